@@ -0,0 +1,64 @@
+"""Бенчмарк конвертации: одна сумма во много валют и пакет пар convert_batch.
+
+Курсы берутся из RateTable (как в CurrencyService), сравниваются поштучный
+цикл по парам, convert_batch на array и, если установлен, на NumPy.
+
+Запуск: python benchmarks/bench_convert.py [--pairs N] [--targets K]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', '0:bench')
+
+from rate_table import CODES, RateTable, convert_batch, np  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pairs', type=int, default=10000, help="пар в пакете")
+    parser.add_argument('--targets', type=int, default=30, help="валют для одной суммы")
+    parser.add_argument('--number', type=int, default=20, help="прогонов")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    table = RateTable(['bench'])
+    table.publish('bench', 0.0, {code: rng.uniform(0.001, 1000) for code in CODES})
+    targets = list(CODES[:args.targets])
+    amounts = [rng.uniform(1, 1000) for _ in range(args.pairs)]
+    from_codes = [rng.choice(CODES) for _ in range(args.pairs)]
+    to_codes = [rng.choice(CODES) for _ in range(args.pairs)]
+
+    def one_by_one():
+        for amount, from_code, to_code in zip(amounts, from_codes, to_codes):
+            table.read('bench', lambda rates: convert_batch(rates, [amount], [from_code], [to_code]))
+
+    cases = [
+        (f"1 → {args.targets} (array)",
+         lambda: table.read('bench', lambda r: convert_batch(r, [100.0], ['EUR'], targets, use_numpy=False)), 1),
+        (f"{args.pairs} пар поштучно", one_by_one, args.pairs),
+        (f"{args.pairs} пар (array)",
+         lambda: table.read('bench', lambda r: convert_batch(r, amounts, from_codes, to_codes, use_numpy=False)),
+         args.pairs),
+    ]
+    if np is not None:
+        cases.append((f"{args.pairs} пар (numpy)",
+                      lambda: table.read('bench', lambda r: convert_batch(r, amounts, from_codes, to_codes,
+                                                                         use_numpy=True)),
+                      args.pairs))
+
+    print(f"{'case':<28} {'ms/run':>10} {'ns/pair':>10}")
+    for name, func, pairs in cases:
+        elapsed = min(timeit.repeat(func, number=args.number, repeat=3)) / args.number
+        print(f"{name:<28} {elapsed * 1e3:>10.3f} {elapsed / pairs * 1e9:>10.0f}")
+    if np is None:
+        print("numpy не установлен — векторизованный путь пропущен")
+    table.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Бенчмарк вычисления выражений: прежний путь (фильтр символов + eval)
+против токенизатора с precedence climbing и переиспользуемых CompiledExpression.
+
+Запуск: python benchmarks/bench_math.py [--number N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from math_parser import MathParser, compile_expression  # noqa: E402
+
+EXPRESSIONS = [
+    "20 + 5",
+    "(20 + 5) * 4",
+    "(10 + 5) * 2 - 8",
+    "1.5к + 2кк",
+    "100 / 4 / 5 * 3 - 2 + 7",
+    "((1 + 2) * (3 + 4)) / (5 - 2)",
+]
+
+
+def legacy_evaluate(parser: MathParser, expression: str):
+    """Прежняя реализация evaluate_expression: строка → фильтр → eval."""
+    clean_expr = parser._clean_expression(expression)
+    clean_expr = re.sub(r'(\d+)кк', r'\1*1000000', clean_expr)
+    clean_expr = re.sub(r'(\d+)к', r'\1*1000', clean_expr)
+    if not all(c in set('0123456789+-*/.() ') for c in clean_expr):
+        return None
+    if clean_expr.count('(') != clean_expr.count(')'):
+        return None
+    if re.search(r'[\+\-\*\/]{2,}', clean_expr):
+        return None
+    if clean_expr and clean_expr[0] in ['+', '*', '/']:
+        return None
+    try:
+        return float(eval(clean_expr, {"__builtins__": {}}, {}))
+    except (ValueError, SyntaxError, ZeroDivisionError, NameError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000, help="прогонов на выражение")
+    args = parser.parse_args()
+
+    math_parser = MathParser()
+    columns = ('eval', 'cold', 'cached', 'reuse')
+    totals = dict.fromkeys(columns, 0.0)
+    print(f"{'expression':<34}" + "".join(f"{c + ' µs':>11}" for c in columns))
+    for expr in EXPRESSIONS:
+        clean = math_parser._clean_expression(expr)
+        compiled = compile_expression(clean)
+        cases = {
+            # eval: прежний путь; cold: токенизация + разбор на каждом вызове;
+            # cached: evaluate_expression с LRU скомпилированных выражений;
+            # reuse: только вычисление готового CompiledExpression
+            'eval': lambda: legacy_evaluate(math_parser, expr),
+            'cold': lambda: compile_expression(clean).evaluate(),
+            'cached': lambda: math_parser.evaluate_expression(expr),
+            'reuse': compiled.evaluate,
+        }
+        row = f"{expr:<34}"
+        for name in columns:
+            elapsed = min(timeit.repeat(cases[name], number=args.number, repeat=3))
+            per_call = elapsed / args.number * 1e6
+            totals[name] += per_call
+            row += f"{per_call:>11.2f}"
+        print(row)
+    print(f"{'mean':<34}" + "".join(f"{totals[c] / len(EXPRESSIONS):>11.2f}" for c in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Микро-бенчмарк разбора сообщений: прежний путь (строковые шаблоны, которые
+re.search компилирует или достаёт из своего кэша на каждом вызове) против
+предкомпилированных регулярок extract_number_and_currency.
+
+Запуск: python benchmarks/bench_parsing.py [--number N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', '0:bench')
+
+from config import CRYPTO_CURRENCIES, CURRENCY_ALIASES, FIAT_CURRENCIES  # noqa: E402
+from currency_service import CurrencyService  # noqa: E402
+
+MESSAGES = [
+    "100$",
+    "$50",
+    "5к руб",
+    "2кк долларов",
+    "1 000 000 рублей",
+    "10,5 евро",
+    "100usd",
+    "USD 25",
+    "0.5 биткоин",
+    "5000 тенге",
+    "скинь мне 300 гривен до пятницы",
+    "(20 + 5) * 4 доллара",
+    "просто текст без чисел",
+    "встречаемся в 18 30 у метро",
+]
+
+
+def legacy_normalize_number(text: str) -> str:
+    """Прежняя реализация normalize_number: цикл re.search + re.sub."""
+    text = re.sub(r'(\d+),(\d+)', r'\1.\2', text)
+    while re.search(r'\d\s+\d', text):
+        text = re.sub(r'(\d)\s+(\d)', r'\1\2', text)
+    return text
+
+
+def legacy_resolve_currency(currency_text: str):
+    """Прежняя реализация resolve_currency: словарь символов и re.sub на каждом вызове."""
+    currency_text = currency_text.lower().strip().strip('.')
+    if currency_text in CURRENCY_ALIASES:
+        return CURRENCY_ALIASES[currency_text]
+    symbols = {
+        '$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'JPY',
+        '₽': 'RUB', '₴': 'UAH', '₸': 'KZT', '₩': 'KRW',
+        '₹': 'INR', '₿': 'BTC', 'Ξ': 'ETH', '💎': 'TON'
+    }
+    if currency_text in symbols:
+        return symbols[currency_text]
+    upper = currency_text.upper()
+    if upper in FIAT_CURRENCIES or upper in CRYPTO_CURRENCIES:
+        return upper
+    base = re.sub(r'[^a-zа-яё]', '', currency_text)
+    if base in CURRENCY_ALIASES:
+        return CURRENCY_ALIASES[base]
+    return None
+
+
+def legacy_extract(cs: CurrencyService, text: str):
+    """Прежняя реализация extract_number_and_currency: математика на каждом
+    сообщении и перебор строковых шаблонов через re.search."""
+    text = text.strip().lower()
+
+    math_result = cs.evaluate_math_expression(text)
+    if math_result:
+        return math_result
+
+    norm_text = legacy_normalize_number(text)
+
+    multiplier = 1
+    if re.search(r'\d\s*[kк]{2}', norm_text):
+        multiplier = 1_000_000
+        norm_text = re.sub(r'(\d)\s*[kк]{2}', r'\1', norm_text)
+    elif re.search(r'\d\s*[kк](?![a-zа-я])', norm_text):
+        multiplier = 1_000
+        norm_text = re.sub(r'(\d)\s*[kк](?![a-zа-я])', r'\1', norm_text)
+
+    patterns = [
+        (r'(\d+(?:[.,]\d+)?)([a-z]{3}|[а-яё.]+)', 'num_first'),
+        (r'(\d+(?:[.,]\d+)?)\s+([а-яё]+)', 'num_first'),
+        (r'(\d+(?:[.,]\d+)?)\s+([a-zа-яё]{1,3})', 'num_first'),
+        (r'([$€£¥₽₴₸₩₹₿Ξ💎])\s*(\d+(?:[.,]\d+)?)', 'sym_first'),
+        (r'(\d+(?:[.,]\d+)?)\s*([$€£¥₽₴₸₩₹₿Ξ💎])', 'num_first'),
+        (r'([a-z]{3})\s+(\d+(?:[.,]\d+)?)', 'code_first'),
+        (r'(\d+(?:[.,]\d+)?)\s+([a-z]{3})', 'num_first'),
+    ]
+
+    for pattern, fmt in patterns:
+        match = re.search(pattern, norm_text)
+        if match:
+            try:
+                if fmt == 'num_first':
+                    number = float(legacy_normalize_number(match.group(1))) * multiplier
+                    currency_text = match.group(2)
+                else:
+                    currency_text = match.group(1)
+                    number = float(legacy_normalize_number(match.group(2))) * multiplier
+
+                currency = legacy_resolve_currency(currency_text)
+                if currency:
+                    return number, currency
+            except ValueError:
+                continue
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000, help="прогонов на сообщение")
+    args = parser.parse_args()
+
+    cs = CurrencyService()
+    columns = ('legacy', 'compiled')
+    totals = dict.fromkeys(columns, 0.0)
+    print(f"{'message':<36}" + "".join(f"{c + ' µs':>13}" for c in columns))
+    for text in MESSAGES:
+        # Оба пути обязаны разбирать сообщение одинаково, иначе сравнение бессмысленно
+        assert legacy_extract(cs, text) == cs.extract_number_and_currency(text), text
+        cases = {
+            'legacy': lambda: legacy_extract(cs, text),
+            'compiled': lambda: cs.extract_number_and_currency(text),
+        }
+        row = f"{text:<36}"
+        for name in columns:
+            elapsed = min(timeit.repeat(cases[name], number=args.number, repeat=3))
+            per_msg = elapsed / args.number * 1e6
+            totals[name] += per_msg
+            row += f"{per_msg:>13.2f}"
+        print(row)
+    print(f"{'mean':<36}" + "".join(f"{totals[c] / len(MESSAGES):>13.2f}" for c in columns))
+
+
+if __name__ == '__main__':
+    main()
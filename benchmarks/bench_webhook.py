@@ -0,0 +1,202 @@
+"""Нагрузочный тест доставки апдейтов: задержка «апдейт → ответ» в polling и webhook.
+
+Локальная заглушка Bot API выдаёт апдейты с заданной частотой: в polling —
+через long-poll getUpdates, в webhook — POST-запросами на create_webhook_app
+(до --connections одновременно, как max_connections у Telegram). Задержка —
+время от появления апдейта до получения заглушкой sendMessage с ответом.
+Хендлер — эхо без обращения к курсам, чтобы мерить только транспорт.
+Заглушка и бот работают в одном event loop, поэтому абсолютные цифры
+завышены одинаково для обоих режимов; сравнивать стоит их соотношение.
+
+Запуск: python benchmarks/bench_webhook.py [--updates N] [--rate R] [--mode polling|webhook|both]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', '0:bench')
+
+from aiohttp import ClientSession, web  # noqa: E402
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.types import Message  # noqa: E402
+
+from bot import create_webhook_app  # noqa: E402
+
+TOKEN = '123456:bench'
+SECRET = 'bench-secret'
+WEBHOOK_PATH = '/webhook'
+
+
+class FakeTelegram:
+    """Минимальный Bot API: getUpdates (long-poll), sendMessage, остальное — ok."""
+
+    def __init__(self):
+        self.updates = []
+        self.new_update = asyncio.Condition()
+        self.sent_at = {}
+        self.replied_at = {}
+        self.all_replied = asyncio.Event()
+        self.expected = 0
+        self.webhook_url = None
+        self.webhook_sem = None
+        self.client = None
+        self.closing = False
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(f'/bot{TOKEN}/{{method}}', self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        params = await request.post()
+        if method == 'getupdates':
+            result = await self._get_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0))
+        elif method == 'sendmessage':
+            result = self._send_message(int(params['chat_id']), params['text'])
+        elif method == 'getme':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, offset: int, timeout: float):
+        def pending():
+            # update_id = позиция в списке + 1
+            return self.updates[max(0, offset - 1):]
+
+        async with self.new_update:
+            if not pending() and not self.closing:
+                try:
+                    await asyncio.wait_for(
+                        self.new_update.wait_for(lambda: pending() or self.closing), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return pending()[:100]
+
+    def _send_message(self, chat_id: int, text: str):
+        seq = int(text.lstrip('#'))
+        self.replied_at[seq] = time.perf_counter()
+        if len(self.replied_at) >= self.expected:
+            self.all_replied.set()
+        return {'message_id': seq, 'date': int(time.time()), 'text': text,
+                'chat': {'id': chat_id, 'type': 'private'}}
+
+    async def emit(self, seq: int):
+        update = {
+            'update_id': seq,
+            'message': {
+                'message_id': seq, 'date': int(time.time()), 'text': f'#{seq}',
+                'chat': {'id': 1000 + seq % 50, 'type': 'private'},
+                'from': {'id': 1000 + seq % 50, 'is_bot': False, 'first_name': 'bench'},
+            },
+        }
+        self.sent_at[seq] = time.perf_counter()
+        if self.webhook_url:
+            asyncio.create_task(self._post_webhook(update))
+        else:
+            async with self.new_update:
+                self.updates.append(update)
+                self.new_update.notify_all()
+
+    async def _post_webhook(self, update):
+        async with self.webhook_sem:
+            async with self.client.post(self.webhook_url, json=update,
+                                        headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as resp:
+                resp.raise_for_status()
+
+    async def release_pollers(self):
+        async with self.new_update:
+            self.closing = True
+            self.new_update.notify_all()
+
+
+async def _start_site(app: web.Application):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    host, port = runner.addresses[0][:2]
+    return runner, f'http://{host}:{port}'
+
+
+def _make_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message()
+    async def echo(message: Message):
+        await message.answer(message.text)
+
+    return dp
+
+
+async def run(mode: str, updates: int, rate: float, connections: int):
+    fake = FakeTelegram()
+    fake.expected = updates
+    fake_runner, api_url = await _start_site(fake.app())
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    dp = _make_dispatcher()
+    bot_runner = polling = None
+
+    if mode == 'webhook':
+        bot_runner, bot_url = await _start_site(create_webhook_app(dp, bot, WEBHOOK_PATH, SECRET))
+        fake.webhook_url = bot_url + WEBHOOK_PATH
+        fake.webhook_sem = asyncio.Semaphore(connections)
+        fake.client = ClientSession()
+    else:
+        polling = asyncio.create_task(dp.start_polling(
+            bot, polling_timeout=10, handle_signals=False, close_bot_session=False))
+        await asyncio.sleep(0.2)  # первый getUpdates
+
+    started = time.perf_counter()
+    for seq in range(1, updates + 1):
+        await fake.emit(seq)
+        delay = started + seq / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    try:
+        await asyncio.wait_for(fake.all_replied.wait(), 30)
+    except asyncio.TimeoutError:
+        print(f"{mode}: получено только {len(fake.replied_at)}/{updates} ответов")
+    elapsed = time.perf_counter() - started
+
+    if polling:
+        await dp.stop_polling()
+        await fake.release_pollers()
+        await polling
+    if fake.client:
+        await fake.client.close()
+    if bot_runner:
+        await bot_runner.cleanup()
+    await bot.session.close()
+    await fake_runner.cleanup()
+
+    latencies = sorted((fake.replied_at[seq] - fake.sent_at[seq]) * 1000 for seq in fake.replied_at)
+    if not latencies:
+        return
+    q = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    print(f"{mode:<8} {len(latencies):>6} {len(latencies) / elapsed:>8.0f} "
+          f"{statistics.mean(latencies):>8.2f} {q[49]:>8.2f} {q[94]:>8.2f} {q[98]:>8.2f} {latencies[-1]:>8.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=2000, help="апдейтов на режим")
+    parser.add_argument('--rate', type=float, default=200, help="апдейтов в секунду")
+    parser.add_argument('--connections', type=int, default=40, help="одновременных webhook-запросов")
+    parser.add_argument('--mode', choices=('polling', 'webhook', 'both'), default='both')
+    args = parser.parse_args()
+
+    print(f"{'mode':<8} {'replies':>6} {'upd/s':>8} {'mean ms':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for mode in (('polling', 'webhook') if args.mode == 'both' else (args.mode,)):
+        await run(mode, args.updates, args.rate, args.connections)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
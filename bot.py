@@ -1,25 +1,40 @@
 import asyncio
 import logging
+import multiprocessing
 import os
-import re
+import signal
+from contextlib import suppress
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
     Message, CallbackQuery, InlineQuery,
     InlineQueryResultArticle, InputTextMessageContent,
 )
 from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 
-from config import BOT_TOKEN, FIAT_CURRENCIES, CRYPTO_CURRENCIES, CURRENCY_ALIASES
+from config import (
+    BOT_TOKEN, BOT_MODE, BOT_WORKERS, TELEGRAM_API_URL, DROP_PENDING_UPDATES,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    ADMIN_IDS, BROADCAST_RATE, BROADCAST_CONCURRENCY, RATES_SNAPSHOT_PATH, USER_CACHE_SIZE, USER_FLUSH_INTERVAL, USER_FLUSH_MAX_PENDING,
+    FIAT_CURRENCIES, CRYPTO_CURRENCIES,
+)
+from broadcast import Broadcaster
+from currency_index import SEARCH_INDEX
 from currency_service import CurrencyService
 from localization import t
+from middlewares import UserContext, UserContextMiddleware
 from keyboards import (
     get_main_menu_keyboard, get_letter_keyboard,
     get_currencies_by_letter_keyboard, get_settings_keyboard,
     get_processing_mode_keyboard, get_back_keyboard, get_help_keyboard,
     get_currency_selection_keyboard, get_api_source_keyboard, get_debug_mode_keyboard,
-    get_language_keyboard, get_appearance_keyboard,
+    get_language_keyboard, get_appearance_keyboard, get_search_results_keyboard,
+    find_currency_page,
 )
 from localization import t
 
@@ -29,13 +44,24 @@ logger = logging.getLogger(__name__)
 # ── Сервисы (инициализируются в lifespan) ─────────────────
 
 class Services:
-    def __init__(self):
-        self.bot = Bot(token=BOT_TOKEN)
+    def __init__(self, worker_id: int = 0):
+        self.worker_id = worker_id
+        shared = BOT_WORKERS > 1
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+        self.bot = Bot(token=BOT_TOKEN, session=session)
         self.dp = Dispatcher()
-        self.currency = CurrencyService()
+        self.currency = CurrencyService(snapshot_path=RATES_SNAPSHOT_PATH, shared=shared)
         # Импорт здесь чтобы избежать циклического
-        from database import UserDatabase
-        self.db = UserDatabase()
+        from database import AsyncUserDatabase
+        # Кэш профилей и буфер записи живут в памяти процесса и не видят записей
+        # других воркеров — с несколькими воркерами каждая запись сразу идёт в SQLite
+        self.db = AsyncUserDatabase(
+            cache_size=0 if shared else USER_CACHE_SIZE,
+            max_pending=0 if shared else USER_FLUSH_MAX_PENDING,
+        )
+        # Рассылки отправляет только первый воркер: лимит BROADCAST_RATE общий на бота
+        self.broadcaster = Broadcaster(self.bot, self.db, rate=BROADCAST_RATE,
+                                       concurrency=BROADCAST_CONCURRENCY, sender=worker_id == 0)
 
     async def close(self):
         await self.currency.close()
@@ -44,42 +70,29 @@ class Services:
 
 services: Services | None = None
 
+FIND_RESULTS_LIMIT = 20
+
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query"]
+
 
 # ── Общая логика конвертации (убирает дублирование) ────────
 
 async def try_extract_currency(text: str, use_w2n: bool = False) -> tuple[float, str] | None:
-    """Попытаться извлечь (число, валюта) из текста."""
-    result = services.currency.extract_number_and_currency(text)
-    if result:
-        return result
-
-    if use_w2n:
-        words_number = services.currency.words_to_number(text)
-        if words_number:
-            for alias, code in CURRENCY_ALIASES.items():
-                if alias in text.lower():
-                    return words_number, code
-
-    if use_w2n:
-        result = services.currency.money_to_number(text)
-        if result:
-            return result
-
-    return None
+    """Попытаться извлечь (число, валюта) из текста (с кэшем разбора)."""
+    return services.currency.parse_message(text, use_w2n)
 
 
 async def format_conversion_response(amount: float, from_currency: str,
-                                     conversions: dict, user_id: int) -> str:
+                                     conversions: dict, user_ctx: UserContext) -> str:
     """Форматировать результат конвертации в строку."""
-    db = services.db
-    prefs = db.get_appearance(user_id)
+    prefs = user_ctx.appearance
     top_flag = services.currency._get_currency_flag(from_currency) if prefs.get('show_flags', True) else ''
     top_code = f" {from_currency}" if prefs.get('show_codes', True) else ''
     response = f"{top_flag}{amount}{top_code}\n\n"
 
     fiat_results = []
     crypto_results = []
-    debug_enabled = db.get_debug_mode(user_id)
+    debug_enabled = user_ctx.debug_mode
 
     for currency, info in conversions.items():
         if isinstance(info, dict):
@@ -105,267 +118,313 @@ async def format_conversion_response(amount: float, from_currency: str,
     return response
 
 
-async def do_conversion(text: str, user_id: int, use_w2n: bool = False) -> str | None:
+async def do_conversion(text: str, user_ctx: UserContext, use_w2n: bool = False) -> str | None:
     """Полный цикл: извлечь → проверить → конвертировать → форматировать."""
-    db = services.db
     result = await try_extract_currency(text, use_w2n)
     if not result:
         return None
 
     amount, from_currency = result
-    selected = db.get_selected_currencies(user_id)
-    targets = selected['fiat'] + selected['crypto']
+    targets = user_ctx.targets
 
     if not targets:
-        return t('no_currencies_selected', db.get_language(user_id))
+        return t('no_currencies_selected', user_ctx.language)
 
     if from_currency in targets:
         targets.remove(from_currency)
 
-    api_source = db.get_api_source(user_id)
-    conversions = await services.currency.convert_currency(amount, from_currency, targets, api_source=api_source)
+    conversions = await services.currency.convert_currency(
+        amount, from_currency, targets, api_source=user_ctx.api_source)
 
     if not conversions:
-        return t('conversion_failed', db.get_language(user_id), amount=amount, from_currency=from_currency)
+        return t('conversion_failed', user_ctx.language, amount=amount, from_currency=from_currency)
 
-    return await format_conversion_response(amount, from_currency, conversions, user_id)
+    return await format_conversion_response(amount, from_currency, conversions, user_ctx)
 
 
 # ── Lifespan ────────────────────────────────────────────────
 
 async def on_startup(svc: Services):
-    logger.info("Запуск бота...")
+    logger.info("Запуск бота (воркер %s)...", svc.worker_id)
+    svc.currency.start_background_refresh()
+    svc.db.start_background_flush(USER_FLUSH_INTERVAL)
+    if svc.worker_id:
+        # Команды, вебхук и рассылки настраивает только первый воркер
+        return
     await svc.bot.set_my_commands([
         types.BotCommand(command="start", description="🚀 Запустить бота"),
         types.BotCommand(command="help", description="📖 Справка и помощь"),
         types.BotCommand(command="settings", description="⚙️ Настройки бота"),
+        types.BotCommand(command="find", description="🔎 Найти валюту"),
         types.BotCommand(command="version", description="📋 Версия бота"),
     ])
     logger.info("Команды бота установлены")
+    resumed = await svc.broadcaster.resume_unfinished()
+    if resumed:
+        logger.info("Продолжено рассылок: %s", resumed)
+    if BOT_WORKERS > 1:
+        # /broadcast, пришедший в другой воркер, только создаёт строку в broadcasts
+        svc.broadcaster.start_watching()
 
 
 async def on_shutdown(svc: Services):
     logger.info("Завершение работы...")
-    svc.db.close()
+    await svc.broadcaster.close()
+    # close() дописывает буфер записи и делает checkpoint WAL
+    await svc.db.close()
     await svc.currency.close()
     await svc.bot.session.close()
 
 
 # ── Хендлеры команд ─────────────────────────────────────────
 
-async def cmd_start(message: Message):
-    lang = services.db.get_language(message.from_user.id)
+async def cmd_start(message: Message, user_ctx: UserContext):
+    lang = user_ctx.language
     await message.answer(t('welcome', lang), reply_markup=get_main_menu_keyboard(lang))
 
 
-async def cmd_help(message: Message):
-    lang = services.db.get_language(message.from_user.id)
+async def cmd_help(message: Message, user_ctx: UserContext):
+    lang = user_ctx.language
     await message.answer(t('help', lang), reply_markup=get_help_keyboard(lang))
 
 
-async def cmd_settings(message: Message):
-    lang = services.db.get_language(message.from_user.id)
+async def cmd_settings(message: Message, user_ctx: UserContext):
+    lang = user_ctx.language
     await message.answer(t('settings', lang), reply_markup=get_settings_keyboard(lang))
 
 
+async def cmd_broadcast(message: Message, command: CommandObject, user_ctx: UserContext):
+    lang = user_ctx.language
+    if user_ctx.user_id not in ADMIN_IDS:
+        await message.answer(t('admin_only', lang))
+        return
+    text = (command.args or "").strip()
+    if not text:
+        await message.answer(t('broadcast_usage', lang))
+        return
+    if await services.broadcaster.start(user_ctx.user_id, text, lang) is None:
+        await message.answer(t('broadcast_busy', lang))
+
+
+async def cmd_find(message: Message, command: CommandObject, user_ctx: UserContext):
+    lang = user_ctx.language
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer(t('find_usage', lang))
+        return
+    results = SEARCH_INDEX.search(query, limit=FIND_RESULTS_LIMIT)
+    if not results:
+        await message.answer(t('find_nothing', lang, query=query))
+        return
+    await message.answer(
+        t('find_results', lang, query=query, count=len(results)),
+        reply_markup=get_search_results_keyboard(results, user_ctx.selected, lang),
+    )
+
+
 async def cmd_version(message: Message):
     await message.answer("🤖 **Бот конвертации валют**\n\nВерсия: 1.0.0", parse_mode="Markdown")
 
 
 # ── Хендлеры callback ───────────────────────────────────────
 
-async def process_settings_callback(callback: CallbackQuery):
-    lang = services.db.get_language(callback.from_user.id)
+async def process_settings_callback(callback: CallbackQuery, user_ctx: UserContext):
+    lang = user_ctx.language
     await callback.message.edit_text(t('settings', lang), reply_markup=get_settings_keyboard(lang))
 
 
-async def process_processing_mode_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    current_mode = services.db.get_processing_mode(user_id)
-    lang = services.db.get_language(callback.from_user.id)
+async def process_processing_mode_callback(callback: CallbackQuery, user_ctx: UserContext):
+    lang = user_ctx.language
     await callback.message.edit_text(
         t('processing_desc', lang),
-        reply_markup=get_processing_mode_keyboard(current_mode, lang),
+        reply_markup=get_processing_mode_keyboard(user_ctx.processing_mode, lang),
         parse_mode=ParseMode.HTML,
     )
 
 
-async def process_currency_selection_callback(callback: CallbackQuery):
-    lang = services.db.get_language(callback.from_user.id)
+async def process_currency_selection_callback(callback: CallbackQuery, user_ctx: UserContext):
+    lang = user_ctx.language
     await callback.message.edit_text(t('choose_type', lang), reply_markup=get_currency_selection_keyboard(lang))
 
 
-async def process_set_mode_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
+async def process_set_mode_callback(callback: CallbackQuery, user_ctx: UserContext):
     mode = callback.data.split("_")[2]
     if mode not in ("simplified", "standard", "advanced"):
         await callback.answer("Некорректный режим")
         return
-    services.db.set_processing_mode(user_id, mode)
-    lang = services.db.get_language(callback.from_user.id)
+    await services.db.set_processing_mode(user_ctx.user_id, mode)
+    user_ctx.processing_mode = mode
+    lang = user_ctx.language
     await callback.answer(t('mode_changed', lang))
     await callback.message.edit_text(t('mode_changed', lang), reply_markup=get_back_keyboard("back_to_settings", lang))
 
 
-async def process_back_to_settings_callback(callback: CallbackQuery):
+async def process_back_to_settings_callback(callback: CallbackQuery, user_ctx: UserContext):
     try:
-        lang = services.db.get_language(callback.from_user.id)
+        lang = user_ctx.language
         await callback.message.edit_text(t('settings', lang), reply_markup=get_settings_keyboard(lang))
     except Exception:
-        await callback.answer(t('already_here', services.db.get_language(callback.from_user.id)))
+        await callback.answer(t('already_here', user_ctx.language))
 
 
-async def process_back_to_main_callback(callback: CallbackQuery):
+async def process_back_to_main_callback(callback: CallbackQuery, user_ctx: UserContext):
     try:
-        lang = services.db.get_language(callback.from_user.id)
+        lang = user_ctx.language
         await callback.message.edit_text(t('welcome', lang), reply_markup=get_main_menu_keyboard(lang))
     except Exception:
-        await callback.answer(t('already_main', services.db.get_language(callback.from_user.id)))
+        await callback.answer(t('already_main', user_ctx.language))
 
 
-async def process_currency_type_callback(callback: CallbackQuery):
+async def process_currency_type_callback(callback: CallbackQuery, user_ctx: UserContext):
     currency_type = callback.data.split("_")[0]
     try:
-        lang = services.db.get_language(callback.from_user.id)
+        lang = user_ctx.language
         text = t('fiat_menu', lang) if currency_type == "fiat" else t('crypto_menu', lang)
         await callback.message.edit_text(text, reply_markup=get_letter_keyboard(currency_type, lang))
     except Exception:
         await callback.answer("Ошибка при загрузке меню")
 
 
-async def process_letter_callback(callback: CallbackQuery):
+async def show_letter_page(callback: CallbackQuery, user_ctx: UserContext,
+                           currency_type: str, letter: str, page: int = 0):
+    """Открыть страницу валют на букву (состояние страницы — в callback_data)."""
+    lang = user_ctx.language
+    await callback.message.edit_text(
+        t('choose_by_letter', lang, letter=letter),
+        reply_markup=get_currencies_by_letter_keyboard(
+            currency_type, letter, user_ctx.selected_codes(currency_type), lang, page),
+    )
+
+
+async def process_letter_callback(callback: CallbackQuery, user_ctx: UserContext):
+    # letter_{type}_{letter}
     parts = callback.data.split("_")
     currency_type = parts[1]
     letter = parts[2]
     try:
-        user_id = callback.from_user.id
-        selected = services.db.get_selected_currencies(user_id)
-        selected_codes = selected['fiat'] if currency_type == 'fiat' else selected['crypto']
-        lang = services.db.get_language(callback.from_user.id)
-        await callback.message.edit_text(
-            t('choose_by_letter', lang, letter=letter),
-            reply_markup=get_currencies_by_letter_keyboard(currency_type, letter, selected_codes, lang),
-        )
+        await show_letter_page(callback, user_ctx, currency_type, letter)
     except Exception:
         await callback.answer("Ошибка при загрузке валют")
 
 
-async def process_select_currency_callback(callback: CallbackQuery):
+async def process_page_callback(callback: CallbackQuery, user_ctx: UserContext):
+    # page_{type}_{letter}_{page}
+    parts = callback.data.split("_")
+    try:
+        await show_letter_page(callback, user_ctx, parts[1], parts[2], int(parts[3]))
+    except Exception:
+        await callback.answer("Ошибка при загрузке валют")
+
+
+async def process_noop_callback(callback: CallbackQuery):
+    await callback.answer()
+
+
+async def process_select_currency_callback(callback: CallbackQuery, user_ctx: UserContext):
+    # select_currency_{type}_{code}_{letter}_{page}
     parts = callback.data.split("_")
     currency_type = parts[2]
     currency_code = parts[3]
 
     try:
-        user_id = callback.from_user.id
-        selected = services.db.get_selected_currencies(user_id)
-        selected_codes = selected['fiat'] if currency_type == 'fiat' else selected['crypto']
+        if len(parts) >= 6:
+            letter, page = parts[4], int(parts[5])
+        else:
+            # Клавиатуры, отправленные до появления страниц, состояние не несут
+            letter, page = find_currency_page(currency_type, currency_code)
+
+        user_id = user_ctx.user_id
+        selected_codes = user_ctx.selected_codes(currency_type)
 
         if currency_code in selected_codes:
-            services.db.remove_selected_currency(user_id, currency_type, currency_code)
+            await services.db.remove_selected_currency(user_id, currency_type, currency_code)
+            selected_codes.remove(currency_code)
             action = "removed"
         else:
-            services.db.add_selected_currency(user_id, currency_type, currency_code)
+            await services.db.add_selected_currency(user_id, currency_type, currency_code)
+            selected_codes.append(currency_code)
             action = "added"
 
         currencies = FIAT_CURRENCIES if currency_type == "fiat" else CRYPTO_CURRENCIES
         currency_name = currencies.get(currency_code, currency_code)
-        lang = services.db.get_language(callback.from_user.id)
+        lang = user_ctx.language
         await callback.answer(t(f'{action}_currency', lang, name=currency_name))
-
-        # Обновляем страницу
-        current_text = callback.message.text
-        letter_match = re.search(r"['\"]([A-ZА-Я])['\"]", current_text)
-        if letter_match:
-            letter = letter_match.group(1)
-            selected = services.db.get_selected_currencies(user_id)
-            selected_codes = selected['fiat'] if currency_type == 'fiat' else selected['crypto']
-            await callback.message.edit_text(
-                t('choose_by_letter', lang, letter=letter),
-                reply_markup=get_currencies_by_letter_keyboard(currency_type, letter, selected_codes, lang),
-            )
+        await show_letter_page(callback, user_ctx, currency_type, letter, page)
     except Exception:
         await callback.answer("Ошибка при изменении валюты")
 
 
-async def process_back_to_letters_callback(callback: CallbackQuery):
+async def process_back_to_letters_callback(callback: CallbackQuery, user_ctx: UserContext):
     currency_type = callback.data.split("_")[3]
     try:
-        lang = services.db.get_language(callback.from_user.id)
+        lang = user_ctx.language
         text = t('fiat_menu', lang) if currency_type == "fiat" else t('crypto_menu', lang)
         await callback.message.edit_text(text, reply_markup=get_letter_keyboard(currency_type, lang))
     except Exception:
         await callback.answer("Ошибка при загрузке меню")
 
 
-async def process_back_callback(callback: CallbackQuery):
+async def process_back_callback(callback: CallbackQuery, user_ctx: UserContext):
     try:
-        lang = services.db.get_language(callback.from_user.id)
+        lang = user_ctx.language
         if callback.data == "back_to_fiat":
             await callback.message.edit_text(t('fiat_menu', lang), reply_markup=get_letter_keyboard("fiat", lang))
         else:
             await callback.message.edit_text(t('crypto_menu', lang), reply_markup=get_letter_keyboard("crypto", lang))
     except Exception:
-        await callback.answer(t('already_here', services.db.get_language(callback.from_user.id)))
+        await callback.answer(t('already_here', user_ctx.language))
 
 
-async def process_api_source_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    current = services.db.get_api_source(user_id)
-    lang = services.db.get_language(callback.from_user.id)
-    await callback.message.edit_text(t('api_choose', lang), reply_markup=get_api_source_keyboard(current, lang))
+async def process_api_source_callback(callback: CallbackQuery, user_ctx: UserContext):
+    lang = user_ctx.language
+    await callback.message.edit_text(t('api_choose', lang), reply_markup=get_api_source_keyboard(user_ctx.api_source, lang))
 
 
-async def process_set_api_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
+async def process_set_api_callback(callback: CallbackQuery, user_ctx: UserContext):
     source = callback.data.split("set_api_")[1]
     if source not in ("auto", "1", "2", "3", "4"):
         await callback.answer("Некорректный источник")
         return
-    services.db.set_api_source(user_id, source)
-    lang = services.db.get_language(callback.from_user.id)
+    await services.db.set_api_source(user_ctx.user_id, source)
+    user_ctx.api_source = source
+    lang = user_ctx.language
     await callback.answer(t('api_changed', lang))
     await callback.message.edit_text(t('api_changed', lang), reply_markup=get_back_keyboard("back_to_settings", lang))
 
 
-async def process_debug_mode_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    enabled = services.db.get_debug_mode(user_id)
-    lang = services.db.get_language(callback.from_user.id)
-    await callback.message.edit_text(t('debug_title', lang), reply_markup=get_debug_mode_keyboard(enabled, lang))
+async def process_debug_mode_callback(callback: CallbackQuery, user_ctx: UserContext):
+    lang = user_ctx.language
+    await callback.message.edit_text(t('debug_title', lang), reply_markup=get_debug_mode_keyboard(user_ctx.debug_mode, lang))
 
 
-async def process_set_debug_mode(callback: CallbackQuery):
-    user_id = callback.from_user.id
+async def process_set_debug_mode(callback: CallbackQuery, user_ctx: UserContext):
     enabled = callback.data == "set_debug_on"
-    services.db.set_debug_mode(user_id, enabled)
-    lang = services.db.get_language(callback.from_user.id)
+    await services.db.set_debug_mode(user_ctx.user_id, enabled)
+    user_ctx.debug_mode = enabled
+    lang = user_ctx.language
     await callback.answer(t('debug_changed', lang))
     await callback.message.edit_text(t('debug_changed', lang), reply_markup=get_back_keyboard("back_to_settings", lang))
 
 
-async def process_language_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    current = services.db.get_language(user_id)
-    lang = services.db.get_language(callback.from_user.id)
-    await callback.message.edit_text(t('lang_choose', lang), reply_markup=get_language_keyboard(current, lang))
+async def process_language_callback(callback: CallbackQuery, user_ctx: UserContext):
+    lang = user_ctx.language
+    await callback.message.edit_text(t('lang_choose', lang), reply_markup=get_language_keyboard(lang, lang))
 
 
-async def process_set_language_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
+async def process_set_language_callback(callback: CallbackQuery, user_ctx: UserContext):
     lang = callback.data.split("set_lang_")[1]
     if lang not in ("ru", "en"):
         await callback.answer("Некорректный язык")
         return
-    services.db.set_language(user_id, lang)
-    new_lang = services.db.get_language(callback.from_user.id)
+    await services.db.set_language(user_ctx.user_id, lang)
+    user_ctx.language = new_lang = lang
     await callback.answer(t('lang_changed', new_lang))
     await callback.message.edit_text(t('lang_changed', new_lang), reply_markup=get_back_keyboard("back_to_settings", new_lang))
 
 
-async def process_appearance_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    prefs = services.db.get_appearance(user_id)
-    lang = services.db.get_language(callback.from_user.id)
+async def process_appearance_callback(callback: CallbackQuery, user_ctx: UserContext):
+    prefs = user_ctx.appearance
+    lang = user_ctx.language
     await callback.message.edit_text(
         t('settings', lang),
         reply_markup=get_appearance_keyboard(
@@ -378,9 +437,8 @@ async def process_appearance_callback(callback: CallbackQuery):
     )
 
 
-async def process_toggle_appearance(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    prefs = services.db.get_appearance(user_id)
+async def process_toggle_appearance(callback: CallbackQuery, user_ctx: UserContext):
+    prefs = user_ctx.appearance
     key_map = {
         "toggle_compact": 'compact',
         "toggle_flags": 'show_flags',
@@ -388,9 +446,9 @@ async def process_toggle_appearance(callback: CallbackQuery):
         "toggle_symbols": 'show_symbols',
     }
     key = key_map[callback.data]
-    services.db.set_appearance(user_id, **{key: not prefs.get(key, False)})
-    prefs = services.db.get_appearance(user_id)
-    lang = services.db.get_language(callback.from_user.id)
+    prefs[key] = not prefs.get(key, False)
+    await services.db.set_appearance(user_ctx.user_id, **{key: prefs[key]})
+    lang = user_ctx.language
     await callback.message.edit_text(
         t('settings', lang),
         reply_markup=get_appearance_keyboard(
@@ -403,44 +461,42 @@ async def process_toggle_appearance(callback: CallbackQuery):
     )
 
 
-async def process_back_to_currency_selection(callback: CallbackQuery):
-    lang = services.db.get_language(callback.from_user.id)
+async def process_back_to_currency_selection(callback: CallbackQuery, user_ctx: UserContext):
+    lang = user_ctx.language
     await callback.message.edit_text(t('choose_type', lang), reply_markup=get_currency_selection_keyboard(lang))
 
 
 # ── Обработчик сообщений ───────────────────────────────────
 
-async def process_message(message: Message):
+async def process_message(message: Message, user_ctx: UserContext):
     try:
         if not message.text or not message.text.strip():
             return
 
-        user_id = message.from_user.id
-        processing_mode = services.db.get_processing_mode(user_id)
+        processing_mode = user_ctx.processing_mode
         text = message.text.strip()
 
         if processing_mode == "simplified":
             if not text[0].isdigit():
                 return
-            result = await do_conversion(text, user_id, use_w2n=False)
+            result = await do_conversion(text, user_ctx, use_w2n=False)
         elif processing_mode == "standard":
-            result = await do_conversion(text, user_id, use_w2n=False)
+            result = await do_conversion(text, user_ctx, use_w2n=False)
         else:  # advanced
-            result = await do_conversion(text, user_id, use_w2n=True)
+            result = await do_conversion(text, user_ctx, use_w2n=True)
 
         if result:
             await message.answer(result)
     except Exception as e:
         logger.error("Error processing message: %s", e)
-        await message.answer(t('error_processing', services.db.get_language(message.from_user.id)))
+        await message.answer(t('error_processing', user_ctx.language))
 
 
 # ── Инлайн хендлер ─────────────────────────────────────────
 
-async def inline_query_handler(inline_query: InlineQuery):
+async def inline_query_handler(inline_query: InlineQuery, user_ctx: UserContext):
     query = (inline_query.query or "").strip()
-    user_id = inline_query.from_user.id
-    lang = services.db.get_language(user_id)
+    lang = user_ctx.language
 
     if not query:
         results = [InlineQueryResultArticle(
@@ -465,8 +521,7 @@ async def inline_query_handler(inline_query: InlineQuery):
             return
 
         amount, from_currency = result
-        selected = services.db.get_selected_currencies(user_id)
-        targets = selected['fiat'] + selected['crypto']
+        targets = user_ctx.targets
 
         if not targets:
             results = [InlineQueryResultArticle(
@@ -480,8 +535,8 @@ async def inline_query_handler(inline_query: InlineQuery):
         if from_currency in targets:
             targets.remove(from_currency)
 
-        api_source = services.db.get_api_source(user_id)
-        conversions = await services.currency.convert_currency(amount, from_currency, targets, api_source=api_source)
+        conversions = await services.currency.convert_currency(
+            amount, from_currency, targets, api_source=user_ctx.api_source)
 
         if not conversions:
             results = [InlineQueryResultArticle(
@@ -493,7 +548,7 @@ async def inline_query_handler(inline_query: InlineQuery):
             await inline_query.answer(results=results, cache_time=300)
             return
 
-        response = await format_conversion_response(amount, from_currency, conversions, user_id)
+        response = await format_conversion_response(amount, from_currency, conversions, user_ctx)
 
         results = [InlineQueryResultArticle(
             id="conversion",
@@ -516,10 +571,18 @@ async def inline_query_handler(inline_query: InlineQuery):
 # ── Регистрация хендлеров ──────────────────────────────────
 
 def register_handlers(dp: Dispatcher):
+    # Профиль пользователя загружается один раз на апдейт и приходит в хендлеры как user_ctx
+    user_ctx_middleware = UserContextMiddleware(services.db)
+    dp.message.middleware(user_ctx_middleware)
+    dp.callback_query.middleware(user_ctx_middleware)
+    dp.inline_query.middleware(user_ctx_middleware)
+
     dp.message.register(cmd_start, Command("start"))
     dp.message.register(cmd_help, Command("help"))
     dp.message.register(cmd_settings, Command("settings"))
     dp.message.register(cmd_version, Command("version"))
+    dp.message.register(cmd_broadcast, Command("broadcast"))
+    dp.message.register(cmd_find, Command("find"))
     dp.message.register(process_message)
 
     dp.callback_query.register(process_settings_callback, lambda c: c.data == "settings")
@@ -530,6 +593,8 @@ def register_handlers(dp: Dispatcher):
     dp.callback_query.register(process_back_to_main_callback, lambda c: c.data == "back_to_main")
     dp.callback_query.register(process_currency_type_callback, lambda c: c.data in ["fiat_currencies", "crypto_currencies"])
     dp.callback_query.register(process_letter_callback, lambda c: c.data.startswith("letter_"))
+    dp.callback_query.register(process_page_callback, lambda c: c.data.startswith("page_"))
+    dp.callback_query.register(process_noop_callback, lambda c: c.data == "noop")
     dp.callback_query.register(process_select_currency_callback, lambda c: c.data.startswith("select_currency_"))
     dp.callback_query.register(process_back_to_letters_callback, lambda c: c.data.startswith("back_to_letters_"))
     dp.callback_query.register(process_back_callback, lambda c: c.data in ["back_to_fiat", "back_to_crypto"])
@@ -550,9 +615,10 @@ def register_handlers(dp: Dispatcher):
 
 def setup_logging():
     os.makedirs('logs', exist_ok=True)
+    process = ' - %(processName)s' if BOT_WORKERS > 1 else ''
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        format=f'%(asctime)s{process} - %(name)s - %(levelname)s - %(message)s',
         handlers=[
             logging.StreamHandler(),
             logging.FileHandler('logs/bot.log', encoding='utf-8'),
@@ -560,22 +626,69 @@ def setup_logging():
     )
 
 
-async def main():
+def create_webhook_app(dp: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH,
+                       secret: str = WEBHOOK_SECRET) -> web.Application:
+    """aiohttp-приложение, принимающее апдейты от Telegram на path.
+
+    Запросы без верного X-Telegram-Bot-Api-Secret-Token получают 401.
+    Апдейт обрабатывается в фоне: Telegram сразу получает 200 и не ждёт
+    ответа хендлера (иначе медленный хендлер задерживает следующие апдейты)."""
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    return app
+
+
+async def run_polling(svc: Services):
+    # getUpdates не работает при выставленном вебхуке — снимаем оставшийся от webhook-режима
+    await svc.bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+    logger.info("Запуск polling...")
+    await svc.dp.start_polling(svc.bot, allowed_updates=ALLOWED_UPDATES, close_bot_session=False)
+
+
+async def run_webhook(svc: Services):
+    runner = web.AppRunner(create_webhook_app(svc.dp, svc.bot))
+    await runner.setup()
+    # Несколько воркеров слушают один порт, соединения между ними распределяет ядро
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=BOT_WORKERS > 1).start()
+    logger.info("Webhook-сервер слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    if svc.worker_id == 0:
+        if WEBHOOK_URL:
+            await svc.bot.set_webhook(
+                WEBHOOK_URL + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=DROP_PENDING_UPDATES,
+            )
+            logger.info("Вебхук установлен: %s%s", WEBHOOK_URL, WEBHOOK_PATH)
+        else:
+            logger.warning("WEBHOOK_URL не задан: вебхук не регистрируется, его должен выставить деплой")
+
+    # Вебхук при остановке не снимаем: Telegram копит апдейты и доставит их после рестарта
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main(worker_id: int = 0):
     global services
-    services = Services()
+    services = Services(worker_id)
 
     register_handlers(services.dp)
 
     await on_startup(services)
 
     try:
-        logger.info("Запуск polling...")
-        await services.dp.start_polling(
-            services.bot,
-            skip_updates=True,
-            allowed_updates=["message", "callback_query", "inline_query"],
-            drop_pending_updates=True,
-        )
+        if BOT_MODE == 'webhook':
+            await run_webhook(services)
+        else:
+            await run_polling(services)
     except KeyboardInterrupt:
         logger.info("Бот остановлен")
     except Exception as e:
@@ -586,6 +699,41 @@ async def main():
         await on_shutdown(services)
 
 
+def _worker_main(worker_id: int):
+    setup_logging()
+    asyncio.run(main(worker_id))
+
+
+def run_workers(count: int):
+    """Запустить count процессов бота за одним webhook-портом и дождаться их.
+
+    Миграции users.db выполняются здесь один раз, до старта воркеров.
+    SIGINT/SIGTERM передаются воркерам, те завершаются штатно (on_shutdown)."""
+    from database import UserDatabase
+    UserDatabase(cache_size=0, max_pending=0).close()
+
+    ctx = multiprocessing.get_context('spawn')
+    workers = [ctx.Process(target=_worker_main, args=(i,), name=f"worker-{i}") for i in range(count)]
+    for worker in workers:
+        worker.start()
+    logger.info("Запущено воркеров: %s", count)
+
+    def stop(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for worker in workers:
+        worker.join()
+        if worker.exitcode:
+            logger.warning("Воркер %s завершился с кодом %s", worker.name, worker.exitcode)
+
+
 if __name__ == "__main__":
     setup_logging()
-    asyncio.run(main())
+    if BOT_WORKERS > 1:
+        run_workers(BOT_WORKERS)
+    else:
+        asyncio.run(main())
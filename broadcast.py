@@ -0,0 +1,265 @@
+"""Рассылка сообщения всем пользователям бота.
+
+Отправка идёт с ограничением скорости (token bucket, общий на все рассылки),
+ограниченным числом одновременных запросов и соблюдением retry_after от
+Telegram. Прогресс сохраняется в таблице broadcasts после каждой страницы
+пользователей — прерванная рассылка продолжается после рестарта.
+
+Одновременно идёт не больше одной рассылки: занятость определяет строка
+со status='running' в общей базе, а не состояние процесса. С несколькими
+воркерами отправляет только один (sender) — лимит скорости остаётся общим;
+остальные лишь создают рассылку, а sender подхватывает её из таблицы.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError,
+    TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+)
+
+from localization import t
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket: в среднем rate операций в секунду, всплеск до capacity.
+
+    Ожидающие обслуживаются по очереди (FIFO через asyncio.Lock)."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (flood control Telegram действует на весь бот).
+        После паузы ведро стартует пустым, без всплеска."""
+        until = self._clock() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self._tokens = 0.0
+            self._updated = until
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = self._clock()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class Broadcaster:
+    """Движок рассылок поверх AsyncUserDatabase.
+
+    Пользователи читаются страницами по batch_size (keyset по user_id),
+    страница отправляется параллельно (не более concurrency запросов,
+    не чаще rate в секунду), затем в базу пишутся last_user_id и счётчики.
+    При рестарте посреди страницы её начало может получить сообщение повторно.
+
+    sender=False — экземпляр только создаёт рассылки, отправляет их экземпляр
+    с sender=True (см. start_watching)."""
+
+    def __init__(self, bot, db, rate: float = 25.0, concurrency: int = 10,
+                 batch_size: int = 200, report_interval: float = 10.0, max_retries: int = 3,
+                 sender: bool = True):
+        self.bot = bot
+        self.db = db
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.report_interval = report_interval
+        self.max_retries = max_retries
+        self.sender = sender
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self, admin_id: int, text: str, lang: str = 'ru') -> Optional[int]:
+        """Создать рассылку, отправить админу статусное сообщение и запустить отправку.
+        None — уже идёт другая рассылка (в любом воркере)."""
+        total = await self.db.count_users()
+        broadcast_id = await self.db.create_broadcast(admin_id, text, total, exclusive=True)
+        if broadcast_id is None:
+            return None
+        try:
+            status = await self.bot.send_message(
+                admin_id, t('broadcast_started', lang, id=broadcast_id, total=total))
+            await self.db.update_broadcast(
+                broadcast_id, status_chat_id=status.chat.id, status_message_id=status.message_id)
+        except TelegramAPIError as e:
+            logger.warning("Не удалось отправить статус рассылки #%s: %s", broadcast_id, e)
+        if self.sender:
+            self._spawn(broadcast_id)
+        return broadcast_id
+
+    async def resume_unfinished(self) -> int:
+        """Запустить незавершённые рассылки, которые ещё не отправляются этим
+        экземпляром: прерванные остановкой бота или созданные другим воркером."""
+        resumed = 0
+        for broadcast in await self.db.get_unfinished_broadcasts():
+            if broadcast['id'] in self._tasks:
+                continue
+            logger.info("Запуск рассылки #%s с user_id > %s (%s/%s)",
+                        broadcast['id'], broadcast['last_user_id'],
+                        broadcast['sent'] + broadcast['failed'], broadcast['total'])
+            self._spawn(broadcast['id'])
+            resumed += 1
+        return resumed
+
+    def start_watching(self, interval: float = 2.0):
+        """Периодически подхватывать рассылки, созданные другими воркерами.
+        Вызывается у sender из on_startup, когда уже есть работающий event loop."""
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_loop(interval))
+
+    async def _watch_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.resume_unfinished()
+            except Exception as e:
+                logger.warning("Не удалось проверить новые рассылки: %s", e)
+
+    async def close(self):
+        """Остановить рассылки; сохранённый прогресс позволит продолжить их позже."""
+        if self._watch_task:
+            self._watch_task.cancel()
+            self._watch_task = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, broadcast_id: int):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    # ── Отправка ─────────────────────────────────────────────
+
+    async def _run(self, broadcast_id: int):
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if broadcast is None:
+            return
+        lang = await self.db.get_language(broadcast['admin_id'])
+        sent, failed = broadcast['sent'], broadcast['failed']
+        after = broadcast['last_user_id']
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        done_at_start = sent + failed
+        last_report = started
+
+        try:
+            while True:
+                page = await self.db.fetch_users_page(after, self.batch_size, ['user_id'])
+                if not page:
+                    break
+                results = await asyncio.gather(
+                    *(self._deliver(semaphore, user['user_id'], broadcast['text']) for user in page))
+                delivered = sum(results)
+                sent += delivered
+                failed += len(results) - delivered
+                after = page[-1]['user_id']
+                await self.db.update_broadcast(broadcast_id, last_user_id=after, sent=sent, failed=failed)
+
+                now = time.monotonic()
+                if now - last_report >= self.report_interval:
+                    last_report = now
+                    await self._report(broadcast, self._progress_text(
+                        broadcast, lang, sent, failed, now - started, sent + failed - done_at_start))
+        except asyncio.CancelledError:
+            logger.info("Рассылка #%s приостановлена на user_id %s", broadcast_id, after)
+            raise
+        except Exception as e:
+            logger.error("Рассылка #%s прервана: %s", broadcast_id, e)
+            await self.db.update_broadcast(broadcast_id, status='failed')
+            await self._report(broadcast, t('broadcast_failed', lang, id=broadcast_id, error=e))
+            return
+
+        elapsed = time.monotonic() - started
+        await self.db.update_broadcast(broadcast_id, status='done')
+        logger.info("Рассылка #%s завершена за %.1f с: доставлено %s, ошибок %s",
+                    broadcast_id, elapsed, sent, failed)
+        await self._report(broadcast, t('broadcast_done', lang, id=broadcast_id, sent=sent,
+                                         failed=failed, elapsed=_format_duration(elapsed)))
+
+    async def _deliver(self, semaphore: asyncio.Semaphore, chat_id: int, text: str) -> bool:
+        """Отправить одно сообщение. True — доставлено, False — получатель недоступен."""
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.bucket.acquire()
+                try:
+                    await self.bot.send_message(chat_id, text)
+                    return True
+                except TelegramRetryAfter as e:
+                    logger.warning("Flood control: пауза %s с", e.retry_after)
+                    self.bucket.pause(e.retry_after)
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    # Бот заблокирован, чат удалён и т.п. — повтор не поможет
+                    logger.debug("Рассылка: %s недоступен: %s", chat_id, e)
+                    return False
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    logger.debug("Рассылка: ошибка отправки %s (попытка %s): %s", chat_id, attempt + 1, e)
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                except TelegramAPIError as e:
+                    logger.warning("Рассылка: %s: %s", chat_id, e)
+                    return False
+            return False
+
+    # ── Отчёты ───────────────────────────────────────────────
+
+    @staticmethod
+    def _progress_text(broadcast: Dict, lang: str, sent: int, failed: int,
+                       elapsed: float, done_this_run: int) -> str:
+        done = sent + failed
+        total = max(broadcast['total'], done)
+        rate = done_this_run / elapsed if elapsed > 0 else 0.0
+        eta = _format_duration((total - done) / rate) if rate > 0 else '—'
+        return t('broadcast_progress', lang, id=broadcast['id'], done=done, total=total,
+                 percent=round(100 * done / total) if total else 100,
+                 sent=sent, failed=failed, rate=f"{rate:.1f}", eta=eta)
+
+    async def _report(self, broadcast: Dict, text: str):
+        """Обновить статусное сообщение у администратора."""
+        logger.info("%s", text.replace("\n", " | "))
+        row = await self.db.get_broadcast(broadcast['id'])
+        if not row or not row['status_message_id']:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=row['status_chat_id'], message_id=row['status_message_id'])
+        except TelegramAPIError as e:
+            logger.debug("Не удалось обновить статус рассылки #%s: %s", broadcast['id'], e)
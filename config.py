@@ -1,4 +1,5 @@
 import os
+import re
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,6 +9,33 @@ BOT_TOKEN = os.environ.get('BOT_TOKEN')
 if not BOT_TOKEN:
     raise SystemExit("BOT_TOKEN not set in environment/.env")
 
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling').strip().lower()
+if BOT_MODE not in ('polling', 'webhook'):
+    raise SystemExit(f"BOT_MODE must be 'polling' or 'webhook', got {BOT_MODE!r}")
+
+# Webhook: публичный адрес, который Telegram будет вызывать (https://bot.example.com),
+# путь на локальном сервере и секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+if BOT_MODE == 'webhook' and not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', WEBHOOK_SECRET):
+    raise SystemExit("WEBHOOK_SECRET must be 1-256 chars of A-Z, a-z, 0-9, _ and - in webhook mode")
+
+# Воркеры: BOT_WORKERS процессов слушают один WEBHOOK_PORT (SO_REUSEPORT) и делят
+# снимок курсов RATES_SNAPSHOT_PATH; polling с несколькими процессами невозможен
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+if BOT_WORKERS > 1 and BOT_MODE != 'webhook':
+    raise SystemExit("BOT_WORKERS > 1 requires BOT_MODE=webhook")
+
+# Сбрасывать ли накопившиеся апдейты при старте (по умолчанию — обработать их)
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', '0').lower() in ('1', 'true', 'yes')
+
+# Свой Bot API сервер (telegram-bot-api или локальная заглушка для бенчмарков)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '').rstrip('/')
+
 # Admin IDs (comma-separated list)
 ADMIN_IDS = [int(x.strip()) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip()]
 
@@ -25,6 +53,16 @@ FRANKFURTER_BASE_URL = "https://api.frankfurter.dev/v2"
 # НБРБ API (белорусский источник)
 NBRB_BASE_URL = "https://www.nbrb.by/api"
 
+# CoinGecko simple/price — курсы крипты: все монеты COINGECKO_IDS одним запросом.
+# URL переопределяется для локальной заглушки; ключ демо-тарифа необязателен
+COINGECKO_BASE_URL = os.getenv('COINGECKO_BASE_URL', 'https://api.coingecko.com/api/v3').rstrip('/')
+COINGECKO_API_KEY = os.getenv('COINGECKO_API_KEY')
+# Курсы крипты устаревают быстрее фиатных (у тех — 10 минут)
+CRYPTO_CACHE_TIMEOUT = int(os.getenv('CRYPTO_CACHE_TIMEOUT', '60'))
+
+# Снимок последних удачных курсов на диске (переживает перезапуск бота)
+RATES_SNAPSHOT_PATH = os.getenv('RATES_SNAPSHOT_PATH', 'data/rates.json')
+
 # Supported currencies
 FIAT_CURRENCIES = {
     'USD': '🇺🇸 USD', 'EUR': '🇪🇺 EUR', 'GBP': '🇬🇧 GBP', 'JPY': '🇯🇵 JPY',
@@ -76,6 +114,17 @@ CRYPTO_CURRENCIES = {
     'FRAX': '💎 FRAX', 'LUSD': '💎 LUSD', 'TON': '💎 TON'
 }
 
+# Идентификаторы монет CRYPTO_CURRENCIES в CoinGecko
+COINGECKO_IDS = {
+    'BTC': 'bitcoin', 'ETH': 'ethereum', 'USDT': 'tether', 'USDC': 'usd-coin',
+    'BNB': 'binancecoin', 'ADA': 'cardano', 'SOL': 'solana', 'DOT': 'polkadot',
+    'MATIC': 'matic-network', 'LINK': 'chainlink', 'UNI': 'uniswap', 'AVAX': 'avalanche-2',
+    'ATOM': 'cosmos', 'LTC': 'litecoin', 'BCH': 'bitcoin-cash', 'XRP': 'ripple',
+    'DOGE': 'dogecoin', 'SHIB': 'shiba-inu', 'TRX': 'tron', 'XLM': 'stellar',
+    'DAI': 'dai', 'BUSD': 'binance-usd', 'TUSD': 'true-usd', 'GUSD': 'gemini-dollar',
+    'FRAX': 'frax', 'LUSD': 'liquity-usd', 'TON': 'the-open-network'
+}
+
 # Currency aliases and slang
 CURRENCY_ALIASES = {
     # Fiat currencies
@@ -256,6 +305,25 @@ API_PRIORITY = {
     'exchangerate': 4,
 }
 
+# Hedged-запросы: если источник не ответил за HEDGE_DELAY_MS, параллельно
+# запускается следующий по приоритету, побеждает первый удачный ответ
+HEDGE_DELAY_MS = int(os.getenv('HEDGE_DELAY_MS', '300'))
+
+# Кэш результатов разбора сообщений (одинаковые "100$", "5к руб" в чатах и инлайне)
+PARSE_CACHE_SIZE = int(os.getenv('PARSE_CACHE_SIZE', '10000'))
+
+# LRU-кэш профилей пользователей перед SQLite (write-through)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+
+# Буфер записи пользователей: сброс одной транзакцией раз в USER_FLUSH_INTERVAL
+# секунд или при USER_FLUSH_MAX_PENDING изменённых профилях (0 — коммит на каждую запись)
+USER_FLUSH_INTERVAL = float(os.getenv('USER_FLUSH_INTERVAL', '1.0'))
+USER_FLUSH_MAX_PENDING = int(os.getenv('USER_FLUSH_MAX_PENDING', '500'))
+
+# Рассылки (/broadcast): лимит Telegram — около 30 сообщений в секунду на бота
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))
+
 # Processing modes
 PROCESSING_MODES = {
     'simplified': 'Упрощенный режим',
@@ -0,0 +1,147 @@
+"""Предрасчитанные индексы валют для поиска в тексте.
+
+Строятся один раз при импорте из config и ищут за один проход по сообщению,
+вместо регулярки на каждый алиас и код.
+"""
+
+import re
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import CURRENCY_ALIASES, FIAT_CURRENCIES, CRYPTO_CURRENCIES
+
+# Символы, считающиеся частью слова при проверке границ: [a-zа-яё]
+_WORD_CHARS = frozenset(
+    [chr(c) for c in range(ord('a'), ord('z') + 1)]
+    + [chr(c) for c in range(ord('а'), ord('я') + 1)]
+    + ['ё']
+)
+_LATIN_RUN_RE = re.compile(r'[a-z]+')
+_NAME_WORD_RE = re.compile(r'[^\W\d_]+')
+_END = ''  # ключ терминального узла в trie
+
+
+class AliasTrie:
+    """Trie алиасов валют с поиском самого длинного алиаса, стоящего
+    отдельным словом. При равной длине побеждает алиас, объявленный
+    в словаре раньше — как при сортировке CURRENCY_ALIASES по длине."""
+
+    def __init__(self, aliases: Dict[str, str], min_length: int = 2):
+        self._root: Dict[str, dict] = {}
+        for rank, (alias, code) in enumerate(aliases.items()):
+            if len(alias) < min_length:
+                continue
+            node = self._root
+            for char in alias:
+                node = node.setdefault(char, {})
+            node[_END] = (len(alias), rank, code)
+
+    def find_longest(self, text: str) -> Optional[str]:
+        """Код валюты для самого длинного алиаса в text (ожидается lower-case)."""
+        best = None
+        length = len(text)
+        for start in range(length):
+            # Алиас может начинаться только на границе слова
+            if start and text[start - 1] in _WORD_CHARS:
+                continue
+            node = self._root
+            pos = start
+            while pos < length:
+                node = node.get(text[pos])
+                if node is None:
+                    break
+                pos += 1
+                entry = node.get(_END)
+                if entry and (pos == length or text[pos] not in _WORD_CHARS):
+                    if best is None or (entry[0], -entry[1]) > (best[0], -best[1]):
+                        best = entry
+        return best[2] if best else None
+
+
+class CodeIndex:
+    """Поиск кодов валют (usd, btc...) отдельными латинскими токенами.
+    При нескольких кодах побеждает первый по порядку объявления в config."""
+
+    def __init__(self, codes: Iterable[str]):
+        self._ranks: Dict[str, tuple] = {}
+        for rank, code in enumerate(codes):
+            self._ranks.setdefault(code.lower(), (rank, code))
+
+    def find_first(self, text: str) -> Optional[str]:
+        """Код валюты, встречающийся в text (ожидается lower-case) как токен."""
+        best = None
+        for token in _LATIN_RUN_RE.findall(text):
+            entry = self._ranks.get(token)
+            if entry and (best is None or entry[0] < best[0]):
+                best = entry
+        return best[1] if best else None
+
+
+class CurrencySearchIndex:
+    """Поиск валют по коду, названию и алиасам для /find.
+
+    Ключи (в нижнем регистре) лежат в отсортированном списке: префиксный
+    поиск — bisect + проход по диапазону совпадений, поиск подстроки —
+    проход по уникальным ключам, только если префиксных совпадений мало.
+    Порядок результатов: точный код, префикс кода, префикс названия/алиаса,
+    подстрока; внутри группы — порядок объявления в config."""
+
+    def __init__(self, currencies: Dict[str, Dict[str, str]], aliases: Dict[str, str]):
+        self._types: Dict[str, str] = {}
+        self._ranks: Dict[str, int] = {}
+        codes_by_key: Dict[str, Dict[str, bool]] = {}  # ключ → {код: это код валюты?}
+
+        def add(key: str, code: str, is_code: bool = False):
+            entry = codes_by_key.setdefault(key, {})
+            entry[code] = entry.get(code, False) or is_code
+
+        for currency_type, items in currencies.items():
+            for code, name in items.items():
+                self._types.setdefault(code, currency_type)
+                self._ranks.setdefault(code, len(self._ranks))
+                add(code.lower(), code, is_code=True)
+                for word in _NAME_WORD_RE.findall(name.lower()):
+                    add(word, code)
+        for alias, code in aliases.items():
+            if code in self._types:
+                add(alias.lower(), code)
+
+        self._keys: List[str] = sorted(codes_by_key)
+        self._entries: Dict[str, Tuple[Tuple[str, bool], ...]] = {
+            key: tuple(codes.items()) for key, codes in codes_by_key.items()
+        }
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[str, str]]:
+        """[(тип, код)] лучших совпадений для query."""
+        query = query.strip().lower()
+        if not query or limit <= 0:
+            return []
+        scores: Dict[str, int] = {}
+
+        def offer(code: str, score: int):
+            if score < scores.get(code, 4):
+                scores[code] = score
+
+        pos = bisect_left(self._keys, query)
+        while pos < len(self._keys) and self._keys[pos].startswith(query):
+            key = self._keys[pos]
+            for code, is_code in self._entries[key]:
+                if is_code:
+                    offer(code, 0 if key == query else 1)
+                else:
+                    offer(code, 2)
+            pos += 1
+
+        if len(scores) < limit and len(query) >= 2:
+            for key in self._keys:
+                if query in key and not key.startswith(query):
+                    for code, _ in self._entries[key]:
+                        offer(code, 3)
+
+        ranked = sorted(scores, key=lambda code: (scores[code], self._ranks[code]))
+        return [(self._types[code], code) for code in ranked[:limit]]
+
+
+ALIAS_INDEX = AliasTrie(CURRENCY_ALIASES)
+CODE_INDEX = CodeIndex(list(FIAT_CURRENCIES) + list(CRYPTO_CURRENCIES))
+SEARCH_INDEX = CurrencySearchIndex({'fiat': FIAT_CURRENCIES, 'crypto': CRYPTO_CURRENCIES}, CURRENCY_ALIASES)
@@ -1,39 +1,168 @@
+import asyncio
 import httpx
+import json
+import os
 import re
 import logging
+import tempfile
 import time
-from typing import Dict, List, Optional, Tuple
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
 from config import (
     CURRENCY_FREAKS_API_KEY, CURRENCY_FREAKS_BASE_URL,
     EXCHANGE_RATE_API_KEY, EXCHANGE_RATE_BASE_URL,
-    NBRB_BASE_URL, FRANKFURTER_BASE_URL, API_PRIORITY,
+    NBRB_BASE_URL, FRANKFURTER_BASE_URL, API_PRIORITY, HEDGE_DELAY_MS, PARSE_CACHE_SIZE,
+    COINGECKO_BASE_URL, COINGECKO_API_KEY, COINGECKO_IDS, CRYPTO_CACHE_TIMEOUT,
     FIAT_CURRENCIES, CRYPTO_CURRENCIES, CURRENCY_ALIASES
 )
 from word2number import w2n
+from currency_index import ALIAS_INDEX, CODE_INDEX
+from lru_cache import LRUCache
 from math_parser import MathParser
+from rate_table import RateTable, batch_length, convert_batch
+
+try:
+    import fcntl
+except ImportError:  # Windows: общий снимок для нескольких процессов недоступен
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+# Провайдер курсов крипты: отдельный от фиатной цепочки, со своим TTL
+CRYPTO_PROVIDER = 'coingecko'
+_CRYPTO_CODES = frozenset(CRYPTO_CURRENCIES)
+
+CURRENCY_SYMBOLS = {
+    '$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'JPY',
+    '₽': 'RUB', '₴': 'UAH', '₸': 'KZT', '₩': 'KRW',
+    '₹': 'INR', '₿': 'BTC', 'Ξ': 'ETH', '💎': 'TON'
+}
+
+# ── Скомпилированные регулярки разбора сообщений ─────────────
+# Компилируются один раз при импорте, а не ищутся в кэше модуля re на каждом вызове
+
+_NUM = r'(\d+(?:[.,]\d+)?)'
+_SYM = '([' + ''.join(CURRENCY_SYMBOLS) + '])'
+
+_HAS_DIGIT_RE = re.compile(r'\d')
+_HAS_MATH_OP_RE = re.compile(r'[+\-*/×÷⋅]')
+_DECIMAL_COMMA_RE = re.compile(r'(\d+),(\d+)')
+# Пробелы между цифрами (1 000 000 → 1000000) убираются за один проход
+_DIGIT_SPACE_RE = re.compile(r'(?<=\d)\s+(?=\d)')
+_MILLION_SUFFIX_RE = re.compile(r'(\d)\s*[kк]{2}')
+_THOUSAND_SUFFIX_RE = re.compile(r'(\d)\s*[kк](?![a-zа-я])')
+_NON_LETTER_RE = re.compile(r'[^a-zа-яё]')
+
+# Порядок важен: шаблоны пробуются по очереди, побеждает первый,
+# у которого найденная валюта распознаётся
+_AMOUNT_PATTERNS = (
+    # Слипшиеся: "15usd", "1бр.", "100eur"
+    (re.compile(_NUM + r'([a-z]{3}|[а-яё.]+)'), 1, 2),
+    # "5 долларов", "10.5 евро"
+    (re.compile(_NUM + r'\s+([а-яё]+)'), 1, 2),
+    # Короткие алиасы: "1 tg", "5 р", "10 тг"
+    (re.compile(_NUM + r'\s+([a-zа-яё]{1,3})'), 1, 2),
+    # "$5", "€10.5"
+    (re.compile(_SYM + r'\s*' + _NUM), 2, 1),
+    # "5$", "10.5€"
+    (re.compile(_NUM + r'\s*' + _SYM), 1, 2),
+    # "USD 5"
+    (re.compile(r'([a-z]{3})\s+' + _NUM), 2, 1),
+    # "5 USD"
+    (re.compile(_NUM + r'\s+([a-z]{3})'), 1, 2),
+)
+
 
 class CurrencyService:
-    """Сервис конвертации валют. Frankfurter — основной источник курсов для фиата.
-    НБРБ, CurrencyFreaks и ExchangeRate-API — фоллбек для крипты и валют вне Frankfurter."""
+    """Сервис конвертации валют. Frankfurter — основной источник курсов для фиата,
+    НБРБ, CurrencyFreaks и ExchangeRate-API — фоллбек для валют вне Frankfurter.
+    Крипту отдельно отдаёт CoinGecko: его курсы накладываются на фиатный снимок."""
 
-    def __init__(self):
+    def __init__(self, snapshot_path: Optional[str] = None, shared: bool = False):
         self.currencyfreaks_api_key = CURRENCY_FREAKS_API_KEY
         self.currencyfreaks_base_url = CURRENCY_FREAKS_BASE_URL
         self.exchangerate_api_key = EXCHANGE_RATE_API_KEY
         self.exchangerate_base_url = EXCHANGE_RATE_BASE_URL
         self.nbrb_base_url = NBRB_BASE_URL
         self.frankfurter_base_url = FRANKFURTER_BASE_URL
+        self.coingecko_base_url = COINGECKO_BASE_URL
+        self.coingecko_api_key = COINGECKO_API_KEY
         self.math_parser = MathParser()
+        # (нормализованный текст, use_w2n) → (число, валюта) или None
+        self.parse_cache = LRUCache(PARSE_CACHE_SIZE)
 
+        # Один снимок курсов на провайдера, всегда с базой USD:
+        # {provider: (timestamp, {code: единиц за 1 USD})}.
+        # Курсы для любой другой базы и кросс-курсы выводятся из снимка.
         self.rates_cache: Dict[str, Tuple[float, Dict]] = {}
+        # Какой провайдер последним обслужил данный api_source ('auto', '1'..'4')
+        self._source_map: Dict[str, str] = {}
         self.cache_timeout = 600  # 10 минут
-        self.api_failures = {'currencyfreaks': 0, 'exchangerate': 0, 'nbrb': 0, 'frankfurter': 0}
+        self.api_failures = {'currencyfreaks': 0, 'exchangerate': 0, 'nbrb': 0, 'frankfurter': 0,
+                             CRYPTO_PROVIDER: 0}
+        # Снимок крипты (rates_cache[CRYPTO_PROVIDER]) — все монеты одним запросом,
+        # живёт crypto_cache_timeout. Запрашивается, только когда в конвертации
+        # участвует крипта; горячим считается hot_key_ttl после последней такой
+        self.crypto_cache_timeout = CRYPTO_CACHE_TIMEOUT
+        self.crypto_refresh_ahead = 10
+        # Сколько конвертация ждёт CoinGecko, если курсов крипты ещё нет совсем;
+        # запрос при этом не отменяется и доезжает в кэш для следующих сообщений
+        self.crypto_cold_timeout = 3.0
+        self._crypto_used_at = 0.0
         self.max_failures = 3
+        # Circuit breaker: после max_failures ошибок подряд источник пропускается
+        # breaker_cooldown секунд, затем допускается одна пробная попытка (half-open)
+        self.breaker_cooldown = 60
+        self._opened_at: Dict[str, float] = {}
         self._session: Optional[httpx.AsyncClient] = None
 
+        # Single-flight: один запрос на провайдер, с которого начинается цепочка
+        # (у 'auto' и '1' это один и тот же frankfurter), остальные ждут ту же задачу
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.fetch_stats = {'fetches': 0, 'coalesced': 0, 'stale_served': 0, 'hedged': 0,
+                            'shared_hits': 0, 'lease_waits': 0}
+
+        # Hedging: через hedge_delay секунд без ответа стартует следующий источник.
+        # None — строго последовательный обход цепочки.
+        self.hedge_delay: Optional[float] = HEDGE_DELAY_MS / 1000
+        self.provider_stats: Dict[str, Dict[str, float]] = {
+            name: {'calls': 0, 'failures': 0, 'cancelled': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            for name in self.api_failures
+        }
+
+        # Stale-while-revalidate: источники, которые недавно запрашивали, обновляются
+        # фоновой задачей за refresh_ahead секунд до истечения кэша
+        self.refresh_ahead = 60
+        self.hot_key_ttl = 3600
+        self._hot_keys: Dict[str, float] = {}
+        self._refresher_task: Optional[asyncio.Task] = None
+        self._background_tasks: set = set()
+
+        # Снимок на диске: загружается при старте, перезаписывается после каждого обновления.
+        # Записи идут по очереди, каждая — с актуальным состоянием кэша
+        self.snapshot_path = snapshot_path
+        self._save_lock = asyncio.Lock()
+        # Режим воркеров (shared): курсы общие для нескольких процессов. Ходит
+        # в API только владелец flock на <snapshot>.lock, остальные подхватывают
+        # его снимок из общей таблицы (проверка — не чаще snapshot_check_interval)
+        self.shared = shared
+        if shared and (not snapshot_path or fcntl is None):
+            raise ValueError("shared mode needs snapshot_path and fcntl (POSIX)")
+        self.snapshot_check_interval = 1.0
+        self._snapshot_checked_at = 0.0
+        self.lease_poll_interval = 0.05
+        self.lease_timeout = 30.0
+        # Курсы провайдеров в компактной таблице: конвертация читает их прямо
+        # из mmap. У воркеров таблица лежит в файле и общая для всех процессов
+        self.rate_table = RateTable(tuple(self.api_failures),
+                                    path=f"{snapshot_path}.table" if shared else None)
+        # Метка времени снимка, который этот процесс уже видел в таблице, по провайдерам
+        self._published: Dict[str, float] = {}
+        if snapshot_path:
+            self._load_snapshot()
+
     # ── HTTP session ──────────────────────────────────────────
 
     async def _get_session(self) -> httpx.AsyncClient:
@@ -43,42 +172,492 @@ class CurrencyService:
         return self._session
 
     async def close(self):
+        if self._refresher_task:
+            self._refresher_task.cancel()
+            self._refresher_task = None
+        for task in [*self._background_tasks, *self._inflight.values()]:
+            task.cancel()
         if self._session:
             await self._session.aclose()
+        self.rate_table.close()
+
+    def get_fetch_stats(self) -> Dict[str, int]:
+        """Счётчики запросов к API: fetches — реальные походы в цепочку,
+        coalesced — вызовы, дождавшиеся чужого in-flight запроса,
+        stale_served — ответы устаревшими курсами на время фонового обновления,
+        hedged — сколько раз запускался запасной источник по истечении hedge_delay,
+        shared_hits — обновления, которые в режиме воркеров сделал другой процесс,
+        lease_waits — сколько раз аренда снимка была занята другим процессом."""
+        return dict(self.fetch_stats)
+
+    def get_provider_stats(self) -> Dict[str, Dict[str, float]]:
+        """Задержки и ошибки по провайдерам — для подбора hedge_delay.
+        cancelled — запросы, отменённые после победы другого источника."""
+        stats = {}
+        for name, s in self.provider_stats.items():
+            completed = s['calls'] - s['cancelled']
+            stats[name] = {
+                'calls': s['calls'],
+                'failures': s['failures'],
+                'cancelled': s['cancelled'],
+                'avg_ms': round(s['total_ms'] / completed, 1) if completed else 0.0,
+                'max_ms': round(s['max_ms'], 1),
+                'circuit': self._circuit_state(name),
+            }
+        return stats
 
     # ── API: получение курсов ────────────────────────────────
 
     async def get_rates(self, base_currency: str = 'USD', api_source: str = 'auto'
                         ) -> Tuple[Dict, str]:
         """Получить курсы. Возвращает (rates, source).
-        api_source: 'auto' | '1' (НБРБ) | '2' (Frankfurter) | '3' (CurrencyFreaks) | '4' (ExchangeRate)"""
-        cache_key = f"{api_source}:{base_currency}"
-        cached = self.rates_cache.get(cache_key)
+        api_source: 'auto' | '1' (Frankfurter) | '2' (НБРБ) | '3' (CurrencyFreaks) | '4' (ExchangeRate)
+
+        Курсы берутся из USD-снимка провайдера и пересчитываются в base_currency.
+        После истечения cache_timeout возвращаются последние удачные курсы
+        с источником вида 'stale:<провайдер>:<возраст>s', а обновление уходит в фон."""
+        snapshot = await self._get_snapshot(api_source)
+        if snapshot is None:
+            logger.warning("Все API недоступны для базы %s", base_currency)
+            return {}, 'unavailable'
+        rates, source = snapshot
+        rebased = self._rebase(rates, base_currency)
+        if rebased is None:
+            logger.warning("Нет курса %s в снимке %s", base_currency, source)
+            return {}, 'unavailable'
+        return rebased, source
+
+    async def get_cross_rate(self, from_currency: str, to_currency: str,
+                             api_source: str = 'auto') -> Optional[float]:
+        """Курс from → to (сколько to за 1 from) из одного USD-снимка за O(1)."""
+        snapshot = await self._get_snapshot(api_source)
+        if snapshot is None:
+            return None
+        rates = snapshot[0]
+        from_rate = rates.get(from_currency)
+        to_rate = rates.get(to_currency)
+        if not from_rate or to_rate is None:
+            return None
+        return float(to_rate) / float(from_rate)
+
+    async def _get_snapshot(self, api_source: str) -> Optional[Tuple[Dict, str]]:
+        """USD-снимок для api_source: (rates, source) или None, если API недоступны."""
+        entry = await self._get_snapshot_entry(api_source)
+        return entry[1:] if entry else None
+
+    async def _get_snapshot_entry(self, api_source: str) -> Optional[Tuple[str, Dict, str]]:
+        """То же, что _get_snapshot, плюс имя провайдера: (name, rates, source)."""
+        now = time.time()
+        self._hot_keys[api_source] = now
+        if self.shared:
+            self._sync_snapshot()
+        cached = self._cached_snapshot(api_source)
         if cached:
-            cache_time, rates = cached
-            if (time.time() - cache_time) < self.cache_timeout:
-                logger.debug("Используем кэшированные курсы (база: %s)", base_currency)
-                return rates, f"cache:{api_source}"
+            name, cache_time, rates = cached
+            age = now - cache_time
+            if age < self.cache_timeout:
+                logger.debug("Используем кэшированные курсы %s", name)
+                return name, rates, f"cache:{name}"
+            self.fetch_stats['stale_served'] += 1
+            self._schedule_refresh(api_source)
+            return name, rates, f"stale:{name}:{int(age)}s"
+
+        rates, name = await self._fetch_coalesced(api_source)
+        if not rates:
+            return None
+        return name, rates, name
+
+    def _cached_snapshot(self, api_source: str) -> Optional[Tuple[str, float, Dict]]:
+        """Найти снимок в кэше: сначала провайдер, который последним обслужил
+        api_source, затем первый провайдер его цепочки."""
+        name = self._source_map.get(api_source)
+        if name is None:
+            name = self._build_chain(api_source, skip_open=False)[0][0]
+        cached = self.rates_cache.get(name)
+        if cached is None:
+            return None
+        return name, cached[0], cached[1]
 
+    @staticmethod
+    def _rebase(usd_rates: Dict, base_currency: str) -> Optional[Dict]:
+        """Пересчитать USD-снимок в базу base_currency."""
+        if base_currency == 'USD':
+            return usd_rates
+        base_rate = usd_rates.get(base_currency)
+        if not base_rate:
+            return None
+        base_rate = float(base_rate)
+        return {code: float(r) / base_rate for code, r in usd_rates.items()}
+
+    async def _fetch_coalesced(self, api_source: str) -> Tuple[Dict, str]:
+        """Single-flight обёртка над _fetch_rates (для CRYPTO_PROVIDER — над _fetch_crypto).
+
+        Запрос идёт отдельной задачей, и все вызовы, включая первый, ждут её
+        через shield: отмена одного вызова не обрывает запрос остальным.
+        Вызовы для разных api_source с одним первым провайдером делят запрос."""
+        key = self._inflight_key(api_source)
+        task = self._inflight.get(key)
+        if task is not None:
+            self.fetch_stats['coalesced'] += 1
+            logger.debug("Ожидаем уже идущий запрос курсов (%s)", key)
+        else:
+            if api_source == CRYPTO_PROVIDER:
+                task = asyncio.create_task(self._fetch_crypto())
+            elif self.shared:
+                task = asyncio.create_task(self._fetch_shared(api_source))
+            else:
+                task = asyncio.create_task(self._fetch_rates(api_source))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_inflight_done(key, t))
+        rates, name = await asyncio.shield(task)
+        if rates and api_source != CRYPTO_PROVIDER:
+            # Запрос мог запустить вызов с другим api_source
+            self._source_map[api_source] = name
+        return rates, name
+
+    def _inflight_key(self, api_source: str) -> str:
+        """Ключ single-flight: провайдер, с которого начнётся обход цепочки api_source."""
+        if api_source == CRYPTO_PROVIDER:
+            return CRYPTO_PROVIDER
+        chain = self._build_chain(api_source)
+        return chain[0][0] if chain else api_source
+
+    def _on_inflight_done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Исключение получат ждущие; если все они отменены — не теряем его молча
+        if not task.cancelled() and task.exception():
+            logger.debug("Запрос курсов (%s) завершился ошибкой: %s", key, task.exception())
+
+    async def _fetch_rates(self, api_source: str) -> Tuple[Dict, str]:
+        """Получить USD-снимок по цепочке источников и сохранить его в кэш."""
+        self.fetch_stats['fetches'] += 1
         # Порядок попыток зависит от api_source
-        chain = self._build_chain(api_source, base_currency)
-        for name, coro_factory in chain:
-            result = await coro_factory()
-            if result:
-                self.api_failures[name] = 0
-                self.rates_cache[cache_key] = (time.time(), result)
-                logger.info("Курсы получены от %s (база: %s)", name, base_currency)
-                return result, name
-            self.api_failures[name] += 1
+        chain = self._build_chain(api_source)
+        winner = await self._race_chain(chain)
+        if winner is None:
+            return {}, 'unavailable'
+
+        name, result = winner
+        self.rates_cache[name] = (time.time(), result)
+        self._publish(name)
+        self._source_map[api_source] = name
+        logger.info("Курсы получены от %s", name)
+        await self._save_snapshot()
+        return result, name
+
+    async def _get_crypto_snapshot(self) -> Optional[str]:
+        """Снимок крипто-провайдера для наложения на фиатный: source или None.
+        Истёкший снимок отдаётся как stale, обновление уходит в фон; без снимка
+        ждём запрос не дольше crypto_cold_timeout."""
+        now = time.time()
+        self._crypto_used_at = now
+        cached = self.rates_cache.get(CRYPTO_PROVIDER)
+        if cached:
+            self._publish(CRYPTO_PROVIDER)
+            age = now - cached[0]
+            if age < self.crypto_cache_timeout:
+                return f"cache:{CRYPTO_PROVIDER}"
+            self.fetch_stats['stale_served'] += 1
+            self._schedule_refresh(CRYPTO_PROVIDER)
+            return f"stale:{CRYPTO_PROVIDER}:{int(age)}s"
 
-        logger.warning("Все API недоступны для базы %s", base_currency)
-        return {}, 'unavailable'
+        try:
+            rates, _ = await asyncio.wait_for(self._fetch_coalesced(CRYPTO_PROVIDER),
+                                              self.crypto_cold_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("CoinGecko не ответил за %.1f с, конвертируем без курсов крипты",
+                           self.crypto_cold_timeout)
+            return None
+        return CRYPTO_PROVIDER if rates else None
+
+    async def _fetch_crypto(self) -> Tuple[Dict, str]:
+        """Получить курсы крипты и сохранить их в кэш. В режиме воркеров —
+        под той же арендой, что и фиат."""
+        lock_fd = await self._acquire_lease() if self.shared else None
+        try:
+            if self.shared:
+                self._sync_snapshot(force=True)
+                cached = self.rates_cache.get(CRYPTO_PROVIDER)
+                if cached and time.time() - cached[0] < self.crypto_cache_timeout - self.crypto_refresh_ahead:
+                    self.fetch_stats['shared_hits'] += 1
+                    return cached[1], CRYPTO_PROVIDER
+            self.fetch_stats['fetches'] += 1
+            winner = await self._race_chain([(CRYPTO_PROVIDER, self._fetch_coingecko)])
+            if winner is None:
+                return {}, 'unavailable'
+            result = winner[1]
+            self.rates_cache[CRYPTO_PROVIDER] = (time.time(), result)
+            self._publish(CRYPTO_PROVIDER)
+            logger.info("Курсы крипты получены от %s", CRYPTO_PROVIDER)
+            await self._save_snapshot()
+            return result, CRYPTO_PROVIDER
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd)
+
+    async def _race_chain(self, chain: List[Tuple[str, callable]]
+                          ) -> Optional[Tuple[str, Dict]]:
+        """Hedged-обход цепочки: источник стартует, когда предыдущий упал
+        или не ответил за hedge_delay. Первый удачный ответ побеждает,
+        остальные запросы отменяются."""
+        queue = list(chain)
+        order = {name: i for i, (name, _) in enumerate(chain)}
+        pending: Dict[asyncio.Task, str] = {}
+
+        def launch():
+            while queue:
+                name, coro_factory = queue.pop(0)
+                # Состояние могло измениться, пока цепочка ждала своей очереди
+                if not self._admit(name):
+                    continue
+                task = asyncio.create_task(self._timed_fetch(name, coro_factory))
+                pending[task] = name
+                return
+
+        launch()
+        try:
+            while pending:
+                timeout = self.hedge_delay if queue else None
+                done, _ = await asyncio.wait(pending, timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done and queue:
+                    logger.debug("Источник не ответил за %.0f мс, запускаем следующий",
+                                 self.hedge_delay * 1000)
+                    self.fetch_stats['hedged'] += 1
+                    launch()
+                    continue
 
-    def _build_chain(self, api_source: str, base_currency: str
-                     ) -> List[Tuple[str, callable]]:
+                # При одновременных ответах предпочитаем более приоритетный источник
+                for task in sorted(done, key=lambda t: order[pending[t]]):
+                    name = pending.pop(task)
+                    result = task.result()
+                    if result:
+                        self._record_success(name)
+                        return name, result
+                    self._record_failure(name)
+                    launch()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _timed_fetch(self, name: str, coro_factory: callable) -> Optional[Dict]:
+        """Вызвать фетчер провайдера, учитывая задержку в provider_stats."""
+        stats = self.provider_stats.setdefault(
+            name, {'calls': 0, 'failures': 0, 'cancelled': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['calls'] += 1
+        started = time.perf_counter()
+        try:
+            result = await coro_factory()
+        except asyncio.CancelledError:
+            stats['cancelled'] += 1
+            raise
+        except Exception as e:
+            logger.warning("%s error: %s", name, e)
+            result = None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        if not result:
+            stats['failures'] += 1
+        return result
+
+    # ── Снимок курсов на диске ───────────────────────────────
+
+    def _load_snapshot(self):
+        """Загрузить снимки провайдеров с их исходными метками времени.
+        Устаревшие снимки отдаются как stale, пока фон не получит свежие.
+        Снимок провайдера из файла не заменяет более свежий в памяти."""
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                data = json.load(f)
+            for name, entry in data.get('providers', {}).items():
+                timestamp = float(entry['timestamp'])
+                if name not in self.rates_cache or self.rates_cache[name][0] < timestamp:
+                    self.rates_cache[name] = (timestamp, entry['rates'])
+                    self._publish(name)
+            self._source_map.update(data.get('sources', {}))
+            logger.info("Загружен снимок курсов: %s", ", ".join(self.rates_cache) or "пусто")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Не удалось прочитать снимок курсов %s: %s", self.snapshot_path, e)
+
+    async def _save_snapshot(self):
+        """Атомарно записать текущие снимки (tmp + rename) вне event loop.
+        Сохранения сериализуются, а payload собирается уже под блокировкой:
+        последняя запись на диске всегда самая свежая."""
+        if not self.snapshot_path:
+            return
+        async with self._save_lock:
+            payload = json.dumps({
+                'providers': {name: {'timestamp': ts, 'rates': rates}
+                              for name, (ts, rates) in self.rates_cache.items()},
+                'sources': self._source_map,
+            })
+            try:
+                await asyncio.to_thread(self._write_snapshot, payload)
+            except OSError as e:
+                logger.warning("Не удалось сохранить снимок курсов: %s", e)
+
+    def _write_snapshot(self, payload: str):
+        dir_name = os.path.dirname(self.snapshot_path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        # Уникальный tmp-файл: не пересекается ни с другими воркерами, ни с отменённой записью
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name or '.',
+                                        prefix=f"{os.path.basename(self.snapshot_path)}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.snapshot_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _publish(self, name: str):
+        """Выложить снимок провайдера из rates_cache в rate_table, если там он старее."""
+        cache_time, rates = self.rates_cache[name]
+        if self._published.get(name) == cache_time:
+            return
+        if self.rate_table.timestamp(name) < cache_time:
+            self.rate_table.publish(name, cache_time, rates)
+        self._published[name] = cache_time
+
+    # ── Общий снимок для воркеров ────────────────────────────
+
+    def _sync_snapshot(self, force: bool = False) -> bool:
+        """Подтянуть в rates_cache снимки, которые другой процесс выложил
+        в общую таблицу. True — что-то обновилось."""
+        now = time.monotonic()
+        if not force and now - self._snapshot_checked_at < self.snapshot_check_interval:
+            return False
+        self._snapshot_checked_at = now
+        updated = False
+        for name in self.rate_table.providers:
+            cached = self.rates_cache.get(name)
+            if self.rate_table.timestamp(name) > (cached[0] if cached else 0.0):
+                entry = self.rate_table.to_dict(name)
+                if entry:
+                    self.rates_cache[name] = entry
+                    updated = True
+        return updated
+
+    async def _fetch_shared(self, api_source: str) -> Tuple[Dict, str]:
+        """_fetch_rates под арендой: пока один воркер ходит в API, остальные
+        ждут и берут его результат из файла, а не повторяют запрос."""
+        lock_fd = await self._acquire_lease()
+        try:
+            # Пока ждали аренду, курсы мог обновить другой воркер — любым
+            # провайдером из нашей цепочки
+            self._sync_snapshot(force=True)
+            now = time.time()
+            for name, _ in self._build_chain(api_source, skip_open=False):
+                cached = self.rates_cache.get(name)
+                if cached and now - cached[0] < self.cache_timeout - self.refresh_ahead:
+                    self.fetch_stats['shared_hits'] += 1
+                    self._source_map[api_source] = name
+                    return cached[1], name
+            return await self._fetch_rates(api_source)
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd)
+
+    async def _acquire_lease(self) -> Optional[int]:
+        """Взять flock на <snapshot>.lock, не блокируя event loop.
+
+        Блокировку держит открытый дескриптор: если воркер упал, её снимает
+        ядро, зависших аренд не бывает. Если за lease_timeout взять не удалось
+        (владелец завис на медленном API), обновляем без аренды — None."""
+        dir_name = os.path.dirname(self.snapshot_path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        fd = os.open(f"{self.snapshot_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + self.lease_timeout
+        waited = False
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    pass
+                if not waited:
+                    waited = True
+                    self.fetch_stats['lease_waits'] += 1
+                if time.monotonic() >= deadline:
+                    logger.warning("Аренда снимка курсов занята дольше %.0f с, обновляем без неё",
+                                   self.lease_timeout)
+                    os.close(fd)
+                    return None
+                await asyncio.sleep(self.lease_poll_interval)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    # ── Фоновое обновление курсов ────────────────────────────
+
+    def _schedule_refresh(self, api_source: str):
+        """Запустить обновление снимка в фоне, если оно ещё не идёт."""
+        if self._inflight_key(api_source) in self._inflight:
+            return
+        task = asyncio.create_task(self._fetch_coalesced(api_source))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_done)
+
+    def _on_background_done(self, task: asyncio.Task):
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.warning("Ошибка фонового обновления курсов: %s", task.exception())
+
+    def start_background_refresh(self, interval: float = 30.0):
+        """Запустить фоновую задачу, обновляющую горячие источники до истечения кэша.
+        Вызывается из on_startup, когда уже есть работающий event loop."""
+        if self._refresher_task is None:
+            # Основной источник прогреваем сразу, не дожидаясь первого сообщения.
+            # Крипту — нет: она горячая только после конвертации с ней
+            self._hot_keys.setdefault('auto', time.time())
+            self._refresher_task = asyncio.create_task(self._refresh_loop(interval))
+
+    async def _refresh_loop(self, interval: float):
+        while True:
+            try:
+                await self.refresh_hot_keys()
+            except Exception as e:
+                logger.warning("Ошибка фонового обновления курсов: %s", e)
+            await asyncio.sleep(interval)
+
+    async def refresh_hot_keys(self):
+        """Обновить источники, к которым обращались за последние hot_key_ttl секунд
+        и чьи снимки истекут в ближайшие refresh_ahead секунд (крипту — за
+        crypto_refresh_ahead)."""
+        now = time.time()
+        if self.shared:
+            self._sync_snapshot()
+        for api_source, last_used in list(self._hot_keys.items()):
+            if now - last_used > self.hot_key_ttl:
+                del self._hot_keys[api_source]
+                continue
+            cached = self._cached_snapshot(api_source)
+            if cached and now - cached[1] < self.cache_timeout - self.refresh_ahead:
+                continue
+            await self._fetch_coalesced(api_source)
+        if now - self._crypto_used_at <= self.hot_key_ttl:
+            cached = self.rates_cache.get(CRYPTO_PROVIDER)
+            if not cached or now - cached[0] >= self.crypto_cache_timeout - self.crypto_refresh_ahead:
+                await self._fetch_coalesced(CRYPTO_PROVIDER)
+
+    def _build_chain(self, api_source: str, base_currency: str = 'USD',
+                     skip_open: bool = True) -> List[Tuple[str, callable]]:
         """Построить цепочку попыток получения курсов.
         Приоритет определяется API_PRIORITY из config (меньше число = выше приоритет).
-        api_source может быть 'auto' или цифрой '1'..'4'."""
+        api_source может быть 'auto' или цифрой '1'..'4'.
+        Источники с разомкнутым circuit breaker пропускаются (если skip_open)."""
         all_sources = [
             ('frankfurter', self._fetch_frankfurter),
             ('nbrb', self._fetch_nbrb),
@@ -91,14 +670,52 @@ class CurrencyService:
 
         if api_source == 'auto':
             # Сортируем по приоритету из API_PRIORITY
-            sorted_sources = sorted(all_sources, key=lambda x: API_PRIORITY.get(x[0], 99))
-            return [(n, lambda f=f, b=base_currency: f(b)) for n, f in sorted_sources]
+            ordered = sorted(all_sources, key=lambda x: API_PRIORITY.get(x[0], 99))
         else:
             # Преобразуем цифру в имя, если нужно
             source_name = digit_to_name.get(api_source, api_source)
             primary = [(n, f) for n, f in all_sources if n == source_name]
             fallback = [(n, f) for n, f in all_sources if n != source_name]
-            return [(n, lambda f=f, b=base_currency: f(b)) for n, f in primary + fallback]
+            ordered = primary + fallback
+
+        if skip_open:
+            ordered = [(n, f) for n, f in ordered if self._circuit_state(n) != 'open']
+        return [(n, lambda f=f, b=base_currency: f(b)) for n, f in ordered]
+
+    # ── Circuit breaker ──────────────────────────────────────
+
+    def _circuit_state(self, name: str) -> str:
+        """'closed' — источник работает; 'open' — пропускается до конца cool-down;
+        'half_open' — cool-down прошёл, можно сделать пробный запрос."""
+        if self.api_failures.get(name, 0) < self.max_failures:
+            return 'closed'
+        if time.time() - self._opened_at.get(name, 0.0) >= self.breaker_cooldown:
+            return 'half_open'
+        return 'open'
+
+    def _admit(self, name: str) -> bool:
+        """Разрешить запрос к источнику. В half-open пропускается одна проба:
+        cool-down перезапускается, и параллельные запросы видят 'open'."""
+        state = self._circuit_state(name)
+        if state == 'open':
+            return False
+        if state == 'half_open':
+            logger.info("Пробный запрос к %s после cool-down", name)
+            self._opened_at[name] = time.time()
+        return True
+
+    def _record_success(self, name: str):
+        if self.api_failures.get(name, 0) >= self.max_failures:
+            logger.info("Circuit breaker %s замкнут", name)
+        self.api_failures[name] = 0
+        self._opened_at.pop(name, None)
+
+    def _record_failure(self, name: str):
+        self.api_failures[name] = self.api_failures.get(name, 0) + 1
+        if self.api_failures[name] >= self.max_failures:
+            if self.api_failures[name] == self.max_failures:
+                logger.warning("Circuit breaker %s разомкнут на %s с", name, self.breaker_cooldown)
+            self._opened_at[name] = time.time()
 
     async def _fetch_currencyfreaks(self, base_currency: str) -> Optional[Dict]:
         if not self.currencyfreaks_api_key:
@@ -183,6 +800,34 @@ class CurrencyService:
             logger.warning("Frankfurter error: %s", e)
             return None
 
+    async def _fetch_coingecko(self) -> Optional[Dict]:
+        """CoinGecko simple/price: цены всех монет COINGECKO_IDS в USD одним
+        запросом. Формат ответа: {id: {"usd": цена}, ...}.
+        Возвращает USD-снимок, как у остальных провайдеров: монет за 1 USD."""
+        try:
+            session = await self._get_session()
+            headers = {'x-cg-demo-api-key': self.coingecko_api_key} if self.coingecko_api_key else None
+            resp = await session.get(f"{self.coingecko_base_url}/simple/price", params={
+                'ids': ','.join(COINGECKO_IDS.values()), 'vs_currencies': 'usd'
+            }, headers=headers)
+            if resp.status_code != 200:
+                logger.warning("CoinGecko HTTP %s", resp.status_code)
+                return None
+
+            data = resp.json()
+            rates: Dict[str, float] = {}
+            for code, coin_id in COINGECKO_IDS.items():
+                price = (data.get(coin_id) or {}).get('usd')
+                if isinstance(price, (int, float)) and price > 0:
+                    rates[code] = 1.0 / price
+            if not rates:
+                return None
+            rates['USD'] = 1.0
+            return rates
+        except Exception as e:
+            logger.warning("CoinGecko error: %s", e)
+            return None
+
     @staticmethod
     def _convert_base(rates_to_byn: Dict[str, float], base_currency: str) -> Optional[Dict]:
         """Пересчитать курсы из 'к BYN' в 'к base_currency'."""
@@ -196,67 +841,85 @@ class CurrencyService:
 
     # ── Извлечение числа и валюты из текста ───────────────────
 
+    # Длинные тексты почти не повторяются — не тратим на них кэш
+    parse_cache_max_text = 256
+
+    def parse_message(self, text: str, use_w2n: bool = False) -> Optional[Tuple[float, str]]:
+        """Извлечь (число, валюта) из сообщения с учётом режима обработки.
+        Результат, включая отрицательный, кэшируется по тексту в нижнем регистре:
+        все этапы разбора регистронезависимы."""
+        key_text = text.strip().lower()
+        if len(key_text) > self.parse_cache_max_text:
+            return self._parse_message(key_text, use_w2n)
+        key = (key_text, use_w2n)
+        cached = self.parse_cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        result = self._parse_message(key_text, use_w2n)
+        self.parse_cache.set(key, result)
+        return result
+
+    def _parse_message(self, text: str, use_w2n: bool) -> Optional[Tuple[float, str]]:
+        result = self.extract_number_and_currency(text)
+        if result:
+            return result
+
+        if use_w2n:
+            words_number = self.words_to_number(text)
+            if words_number:
+                for alias, code in CURRENCY_ALIASES.items():
+                    if alias in text:
+                        return words_number, code
+
+            result = self.money_to_number(text)
+            if result:
+                return result
+
+        return None
+
+    def get_parse_cache_stats(self) -> Dict[str, float]:
+        return self.parse_cache.stats()
+
     def normalize_number(self, text: str) -> str:
-        text = re.sub(r'(\d+),(\d+)', r'\1.\2', text)
+        text = _DECIMAL_COMMA_RE.sub(r'\1.\2', text)
         # Убираем пробелы внутри чисел (1 000 000 → 1000000)
-        while re.search(r'\d\s+\d', text):
-            text = re.sub(r'(\d)\s+(\d)', r'\1\2', text)
-        return text
+        return _DIGIT_SPACE_RE.sub('', text)
 
     def extract_number_and_currency(self, text: str) -> Optional[Tuple[float, str]]:
         text = text.strip().lower()
 
+        # Без цифр не сработает ни один шаблон, включая математику
+        if not _HAS_DIGIT_RE.search(text):
+            return None
+
         # Сначала — математические выражения
-        math_result = self.evaluate_math_expression(text)
-        if math_result:
-            return math_result
+        if _HAS_MATH_OP_RE.search(text):
+            math_result = self.evaluate_math_expression(text)
+            if math_result:
+                return math_result
 
         norm_text = self.normalize_number(text)
 
         multiplier = 1
-        if re.search(r'\d\s*[kк]{2}', norm_text):
+        norm_text, replaced = _MILLION_SUFFIX_RE.subn(r'\1', norm_text)
+        if replaced:
             multiplier = 1_000_000
-            norm_text = re.sub(r'(\d)\s*[kк]{2}', r'\1', norm_text)
-        elif re.search(r'\d\s*[kк](?![a-zа-я])', norm_text):
-            multiplier = 1_000
-            norm_text = re.sub(r'(\d)\s*[kк](?![a-zа-я])', r'\1', norm_text)
-
-        patterns = [
-            # Слипшиеся: "15usd", "1бр.", "100eur"
-            (r'(\d+(?:[.,]\d+)?)([a-z]{3}|[а-яё.]+)', 'num_first'),
-            # "5 долларов", "10.5 евро"
-            (r'(\d+(?:[.,]\d+)?)\s+([а-яё]+)', 'num_first'),
-            # Короткие алиасы: "1 tg", "5 р", "10 тг"
-            (r'(\d+(?:[.,]\d+)?)\s+([a-zа-яё]{1,3})', 'num_first'),
-            # "$5", "€10.5"
-            (r'([$€£¥₽₴₸₩₹₿Ξ💎])\s*(\d+(?:[.,]\d+)?)', 'sym_first'),
-            # "5$", "10.5€"
-            (r'(\d+(?:[.,]\d+)?)\s*([$€£¥₽₴₸₩₹₿Ξ💎])', 'num_first'),
-            # "USD 5"
-            (r'([a-z]{3})\s+(\d+(?:[.,]\d+)?)', 'code_first'),
-            # "5 USD"
-            (r'(\d+(?:[.,]\d+)?)\s+([a-z]{3})', 'num_first'),
-        ]
+        else:
+            norm_text, replaced = _THOUSAND_SUFFIX_RE.subn(r'\1', norm_text)
+            if replaced:
+                multiplier = 1_000
 
-        for pattern, fmt in patterns:
-            match = re.search(pattern, norm_text)
+        for pattern, number_group, currency_group in _AMOUNT_PATTERNS:
+            match = pattern.search(norm_text)
             if match:
                 try:
-                    if fmt == 'num_first':
-                        number = float(self.normalize_number(match.group(1))) * multiplier
-                        currency_text = match.group(2)
-                    elif fmt == 'sym_first':
-                        currency_text = match.group(1)
-                        number = float(self.normalize_number(match.group(2))) * multiplier
-                    else:  # code_first
-                        currency_text = match.group(1)
-                        number = float(self.normalize_number(match.group(2))) * multiplier
-
-                    currency = self.resolve_currency(currency_text)
-                    if currency:
-                        return number, currency
+                    # В группе числа уже нет пробелов, остаётся максимум одна запятая
+                    number = float(match.group(number_group).replace(',', '.')) * multiplier
                 except ValueError:
                     continue
+                currency = self.resolve_currency(match.group(currency_group))
+                if currency:
+                    return number, currency
         return None
 
     def resolve_currency(self, currency_text: str) -> Optional[str]:
@@ -265,20 +928,15 @@ class CurrencyService:
         if currency_text in CURRENCY_ALIASES:
             return CURRENCY_ALIASES[currency_text]
 
-        symbols = {
-            '$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'JPY',
-            '₽': 'RUB', '₴': 'UAH', '₸': 'KZT', '₩': 'KRW',
-            '₹': 'INR', '₿': 'BTC', 'Ξ': 'ETH', '💎': 'TON'
-        }
-        if currency_text in symbols:
-            return symbols[currency_text]
+        if currency_text in CURRENCY_SYMBOLS:
+            return CURRENCY_SYMBOLS[currency_text]
 
         upper = currency_text.upper()
         if upper in FIAT_CURRENCIES or upper in CRYPTO_CURRENCIES:
             return upper
 
         # Обрезаем окончания для русских слов
-        base = re.sub(r'[^a-zа-яё]', '', currency_text)
+        base = _NON_LETTER_RE.sub('', currency_text)
         if base in CURRENCY_ALIASES:
             return CURRENCY_ALIASES[base]
 
@@ -389,26 +1047,19 @@ class CurrencyService:
 
             # Ищем алиасы по границам слова (длинные первыми)
             lowered = text.lower()
-            for alias, code in sorted(CURRENCY_ALIASES.items(), key=lambda kv: len(kv[0]), reverse=True):
-                if len(alias) == 1:
-                    continue
-                if re.search(r'(?<![a-zа-яё])' + re.escape(alias) + r'(?![a-zа-яё])', lowered):
-                    return value, code
+            code = ALIAS_INDEX.find_longest(lowered)
+            if code:
+                return value, code
 
             # Символы валют
-            currency_symbols = {
-                '$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'JPY',
-                '₽': 'RUB', '₴': 'UAH', '₸': 'KZT', '₩': 'KRW',
-                '₹': 'INR', '₿': 'BTC', 'Ξ': 'ETH', '💎': 'TON'
-            }
-            for symbol, code in currency_symbols.items():
+            for symbol, code in CURRENCY_SYMBOLS.items():
                 if symbol in text:
                     return value, code
 
             # Коды как отдельные токены
-            for code in list(FIAT_CURRENCIES.keys()) + list(CRYPTO_CURRENCIES.keys()):
-                if re.search(r'(?<![A-Za-z])' + re.escape(code.lower()) + r'(?![A-Za-z])', lowered):
-                    return value, code
+            code = CODE_INDEX.find_first(lowered)
+            if code:
+                return value, code
 
             return None
         except Exception as e:
@@ -426,34 +1077,47 @@ class CurrencyService:
         # Если нет — фоллбек на другие API через USD
         return await self._convert_via_usd(amount, from_currency, to_currencies, api_source)
 
+    async def convert_batch(self, amounts: Sequence[float], from_codes: Sequence[str],
+                            to_codes: Sequence[str], api_source: str = 'auto') -> Tuple[array, str]:
+        """Пакетная конвертация по одному снимку курсов: (результаты, source).
+
+        amounts[k] из from_codes[k] в to_codes[k]; последовательности длины 1
+        растягиваются на остальные (см. rate_table.convert_batch). Результат —
+        array('d'), NaN там, где курса нет; при недоступных API — все NaN.
+
+        Если в пакете есть крипта, поверх снимка api_source накладываются
+        курсы CRYPTO_PROVIDER, а source получает вид '<фиат>+<крипта>'."""
+        entry = await self._get_snapshot_entry(api_source)
+        crypto_source = None
+        if not _CRYPTO_CODES.isdisjoint(from_codes) or not _CRYPTO_CODES.isdisjoint(to_codes):
+            crypto_source = await self._get_crypto_snapshot()
+        read = None
+        if entry is not None:
+            name, _, source = entry
+            self._publish(name)
+            if crypto_source:
+                source = f"{source}+{crypto_source}"
+                read = self.rate_table.read_overlay(name, CRYPTO_PROVIDER, lambda rates, crypto: convert_batch(
+                    rates, amounts, from_codes, to_codes, overlay=crypto))
+            else:
+                read = self.rate_table.read(
+                    name, lambda rates: convert_batch(rates, amounts, from_codes, to_codes))
+        elif crypto_source:
+            # Фиатные API недоступны: крипта и USD считаются по одному снимку крипты
+            source = crypto_source
+            read = self.rate_table.read(
+                CRYPTO_PROVIDER, lambda rates: convert_batch(rates, amounts, from_codes, to_codes))
+        if read is None:
+            return array('d', [float('nan')]) * batch_length(amounts, from_codes, to_codes), 'unavailable'
+        return read[1], source
+
     async def _convert_via_usd(self, amount: float, from_currency: str,
                                 to_currencies: List[str], api_source: str) -> Dict:
-        rates, source = await self.get_rates('USD', api_source)
-        if not rates:
-            return {}
-
-        # Конвертируем в USD
-        if from_currency == 'USD':
-            usd_amount = amount
-        elif from_currency in rates:
-            from_rate = rates[from_currency]
-            if isinstance(from_rate, (int, float)):
-                usd_amount = amount / float(from_rate)
-            else:
-                return {}
-        else:
-            return {}
-
-        # Из USD в целевые
-        results = {}
-        for to_curr in to_currencies:
-            if to_curr == 'USD':
-                results[to_curr] = {'amount': usd_amount, 'source': source}
-            elif to_curr in rates:
-                rate = rates[to_curr]
-                if isinstance(rate, (int, float)):
-                    results[to_curr] = {'amount': usd_amount * float(rate), 'source': source}
-        return results
+        values, source = await self.convert_batch((amount,), (from_currency,), to_currencies, api_source)
+        return {
+            code: {'amount': value, 'source': source}
+            for code, value in zip(to_currencies, values) if value == value
+        }
 
     # ── Форматирование ────────────────────────────────────────
 
@@ -1,90 +1,385 @@
 """SQLite-база данных пользователей."""
 
+import asyncio
+import functools
 import json
+import logging
 import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Dict, List
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional
+
+from lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_APPEARANCE = {'show_flags': True, 'show_codes': True, 'show_symbols': True, 'compact': False}
 
+# Переключение валюты — один оператор; позиция сохраняет порядок добавления
+_ADD_CURRENCY_SQL = (
+    "INSERT OR IGNORE INTO user_currencies (user_id, kind, code, position) "
+    "SELECT ?, ?, ?, COALESCE(MAX(position) + 1, 0) FROM user_currencies WHERE user_id = ? AND kind = ?"
+)
+_REMOVE_CURRENCY_SQL = "DELETE FROM user_currencies WHERE user_id = ? AND kind = ? AND code = ?"
+_CLEAR_KIND_SQL = "DELETE FROM user_currencies WHERE user_id = ? AND kind = ?"
+_CLEAR_ALL_SQL = "DELETE FROM user_currencies WHERE user_id = ?"
+
+
+def _currency_kind(currency_type: str) -> str:
+    return 'fiat' if currency_type == 'fiat' else 'crypto'
+
+
+# ── Миграции схемы ───────────────────────────────────────
+#
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция идемпотентна
+# и переносит данные батчами по batch_size строк (keyset по user_id), каждый
+# батч — отдельная транзакция: блокировка записи не держится на всю таблицу,
+# а прерванная миграция при следующем старте продолжается с места остановки.
+# user_version повышается только после успешного завершения миграции.
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def _m1_users(conn: sqlite3.Connection, batch_size: int, progress: ProgressCallback):
+    """Базовая таблица users."""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            processing_mode TEXT DEFAULT 'standard',
+            api_source TEXT DEFAULT 'auto',
+            debug_mode INTEGER DEFAULT 0,
+            language TEXT DEFAULT 'ru',
+            appearance TEXT DEFAULT '{}',
+            selected_fiat TEXT DEFAULT '[]',
+            selected_crypto TEXT DEFAULT '[]',
+            created_at TEXT,
+            last_activity TEXT
+        );
+    """)
+
+
+def _m2_user_currencies(conn: sqlite3.Connection, batch_size: int, progress: ProgressCallback):
+    """Таблица user_currencies и перенос выбранных валют из JSON-колонок users.
+
+    Колонки selected_fiat/selected_crypto остаются в схеме (DROP COLUMN
+    есть только с SQLite 3.35), но после переноса очищаются и больше
+    не используются — по ним же видно, какие строки ещё не перенесены."""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS user_currencies (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            code TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (user_id, kind, code)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_user_currencies_code ON user_currencies (code, kind);
+    """)
+    pending_filter = "(selected_fiat NOT IN ('[]', '') OR selected_crypto NOT IN ('[]', ''))"
+    total = conn.execute(f"SELECT COUNT(*) FROM users WHERE {pending_filter}").fetchone()[0]
+    done = 0
+    last_id = -2 ** 63
+    while done < total:
+        rows = conn.execute(
+            f"SELECT user_id, selected_fiat, selected_crypto FROM users "
+            f"WHERE {pending_filter} AND user_id > ? ORDER BY user_id LIMIT ?",
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        values = []
+        for row in rows:
+            for kind in ('fiat', 'crypto'):
+                codes = json.loads(row[f'selected_{kind}'] or '[]')
+                values.extend((row['user_id'], kind, code, pos) for pos, code in enumerate(codes))
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO user_currencies (user_id, kind, code, position) VALUES (?, ?, ?, ?)",
+                values,
+            )
+            conn.executemany(
+                "UPDATE users SET selected_fiat = '[]', selected_crypto = '[]' WHERE user_id = ?",
+                [(row['user_id'],) for row in rows],
+            )
+        last_id = rows[-1]['user_id']
+        done += len(rows)
+        progress(done, total)
+
+
+def _m3_broadcasts(conn: sqlite3.Connection, batch_size: int, progress: ProgressCallback):
+    """Таблица рассылок: прогресс хранится для продолжения после рестарта."""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            last_user_id INTEGER,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT,
+            updated_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status);
+    """)
+
+
+# (версия, описание, функция) — строго по возрастанию версии, только добавлять в конец
+MIGRATIONS = [
+    (1, "таблица users", _m1_users),
+    (2, "нормализованные выбранные валюты (user_currencies)", _m2_user_currencies),
+    (3, "таблица рассылок (broadcasts)", _m3_broadcasts),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, batch_size: int = 1000,
+            progress: Optional[ProgressCallback] = None) -> List[tuple]:
+    """Применить недостающие миграции. Возвращает [(версия, секунды)]."""
+    current = get_schema_version(conn)
+    if current > SCHEMA_VERSION:
+        logger.warning("Схема users.db новее кода: версия %s > %s", current, SCHEMA_VERSION)
+        return []
+
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Миграция %s: %s", version, description)
+        started = time.perf_counter()
+
+        def report(done: int, total: int, _version=version, _started=started):
+            if progress:
+                progress(done, total)
+            logger.info("Миграция %s: %s/%s строк (%.0f%%), %.1f с",
+                        _version, done, total, 100 * done / total if total else 100,
+                        time.perf_counter() - _started)
+
+        func(conn, batch_size, report)
+        conn.execute(f"PRAGMA user_version = {version:d}")
+        conn.commit()
+        elapsed = time.perf_counter() - started
+        applied.append((version, elapsed))
+        logger.info("Миграция %s завершена за %.3f с", version, elapsed)
+    return applied
+
 
 class UserDatabase:
-    def __init__(self, db_path: str = "data/users.db"):
+    """Хранилище пользователей. Профили кэшируются в LRU (write-through):
+    чтение настроек попадает в SQLite только при промахе кэша.
+
+    Записи буферизуются (write-behind): изменения одного пользователя
+    склеиваются и пишутся одной транзакцией в flush() — по таймеру
+    AsyncUserDatabase, при накоплении max_pending записей и при close().
+    max_pending=0 — коммит на каждую запись, как раньше."""
+
+    def __init__(self, db_path: str = "data/users.db", cache_size: int = 10000,
+                 check_same_thread: bool = True, max_pending: int = 500,
+                 migration_batch_size: int = 1000):
         dir_name = os.path.dirname(db_path)
         if dir_name:
             os.makedirs(dir_name, exist_ok=True)
         self.db_path = db_path
-        self._conn = sqlite3.connect(db_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
         self._conn.row_factory = sqlite3.Row
         self._conn.execute("PRAGMA journal_mode=WAL")
         self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._cache = LRUCache(cache_size)
+        # Кэш читается и из потока event loop (AsyncUserDatabase.cached_user)
+        self._cache_lock = threading.Lock()
+        self.max_pending = max_pending
+        self._pending_inserts: Dict[int, tuple] = {}
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        # Операции над user_currencies в порядке вызова: (user_id, sql, params)
+        self._pending_currency_ops: List[tuple] = []
+        self.flush_stats = {'flushes': 0, 'users': 0}
+        self.migration_batch_size = migration_batch_size
         self._create_tables()
 
     def _create_tables(self):
-        self._conn.executescript("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                processing_mode TEXT DEFAULT 'standard',
-                api_source TEXT DEFAULT 'auto',
-                debug_mode INTEGER DEFAULT 0,
-                language TEXT DEFAULT 'ru',
-                appearance TEXT DEFAULT '{}',
-                selected_fiat TEXT DEFAULT '[]',
-                selected_crypto TEXT DEFAULT '[]',
-                created_at TEXT,
-                last_activity TEXT
-            );
-        """)
-        self._conn.commit()
+        migrate(self._conn, batch_size=self.migration_batch_size)
 
     def close(self):
         if self._conn:
+            self.flush()
+            # Перенести WAL в основной файл: всё записанное переживёт рестарт
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
             self._conn.close()
             self._conn = None  # type: ignore
 
+    # ── Буфер записи ─────────────────────────────────────────
+
+    @property
+    def pending_count(self) -> int:
+        """Записей в буфере: новые пользователи, склеенные UPDATE и операции с валютами."""
+        return len(self._pending_inserts) + len(self._pending) + len(self._pending_currency_ops)
+
+    def flush(self) -> int:
+        """Записать буфер одной транзакцией. Возвращает число затронутых пользователей."""
+        if not self._pending_inserts and not self._pending and not self._pending_currency_ops:
+            return 0
+        inserts, self._pending_inserts = self._pending_inserts, {}
+        updates, self._pending = self._pending, {}
+        currency_ops, self._pending_currency_ops = self._pending_currency_ops, []
+
+        # Одинаковый набор колонок → один executemany
+        grouped: Dict[tuple, List[list]] = {}
+        for user_id, columns in updates.items():
+            keys = tuple(sorted(columns))
+            grouped.setdefault(keys, []).append([columns[k] for k in keys] + [user_id])
+
+        try:
+            with self._conn:
+                if inserts:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO users (user_id, created_at, last_activity, appearance) "
+                        "VALUES (?, ?, ?, ?)",
+                        list(inserts.values()),
+                    )
+                for _, sql, params in currency_ops:
+                    self._conn.execute(sql, params)
+                for keys, rows in grouped.items():
+                    sets = ", ".join(f"{k} = ?" for k in keys)
+                    self._conn.executemany(f"UPDATE users SET {sets} WHERE user_id = ?", rows)
+        except sqlite3.Error:
+            # Вернуть несохранённое в буфер (более новые изменения поверх)
+            for user_id, row in inserts.items():
+                self._pending_inserts.setdefault(user_id, row)
+            for user_id, columns in updates.items():
+                self._pending[user_id] = {**columns, **self._pending.get(user_id, {})}
+            self._pending_currency_ops[:0] = currency_ops
+            raise
+
+        written = len(inserts.keys() | updates.keys())
+        self.flush_stats['flushes'] += 1
+        self.flush_stats['users'] += written
+        return written
+
+    def _maybe_flush(self):
+        if self.pending_count >= self.max_pending:
+            self.flush()
+
     # ── Внутренние хелперы ───────────────────────────────────
 
-    def _get_user_row(self, user_id: int) -> sqlite3.Row:
-        cursor = self._conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
-        if row is None:
+    def _fetch_user(self, user_id: int) -> Optional[Dict]:
+        """Профиль и выбранные валюты одним запросом (LEFT JOIN)."""
+        rows = self._conn.execute(
+            "SELECT u.*, c.kind AS c_kind, c.code AS c_code FROM users u "
+            "LEFT JOIN user_currencies c ON c.user_id = u.user_id "
+            "WHERE u.user_id = ? ORDER BY c.kind, c.position",
+            (user_id,),
+        ).fetchall()
+        if not rows:
+            return None
+        selected = {'fiat': [], 'crypto': []}
+        for row in rows:
+            if row['c_code'] is not None:
+                selected[row['c_kind']].append(row['c_code'])
+        return self._row_to_dict(rows[0], selected)
+
+    def _get_user(self, user_id: int) -> Dict:
+        # Любая запись пользователя (включая операции с валютами) обновляет
+        # last_activity, поэтому достаточно проверить _pending
+        if user_id in self._pending_inserts or user_id in self._pending:
+            # Профиль вытеснен из кэша, а его изменения ещё в буфере
+            self.flush()
+        user = self._fetch_user(user_id)
+        if user is None:
+            # Первый контакт: строку с дефолтами собираем сами, INSERT уйдёт с ближайшим flush
             now = datetime.now(timezone.utc).isoformat()
             appearance = json.dumps(DEFAULT_APPEARANCE, ensure_ascii=False)
-            self._conn.execute(
-                "INSERT INTO users (user_id, created_at, last_activity, appearance) VALUES (?, ?, ?, ?)",
-                (user_id, now, now, appearance),
-            )
-            self._conn.commit()
-            cursor = self._conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            row = cursor.fetchone()
-        return row  # type: ignore[return-value]
+            self._pending_inserts[user_id] = (user_id, now, now, appearance)
+            user = self._row_to_dict({
+                'user_id': user_id,
+                'processing_mode': 'standard',
+                'api_source': 'auto',
+                'debug_mode': 0,
+                'language': 'ru',
+                'appearance': appearance,
+                'created_at': now,
+                'last_activity': now,
+            }, {'fiat': [], 'crypto': []})
+            self._maybe_flush()
+        return user
 
     def _update(self, user_id: int, **kwargs):
         kwargs['last_activity'] = datetime.now(timezone.utc).isoformat()
-        sets = ", ".join(f"{k} = ?" for k in kwargs)
-        values = list(kwargs.values()) + [user_id]
-        self._conn.execute(f"UPDATE users SET {sets} WHERE user_id = ?", values)
-        self._conn.commit()
+        self._pending.setdefault(user_id, {}).update(kwargs)
+        self._apply_to_cache(user_id, kwargs)
+        self._maybe_flush()
+
+    def _load_user(self, user_id: int) -> Dict:
+        """Профиль из кэша; при промахе — один SELECT (и INSERT для нового пользователя).
+        Возвращает внутренний объект кэша — наружу отдавать только копии."""
+        with self._cache_lock:
+            user = self._cache.get(user_id)
+        if user is None:
+            user = self._get_user(user_id)
+            with self._cache_lock:
+                self._cache.set(user_id, user)
+        return user
+
+    def cached_user(self, user_id: int) -> Optional[Dict]:
+        """Копия профиля, если он в кэше, иначе None. В базу не ходит."""
+        with self._cache_lock:
+            user = self._cache.get(user_id)
+            return self._copy_user(user) if user is not None else None
+
+    def _queue_currency_op(self, user_id: int, sql: str, params: tuple,
+                           mutate: Callable[[Dict[str, List[str]]], None]):
+        """Поставить операцию с user_currencies в буфер и применить её к кэшу."""
+        self._load_user(user_id)  # как и раньше, создаёт пользователя при первом обращении
+        self._pending_currency_ops.append((user_id, sql, params))
+        with self._cache_lock:
+            user = self._cache.peek(user_id)
+            if user is not None:
+                mutate(user['selected_currencies'])
+        self._update(user_id)
+
+    def _apply_to_cache(self, user_id: int, columns: Dict):
+        """Write-through: перенести записанные колонки в закэшированный профиль."""
+        with self._cache_lock:
+            user = self._cache.peek(user_id)
+            if user is not None:
+                self._apply_columns(user, columns)
+
+    @staticmethod
+    def _apply_columns(user: Dict, columns: Dict):
+        for key, value in columns.items():
+            if key == 'debug_mode':
+                user[key] = bool(value)
+            elif key == 'appearance':
+                user[key] = json.loads(value)
+            else:
+                user[key] = value
+
+    @staticmethod
+    def _copy_user(user: Dict) -> Dict:
+        copy = dict(user)
+        copy['appearance'] = dict(user['appearance'])
+        copy['selected_currencies'] = {
+            'fiat': list(user['selected_currencies']['fiat']),
+            'crypto': list(user['selected_currencies']['crypto']),
+        }
+        return copy
+
+    def cache_stats(self) -> Dict[str, float]:
+        with self._cache_lock:
+            return self._cache.stats()
 
     # ── Публичный API ────────────────────────────────────────
 
     def get_user(self, user_id: int) -> Dict:
-        row = self._get_user_row(user_id)
-        return {
-            'user_id': row['user_id'],
-            'processing_mode': row['processing_mode'],
-            'api_source': row['api_source'],
-            'debug_mode': bool(row['debug_mode']),
-            'language': row['language'],
-            'appearance': json.loads(row['appearance']),
-            'selected_currencies': {
-                'fiat': json.loads(row['selected_fiat']),
-                'crypto': json.loads(row['selected_crypto']),
-            },
-            'created_at': row['created_at'],
-            'last_activity': row['last_activity'],
-        }
+        return self._copy_user(self._load_user(user_id))
 
     def update_user(self, user_id: int, **kwargs):
         mapped = {}
@@ -92,8 +387,10 @@ class UserDatabase:
             if key == 'appearance':
                 mapped[key] = json.dumps(value, ensure_ascii=False)
             elif key == 'selected_currencies':
-                mapped['selected_fiat'] = json.dumps(value.get('fiat', []), ensure_ascii=False)
-                mapped['selected_crypto'] = json.dumps(value.get('crypto', []), ensure_ascii=False)
+                self.clear_selected_currencies(user_id)
+                for kind in ('fiat', 'crypto'):
+                    for code in value.get(kind, []):
+                        self.add_selected_currency(user_id, kind, code)
             else:
                 mapped[key] = value
         self._update(user_id, **mapped)
@@ -107,8 +404,7 @@ class UserDatabase:
         self._update(user_id, processing_mode=mode)
 
     def get_processing_mode(self, user_id: int) -> str:
-        row = self._get_user_row(user_id)
-        return row['processing_mode']
+        return self._load_user(user_id)['processing_mode']
 
     def set_api_source(self, user_id: int, source: str):
         if source not in self._VALID_API_SOURCES:
@@ -116,72 +412,202 @@ class UserDatabase:
         self._update(user_id, api_source=source)
 
     def get_api_source(self, user_id: int) -> str:
-        row = self._get_user_row(user_id)
-        return row['api_source']
+        return self._load_user(user_id)['api_source']
 
     def set_debug_mode(self, user_id: int, enabled: bool):
         self._update(user_id, debug_mode=int(enabled))
 
     def get_debug_mode(self, user_id: int) -> bool:
-        row = self._get_user_row(user_id)
-        return bool(row['debug_mode'])
+        return self._load_user(user_id)['debug_mode']
 
     def set_language(self, user_id: int, language: str):
         self._update(user_id, language=language)
 
     def get_language(self, user_id: int) -> str:
-        row = self._get_user_row(user_id)
-        return row['language']
+        return self._load_user(user_id)['language']
 
     def get_appearance(self, user_id: int) -> Dict:
-        row = self._get_user_row(user_id)
-        return json.loads(row['appearance'])
+        return dict(self._load_user(user_id)['appearance'])
 
     def set_appearance(self, user_id: int, **kwargs):
-        row = self._get_user_row(user_id)
-        appearance = json.loads(row['appearance'])
+        appearance = dict(self._load_user(user_id)['appearance'])
         for k, v in kwargs.items():
             if k in ('show_flags', 'show_codes', 'show_symbols', 'compact'):
                 appearance[k] = v
         self._update(user_id, appearance=json.dumps(appearance, ensure_ascii=False))
 
     def add_selected_currency(self, user_id: int, currency_type: str, currency_code: str):
-        row = self._get_user_row(user_id)
-        key = 'selected_fiat' if currency_type == 'fiat' else 'selected_crypto'
-        currencies = json.loads(row[key])
-        if currency_code not in currencies:
-            currencies.append(currency_code)
-            self._update(user_id, **{key: json.dumps(currencies, ensure_ascii=False)})
+        kind = _currency_kind(currency_type)
+
+        def mutate(selected):
+            if currency_code not in selected[kind]:
+                selected[kind].append(currency_code)
+
+        self._queue_currency_op(
+            user_id, _ADD_CURRENCY_SQL, (user_id, kind, currency_code, user_id, kind), mutate)
 
     def remove_selected_currency(self, user_id: int, currency_type: str, currency_code: str):
-        row = self._get_user_row(user_id)
-        key = 'selected_fiat' if currency_type == 'fiat' else 'selected_crypto'
-        currencies = json.loads(row[key])
-        if currency_code in currencies:
-            currencies.remove(currency_code)
-            self._update(user_id, **{key: json.dumps(currencies, ensure_ascii=False)})
+        kind = _currency_kind(currency_type)
+
+        def mutate(selected):
+            if currency_code in selected[kind]:
+                selected[kind].remove(currency_code)
+
+        self._queue_currency_op(user_id, _REMOVE_CURRENCY_SQL, (user_id, kind, currency_code), mutate)
 
     def get_selected_currencies(self, user_id: int) -> Dict[str, List[str]]:
-        row = self._get_user_row(user_id)
-        return {
-            'fiat': json.loads(row['selected_fiat']),
-            'crypto': json.loads(row['selected_crypto']),
-        }
+        selected = self._load_user(user_id)['selected_currencies']
+        return {'fiat': list(selected['fiat']), 'crypto': list(selected['crypto'])}
 
     def clear_selected_currencies(self, user_id: int, currency_type: str = None):
-        if currency_type == 'fiat':
-            self._update(user_id, selected_fiat='[]')
-        elif currency_type == 'crypto':
-            self._update(user_id, selected_crypto='[]')
+        if currency_type in ('fiat', 'crypto'):
+            kinds = (currency_type,)
+            sql, params = _CLEAR_KIND_SQL, (user_id, currency_type)
+        else:
+            kinds = ('fiat', 'crypto')
+            sql, params = _CLEAR_ALL_SQL, (user_id,)
+
+        def mutate(selected):
+            for kind in kinds:
+                selected[kind] = []
+
+        self._queue_currency_op(user_id, sql, params, mutate)
+
+    def count_users(self) -> int:
+        self.flush()
+        return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    # ── Рассылки ─────────────────────────────────────────────
+    # Прогресс рассылки коммитится сразу, мимо буфера записи
+
+    def create_broadcast(self, admin_id: int, text: str, total: int,
+                         status_chat_id: Optional[int] = None,
+                         status_message_id: Optional[int] = None,
+                         exclusive: bool = False) -> Optional[int]:
+        """Создать рассылку. exclusive=True — только если нет незавершённой
+        (status='running'), иначе None: проверка и вставка идут одной транзакцией
+        под блокировкой записи, поэтому и воркеры с общей базой не запустят две."""
+        now = datetime.now(timezone.utc).isoformat()
+        params = (admin_id, text, total, status_chat_id, status_message_id, now, now)
+        with self._conn:
+            if not exclusive:
+                cursor = self._conn.execute(
+                    "INSERT INTO broadcasts (admin_id, text, total, status_chat_id, status_message_id, "
+                    "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)", params)
+                return cursor.lastrowid
+            # IMMEDIATE: блокировка записи берётся до проверки, снимок WAL — свежий
+            self._conn.execute("BEGIN IMMEDIATE")
+            cursor = self._conn.execute(
+                "INSERT INTO broadcasts (admin_id, text, total, status_chat_id, status_message_id, "
+                "created_at, updated_at) SELECT ?, ?, ?, ?, ?, ?, ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM broadcasts WHERE status = 'running')", params)
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def get_broadcast(self, broadcast_id: int) -> Optional[Dict]:
+        row = self._conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_unfinished_broadcasts(self) -> List[Dict]:
+        rows = self._conn.execute(
+            "SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id").fetchall()
+        return [dict(r) for r in rows]
+
+    def update_broadcast(self, broadcast_id: int, **fields):
+        """Обновить поля рассылки (last_user_id, sent, failed, status, status_message_id...)."""
+        allowed = {'status', 'status_chat_id', 'status_message_id', 'last_user_id', 'total', 'sent', 'failed'}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"Unknown broadcast fields: {sorted(unknown)}")
+        fields['updated_at'] = datetime.now(timezone.utc).isoformat()
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        with self._conn:
+            self._conn.execute(f"UPDATE broadcasts SET {sets} WHERE id = ?",
+                               list(fields.values()) + [broadcast_id])
+
+    def count_users_with_currency(self, code: str, currency_type: str = None) -> int:
+        """Сколько пользователей выбрали валюту (по индексу idx_user_currencies_code)."""
+        self.flush()
+        if currency_type is None:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM user_currencies WHERE code = ?", (code,)).fetchone()
+        else:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM user_currencies WHERE code = ? AND kind = ?",
+                (code, _currency_kind(currency_type))).fetchone()
+        return row[0]
+
+    # Колонки, доступные для проекции в iter_users (selected_currencies — из user_currencies)
+    USER_COLUMNS = (
+        'user_id', 'processing_mode', 'api_source', 'debug_mode', 'language',
+        'appearance', 'selected_currencies', 'created_at', 'last_activity',
+    )
+
+    def fetch_users_page(self, after_user_id: Optional[int] = None, limit: int = 1000,
+                         columns: Optional[Iterable[str]] = None) -> List[Dict]:
+        """Одна страница пользователей с user_id > after_user_id (keyset-пагинация).
+
+        columns — проекция из USER_COLUMNS (user_id добавляется всегда);
+        None — все поля, как в get_user. Буфер записи сбрасывается перед чтением."""
+        self.flush()
+        if columns is None:
+            columns = self.USER_COLUMNS
         else:
-            self._update(user_id, selected_fiat='[]', selected_crypto='[]')
+            unknown = set(columns) - set(self.USER_COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown columns: {sorted(unknown)}. Must be from {self.USER_COLUMNS}")
+            columns = ['user_id'] + [c for c in self.USER_COLUMNS if c in columns and c != 'user_id']
+        with_selected = 'selected_currencies' in columns
+        sql_columns = ", ".join(c for c in columns if c != 'selected_currencies')
+
+        rows = self._conn.execute(
+            f"SELECT {sql_columns} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after_user_id if after_user_id is not None else -2 ** 63, limit),
+        ).fetchall()
+        if not rows:
+            return []
+
+        selected: Dict[int, Dict[str, List[str]]] = {}
+        if with_selected:
+            for row in self._conn.execute(
+                    "SELECT user_id, kind, code FROM user_currencies WHERE user_id BETWEEN ? AND ? "
+                    "ORDER BY user_id, kind, position",
+                    (rows[0]['user_id'], rows[-1]['user_id'])):
+                selected.setdefault(row['user_id'], {'fiat': [], 'crypto': []})[row['kind']].append(row['code'])
+
+        page = []
+        for row in rows:
+            user = {}
+            for column in columns:
+                if column == 'selected_currencies':
+                    user[column] = selected.get(row['user_id'], {'fiat': [], 'crypto': []})
+                elif column == 'debug_mode':
+                    user[column] = bool(row[column])
+                elif column == 'appearance':
+                    user[column] = json.loads(row[column])
+                else:
+                    user[column] = row[column]
+            page.append(user)
+        return page
+
+    def iter_users(self, batch_size: int = 1000,
+                   columns: Optional[Iterable[str]] = None) -> Iterator[Dict]:
+        """Все пользователи по возрастанию user_id, страницами по batch_size.
+
+        Память — O(batch_size): курсор между страницами не держится, так что
+        во время обхода можно писать в базу."""
+        columns = list(columns) if columns is not None else None
+        after = None
+        while True:
+            page = self.fetch_users_page(after, batch_size, columns)
+            if not page:
+                return
+            yield from page
+            after = page[-1]['user_id']
 
     def get_all_users(self) -> List[Dict]:
-        cursor = self._conn.execute("SELECT * FROM users")
-        rows = cursor.fetchall()
-        return [self._row_to_dict(r) for r in rows]
+        return list(self.iter_users())
 
-    def _row_to_dict(self, row: sqlite3.Row) -> Dict:
+    def _row_to_dict(self, row: sqlite3.Row, selected: Dict[str, List[str]]) -> Dict:
         return {
             'user_id': row['user_id'],
             'processing_mode': row['processing_mode'],
@@ -189,14 +615,176 @@ class UserDatabase:
             'debug_mode': bool(row['debug_mode']),
             'language': row['language'],
             'appearance': json.loads(row['appearance']),
-            'selected_currencies': {
-                'fiat': json.loads(row['selected_fiat']),
-                'crypto': json.loads(row['selected_crypto']),
-            },
+            'selected_currencies': selected,
             'created_at': row['created_at'],
             'last_activity': row['last_activity'],
         }
 
     def delete_user(self, user_id: int):
-        self._conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-        self._conn.commit()
+        self._pending_inserts.pop(user_id, None)
+        self._pending.pop(user_id, None)
+        self._pending_currency_ops = [op for op in self._pending_currency_ops if op[0] != user_id]
+        with self._conn:
+            self._conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+            self._conn.execute(_CLEAR_ALL_SQL, (user_id,))
+        with self._cache_lock:
+            self._cache.pop(user_id)
+
+
+class AsyncUserDatabase:
+    """Асинхронный фасад над UserDatabase.
+
+    Все обращения к SQLite выполняются в одном выделенном потоке
+    (коммиты с fsync в WAL не блокируют event loop). Чтения профиля,
+    который уже лежит в кэше, отвечаются сразу, без перехода в поток."""
+
+    def __init__(self, db_path: str = "data/users.db", cache_size: int = 10000,
+                 max_pending: int = 500):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="userdb")
+        self._db = UserDatabase(db_path, cache_size=cache_size, check_same_thread=False,
+                                max_pending=max_pending)
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def db_path(self) -> str:
+        return self._db.db_path
+
+    async def _run(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _read(self, user_id: int, field: Callable[[Dict], Any]) -> Any:
+        user = self._db.cached_user(user_id)
+        if user is None:
+            user = await self._run(self._db.get_user, user_id)
+        return field(user)
+
+    async def close(self):
+        """Остановить периодический flush, дописать буфер и закрыть соединение."""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+
+    async def flush(self) -> int:
+        return await self._run(self._db.flush)
+
+    def start_background_flush(self, interval: float = 1.0):
+        """Периодически сбрасывать буфер записи (вызывать из работающего loop)."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop(interval))
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                written = await self.flush()
+                if written:
+                    logger.debug("Сброшен буфер записи: %s польз.", written)
+            except Exception as e:
+                logger.warning("Ошибка записи буфера пользователей: %s", e)
+
+    def cache_stats(self) -> Dict[str, float]:
+        return self._db.cache_stats()
+
+    # ── Чтение ───────────────────────────────────────────────
+
+    async def get_user(self, user_id: int) -> Dict:
+        return await self._read(user_id, lambda u: u)
+
+    async def get_processing_mode(self, user_id: int) -> str:
+        return await self._read(user_id, lambda u: u['processing_mode'])
+
+    async def get_api_source(self, user_id: int) -> str:
+        return await self._read(user_id, lambda u: u['api_source'])
+
+    async def get_debug_mode(self, user_id: int) -> bool:
+        return await self._read(user_id, lambda u: u['debug_mode'])
+
+    async def get_language(self, user_id: int) -> str:
+        return await self._read(user_id, lambda u: u['language'])
+
+    async def get_appearance(self, user_id: int) -> Dict:
+        return await self._read(user_id, lambda u: u['appearance'])
+
+    async def get_selected_currencies(self, user_id: int) -> Dict[str, List[str]]:
+        return await self._read(user_id, lambda u: u['selected_currencies'])
+
+    async def get_all_users(self) -> List[Dict]:
+        return await self._run(self._db.get_all_users)
+
+    async def iter_users(self, batch_size: int = 1000,
+                         columns: Optional[Iterable[str]] = None) -> AsyncIterator[Dict]:
+        """Асинхронный обход пользователей: каждая страница читается в потоке БД."""
+        columns = list(columns) if columns is not None else None
+        after = None
+        while True:
+            page = await self._run(self._db.fetch_users_page, after, batch_size, columns)
+            if not page:
+                return
+            for user in page:
+                yield user
+            after = page[-1]['user_id']
+
+    async def fetch_users_page(self, after_user_id: Optional[int] = None, limit: int = 1000,
+                               columns: Optional[Iterable[str]] = None) -> List[Dict]:
+        return await self._run(self._db.fetch_users_page, after_user_id, limit, columns)
+
+    async def count_users(self) -> int:
+        return await self._run(self._db.count_users)
+
+    async def create_broadcast(self, admin_id: int, text: str, total: int,
+                               status_chat_id: Optional[int] = None,
+                               status_message_id: Optional[int] = None,
+                               exclusive: bool = False) -> Optional[int]:
+        return await self._run(self._db.create_broadcast, admin_id, text, total,
+                               status_chat_id, status_message_id, exclusive)
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict]:
+        return await self._run(self._db.get_broadcast, broadcast_id)
+
+    async def get_unfinished_broadcasts(self) -> List[Dict]:
+        return await self._run(self._db.get_unfinished_broadcasts)
+
+    async def update_broadcast(self, broadcast_id: int, **fields):
+        await self._run(self._db.update_broadcast, broadcast_id, **fields)
+
+    async def count_users_with_currency(self, code: str, currency_type: str = None) -> int:
+        return await self._run(self._db.count_users_with_currency, code, currency_type)
+
+    # ── Запись ───────────────────────────────────────────────
+
+    async def update_user(self, user_id: int, **kwargs):
+        await self._run(self._db.update_user, user_id, **kwargs)
+
+    async def set_processing_mode(self, user_id: int, mode: str):
+        await self._run(self._db.set_processing_mode, user_id, mode)
+
+    async def set_api_source(self, user_id: int, source: str):
+        await self._run(self._db.set_api_source, user_id, source)
+
+    async def set_debug_mode(self, user_id: int, enabled: bool):
+        await self._run(self._db.set_debug_mode, user_id, enabled)
+
+    async def set_language(self, user_id: int, language: str):
+        await self._run(self._db.set_language, user_id, language)
+
+    async def set_appearance(self, user_id: int, **kwargs):
+        await self._run(self._db.set_appearance, user_id, **kwargs)
+
+    async def add_selected_currency(self, user_id: int, currency_type: str, currency_code: str):
+        await self._run(self._db.add_selected_currency, user_id, currency_type, currency_code)
+
+    async def remove_selected_currency(self, user_id: int, currency_type: str, currency_code: str):
+        await self._run(self._db.remove_selected_currency, user_id, currency_type, currency_code)
+
+    async def clear_selected_currencies(self, user_id: int, currency_type: str = None):
+        await self._run(self._db.clear_selected_currencies, user_id, currency_type)
+
+    async def delete_user(self, user_id: int):
+        await self._run(self._db.delete_user, user_id)
@@ -1,6 +1,6 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config import FIAT_CURRENCIES, CRYPTO_CURRENCIES
-from typing import List
+from typing import Dict, Iterable, List, Set, Tuple
 
 def get_main_menu_keyboard(lang: str = 'ru') -> InlineKeyboardMarkup:
 	"""Главное меню бота"""
@@ -36,16 +36,68 @@ def get_currency_type_keyboard(lang: str = 'ru') -> InlineKeyboardMarkup:
 	])
 	return keyboard
 
-def get_letter_keyboard(currency_type: str, lang: str = 'ru') -> InlineKeyboardMarkup:
-	"""Клавиатура с буквами для выбора валюты"""
-	currencies = FIAT_CURRENCIES if currency_type == "fiat" else CRYPTO_CURRENCIES
-	available_letters = set()
-	for code in currencies.keys():
-		if code and len(code) >= 1:
-			available_letters.add(code[0].upper())
+# ── Предрасчитанные клавиатуры выбора валют ──────────────────
+# Строятся один раз при импорте: индекс буква → валюты, разбиение букв на
+# страницы, клавиатуры букв и кнопки валют в обоих состояниях (✅/❌).
+# Буква и страница каждой валюты известны заранее, поэтому callback_data
+# кнопки (select_currency_{тип}_{код}_{буква}_{страница}) тоже статична:
+# на клик остаётся выбрать вариант кнопки для валют одной страницы.
+# Готовые объекты общие для всех пользователей — не изменять их.
+
+PAGE_SIZE = 8  # валют на странице (4 ряда по 2)
+
+_LANGS = ('ru', 'en')
+_CURRENCY_TYPES = {'fiat': FIAT_CURRENCIES, 'crypto': CRYPTO_CURRENCIES}
+
+
+def _lang_key(lang: str) -> str:
+	# Как и в остальных клавиатурах: всё, что не 'ru', — английский
+	return 'ru' if lang == 'ru' else 'en'
+
+
+def _currency_type_key(currency_type: str) -> str:
+	return 'fiat' if currency_type == 'fiat' else 'crypto'
+
+
+def _build_letter_index(currencies: Dict[str, str]) -> Dict[str, Tuple[Tuple[str, str], ...]]:
+	"""Буква → ((код, название), ...) в порядке объявления в config."""
+	index: Dict[str, List[Tuple[str, str]]] = {}
+	for code, name in currencies.items():
+		if code:
+			index.setdefault(code[0].upper(), []).append((code, name))
+	return {letter: tuple(items) for letter, items in sorted(index.items())}
+
+
+LETTER_INDEX: Dict[str, Dict[str, Tuple[Tuple[str, str], ...]]] = {
+	currency_type: _build_letter_index(currencies)
+	for currency_type, currencies in _CURRENCY_TYPES.items()
+}
+
+# Тип → код → (буква, страница)
+CURRENCY_PAGES: Dict[str, Dict[str, Tuple[str, int]]] = {
+	currency_type: {
+		code: (letter, position // PAGE_SIZE)
+		for letter, items in index.items()
+		for position, (code, _) in enumerate(items)
+	}
+	for currency_type, index in LETTER_INDEX.items()
+}
+
+
+def page_count(currency_type: str, letter: str) -> int:
+	items = LETTER_INDEX[_currency_type_key(currency_type)].get(letter.upper(), ())
+	return max(1, -(-len(items) // PAGE_SIZE))
+
+
+def find_currency_page(currency_type: str, code: str) -> Tuple[str, int]:
+	"""Буква и страница, на которой находится валюта."""
+	return CURRENCY_PAGES[_currency_type_key(currency_type)].get(code, (code[:1].upper(), 0))
+
+
+def _build_letter_keyboard(currency_type: str, lang: str) -> InlineKeyboardMarkup:
 	buttons = []
 	current_row = []
-	for letter in sorted(available_letters):
+	for letter in LETTER_INDEX[currency_type]:
 		current_row.append(InlineKeyboardButton(
 			text=letter,
 			callback_data=f"letter_{currency_type}_{letter}"
@@ -59,31 +111,102 @@ def get_letter_keyboard(currency_type: str, lang: str = 'ru') -> InlineKeyboardM
 	buttons.append([InlineKeyboardButton(text=back_type_text, callback_data="back_to_currency_selection")])
 	return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def get_currencies_by_letter_keyboard(currency_type: str, letter: str, selected_codes: List[str] = None, lang: str = 'ru') -> InlineKeyboardMarkup:
-	"""Клавиатура с валютами, начинающимися на определенную букву"""
-	currencies = FIAT_CURRENCIES if currency_type == "fiat" else CRYPTO_CURRENCIES
-	selected_codes = selected_codes or []
-	filtered_currencies = []
-	for code, name in currencies.items():
-		if code.startswith(letter.upper()):
-			filtered_currencies.append((code, name))
+
+def _build_currency_buttons(currency_type: str) -> Dict[str, Tuple[InlineKeyboardButton, InlineKeyboardButton]]:
+	"""Код → (кнопка «не выбрана», кнопка «выбрана»)."""
+	buttons = {}
+	for code, name in _CURRENCY_TYPES[currency_type].items():
+		letter, page = CURRENCY_PAGES[currency_type][code]
+		callback_data = f"select_currency_{currency_type}_{code}_{letter}_{page}"
+		buttons[code] = (
+			InlineKeyboardButton(text=f"❌ {name}", callback_data=callback_data),
+			InlineKeyboardButton(text=f"✅ {name}", callback_data=callback_data),
+		)
+	return buttons
+
+
+def _build_page_nav(currency_type: str, letter: str, page: int, pages: int) -> List[InlineKeyboardButton]:
+	"""◀️ n/m ▶️ — стрелки листают по кругу."""
+	return [
+		InlineKeyboardButton(text="◀️", callback_data=f"page_{currency_type}_{letter}_{(page - 1) % pages}"),
+		InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="noop"),
+		InlineKeyboardButton(text="▶️", callback_data=f"page_{currency_type}_{letter}_{(page + 1) % pages}"),
+	]
+
+
+def _build_nav_rows(currency_type: str, lang: str) -> Tuple[List[InlineKeyboardButton], ...]:
+	back_letters_text = "⬅️ Назад к буквам" if lang == 'ru' else "⬅️ Back to letters"
+	back_type_text = "⬅️ Назад к типу валют" if lang == 'ru' else "⬅️ Back to type"
+	return (
+		[InlineKeyboardButton(text=back_letters_text, callback_data=f"back_to_letters_{currency_type}")],
+		[InlineKeyboardButton(text=back_type_text, callback_data="back_to_currency_selection")],
+	)
+
+
+_LETTER_KEYBOARDS = {
+	(currency_type, lang): _build_letter_keyboard(currency_type, lang)
+	for currency_type in _CURRENCY_TYPES for lang in _LANGS
+}
+_CURRENCY_BUTTONS = {currency_type: _build_currency_buttons(currency_type) for currency_type in _CURRENCY_TYPES}
+_PAGE_NAV = {
+	(currency_type, letter, page): _build_page_nav(currency_type, letter, page, page_count(currency_type, letter))
+	for currency_type, index in LETTER_INDEX.items()
+	for letter in index
+	for page in range(page_count(currency_type, letter))
+	if page_count(currency_type, letter) > 1
+}
+_NAV_ROWS = {
+	(currency_type, lang): _build_nav_rows(currency_type, lang)
+	for currency_type in _CURRENCY_TYPES for lang in _LANGS
+}
+
+
+def _overlay_rows(currency_type: str, codes: Iterable[str], selected: Set[str]) -> List[List[InlineKeyboardButton]]:
+	"""Готовые кнопки валют по 2 в ряд с отметкой выбранных."""
+	variants = _CURRENCY_BUTTONS[currency_type]
 	buttons = []
 	current_row = []
-	for code, name in filtered_currencies:
-		check = "✅ " if code in selected_codes else "❌ "
-		current_row.append(InlineKeyboardButton(
-			text=f"{check}{name}",
-			callback_data=f"select_currency_{currency_type}_{code}"
-		))
+	for code in codes:
+		current_row.append(variants[code][code in selected])
 		if len(current_row) == 2:
 			buttons.append(current_row)
 			current_row = []
 	if current_row:
 		buttons.append(current_row)
-	back_letters_text = "⬅️ Назад к буквам" if lang == 'ru' else "⬅️ Back to letters"
-	buttons.append([InlineKeyboardButton(text=back_letters_text, callback_data=f"back_to_letters_{currency_type}")])
-	back_type_text = "⬅️ Назад к типу валют" if lang == 'ru' else "⬅️ Back to type"
-	buttons.append([InlineKeyboardButton(text=back_type_text, callback_data="back_to_currency_selection")])
+	return buttons
+
+
+def get_letter_keyboard(currency_type: str, lang: str = 'ru') -> InlineKeyboardMarkup:
+	"""Клавиатура с буквами для выбора валюты (готовая, из кэша)"""
+	return _LETTER_KEYBOARDS[(_currency_type_key(currency_type), _lang_key(lang))]
+
+def get_currencies_by_letter_keyboard(currency_type: str, letter: str, selected_codes: Iterable[str] = None,
+									  lang: str = 'ru', page: int = 0) -> InlineKeyboardMarkup:
+	"""Страница клавиатуры с валютами, начинающимися на определенную букву.
+	Работа — O(размер страницы): из готовых кнопок выбирается вариант ✅/❌."""
+	currency_type = _currency_type_key(currency_type)
+	letter = letter.upper()
+	items = LETTER_INDEX[currency_type].get(letter, ())
+	pages = page_count(currency_type, letter)
+	page = min(max(page, 0), pages - 1)
+	start = page * PAGE_SIZE
+	buttons = _overlay_rows(
+		currency_type, (code for code, _ in items[start:start + PAGE_SIZE]), set(selected_codes or ()))
+	if pages > 1:
+		buttons.append(_PAGE_NAV[(currency_type, letter, page)])
+	buttons.extend(_NAV_ROWS[(currency_type, _lang_key(lang))])
+	return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def get_search_results_keyboard(results: Iterable[Tuple[str, str]], selected: Dict[str, List[str]],
+								lang: str = 'ru') -> InlineKeyboardMarkup:
+	"""Результаты /find: те же кнопки валют, что и на страницах букв
+	(нажатие переключает валюту и открывает её страницу)."""
+	results = list(results)
+	buttons = []
+	for currency_type in _CURRENCY_TYPES:
+		codes = [code for result_type, code in results if result_type == currency_type]
+		buttons.extend(_overlay_rows(currency_type, codes, set(selected.get(currency_type, ()))))
+	buttons.append(_NAV_ROWS[('fiat', _lang_key(lang))][1])
 	return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 def get_settings_keyboard(lang: str = 'ru') -> InlineKeyboardMarkup:
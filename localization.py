@@ -113,6 +113,20 @@ TEXTS: dict[str, dict[str, str]] = {
         'debug_changed': "Режим отладки обновлен!",
         'added_currency': "Добавлена валюта: {name}",
         'removed_currency': "Убрана валюта: {name}",
+        'find_usage': "Использование: /find <код, название или сленг валюты>, например /find доллар",
+        'find_nothing': "🔎 По запросу «{query}» валют не найдено.",
+        'find_results': "🔎 «{query}»: найдено {count}. Нажмите, чтобы добавить или убрать валюту:",
+        'admin_only': "⛔ Команда доступна только администраторам.",
+        'broadcast_usage': "Использование: /broadcast <текст сообщения>",
+        'broadcast_busy': "📣 Рассылка уже идёт — дождитесь её завершения.",
+        'broadcast_started': "📣 Рассылка #{id} запущена: {total} получателей.",
+        'broadcast_progress': (
+            "📣 Рассылка #{id}: {done}/{total} ({percent}%)\n"
+            "✅ Доставлено: {sent}  ❌ Ошибок: {failed}\n"
+            "⚡ {rate} сообщ./с, осталось ≈ {eta}"
+        ),
+        'broadcast_done': "✅ Рассылка #{id} завершена за {elapsed}: доставлено {sent}, ошибок {failed}.",
+        'broadcast_failed': "❌ Рассылка #{id} прервана: {error}",
     },
     'en': {
         'welcome': (
@@ -226,6 +240,20 @@ TEXTS: dict[str, dict[str, str]] = {
         'debug_changed': "Debug mode updated!",
         'added_currency': "Added currency: {name}",
         'removed_currency': "Removed currency: {name}",
+        'find_usage': "Usage: /find <currency code, name or slang>, e.g. /find dollar",
+        'find_nothing': "🔎 No currencies found for “{query}”.",
+        'find_results': "🔎 “{query}”: {count} found. Tap to add or remove a currency:",
+        'admin_only': "⛔ This command is available to administrators only.",
+        'broadcast_usage': "Usage: /broadcast <message text>",
+        'broadcast_busy': "📣 A broadcast is already running — wait for it to finish.",
+        'broadcast_started': "📣 Broadcast #{id} started: {total} recipients.",
+        'broadcast_progress': (
+            "📣 Broadcast #{id}: {done}/{total} ({percent}%)\n"
+            "✅ Delivered: {sent}  ❌ Failed: {failed}\n"
+            "⚡ {rate} msg/s, ≈ {eta} left"
+        ),
+        'broadcast_done': "✅ Broadcast #{id} finished in {elapsed}: {sent} delivered, {failed} failed.",
+        'broadcast_failed': "❌ Broadcast #{id} aborted: {error}",
     },
 }
 
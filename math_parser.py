@@ -1,5 +1,147 @@
+import math
 import re
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Tuple
+
+from lru_cache import LRUCache
+
+# Ограничения, делающие стоимость разбора предсказуемой
+MAX_EXPRESSION_LENGTH = 200   # символов после очистки
+MAX_NUMBER_DIGITS = 15        # цифр в одном операнде (точность float)
+MAX_NESTING = 32              # глубина скобок и унарных минусов
+
+_TOKEN_RE = re.compile(r'(\d+(?:\.\d*)?|\.\d+)(кк|к)?|([-+*/()])')
+_SUFFIXES = {'к': 1_000, 'кк': 1_000_000}
+_PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2}
+_BINARY_OPS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+}
+
+
+class ExpressionError(ValueError):
+    """Выражение не соответствует грамматике или превышает ограничения."""
+
+
+class CompiledExpression:
+    """Разобранное выражение, готовое к многократному вычислению.
+    Дерево разбора свёрнуто в замыкания, так что evaluate() не разбирает строку заново."""
+
+    __slots__ = ('source', '_fn')
+
+    def __init__(self, source: str, fn: Callable[[], float]):
+        self.source = source
+        self._fn = fn
+
+    def evaluate(self) -> Optional[float]:
+        """Значение выражения или None при делении на ноль / переполнении."""
+        try:
+            result = self._fn()
+        except (ZeroDivisionError, OverflowError):
+            return None
+        if not math.isfinite(result):
+            return None
+        return float(result)
+
+    def __repr__(self) -> str:
+        return f"CompiledExpression({self.source!r})"
+
+
+def _tokenize(expression: str) -> List[Tuple[str, float]]:
+    """Разбить очищенное выражение на токены ('num', значение) и ('op', символ)."""
+    tokens = []
+    pos = 0
+    while pos < len(expression):
+        match = _TOKEN_RE.match(expression, pos)
+        if not match:
+            raise ExpressionError(f"Unexpected character {expression[pos]!r} at {pos}")
+        number, suffix, op = match.groups()
+        if number is not None:
+            if sum(c.isdigit() for c in number) > MAX_NUMBER_DIGITS:
+                raise ExpressionError("Operand is too long")
+            value = float(number) * _SUFFIXES.get(suffix, 1)
+            tokens.append(('num', value))
+        else:
+            tokens.append(('op', op))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """Разбор методом precedence climbing: +,- < *,/ < унарный минус < скобки."""
+
+    def __init__(self, tokens: List[Tuple[str, float]]):
+        self.tokens = tokens
+        self.pos = 0
+        self.depth = 0
+
+    def parse(self) -> Callable[[], float]:
+        if not self.tokens:
+            raise ExpressionError("Empty expression")
+        node = self._expression(1)
+        if self.pos != len(self.tokens):
+            raise ExpressionError(f"Unexpected token at {self.pos}")
+        return node
+
+    def _peek(self) -> Optional[Tuple[str, float]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _expression(self, min_precedence: int) -> Callable[[], float]:
+        left = self._unary()
+        while True:
+            token = self._peek()
+            if token is None or token[0] != 'op' or token[1] not in _PRECEDENCE:
+                return left
+            precedence = _PRECEDENCE[token[1]]
+            if precedence < min_precedence:
+                return left
+            self.pos += 1
+            right = self._expression(precedence + 1)
+            left = self._binary(_BINARY_OPS[token[1]], left, right)
+
+    def _unary(self) -> Callable[[], float]:
+        token = self._peek()
+        if token is None:
+            raise ExpressionError("Unexpected end of expression")
+        kind, value = token
+        if kind == 'num':
+            self.pos += 1
+            return lambda: value
+        if value == '-':
+            self.pos += 1
+            operand = self._nested(self._unary)
+            return lambda: -operand()
+        if value == '(':
+            self.pos += 1
+            inner = self._nested(lambda: self._expression(1))
+            if self._peek() != ('op', ')'):
+                raise ExpressionError("Unbalanced parentheses")
+            self.pos += 1
+            return inner
+        raise ExpressionError(f"Unexpected operator {value!r}")
+
+    def _nested(self, parse: Callable[[], Callable[[], float]]) -> Callable[[], float]:
+        self.depth += 1
+        if self.depth > MAX_NESTING:
+            raise ExpressionError("Expression is nested too deeply")
+        node = parse()
+        self.depth -= 1
+        return node
+
+    @staticmethod
+    def _binary(op: Callable[[float, float], float],
+                left: Callable[[], float], right: Callable[[], float]) -> Callable[[], float]:
+        return lambda: op(left(), right())
+
+
+def compile_expression(expression: str) -> CompiledExpression:
+    """Скомпилировать очищенное выражение (без пробелов, только 0-9 . к + - * / ( )).
+    Бросает ExpressionError, если выражение некорректно или слишком велико."""
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError("Expression is too long")
+    return CompiledExpression(expression, _Parser(_tokenize(expression)).parse())
+
 
 class MathParser:
     """Парсер математических выражений с поддержкой валют"""
@@ -25,6 +167,9 @@ class MathParser:
             '÷': 'truediv',
             '⋅': 'mul',
         }
+
+        # Скомпилированные выражения переиспользуются между сообщениями
+        self._compiled = LRUCache(1024)
     
     def extract_math_expression(self, text: str) -> Optional[Tuple[str, str]]:
         """
@@ -113,6 +258,23 @@ class MathParser:
         # Для выражений без скобок достаточно операторов и чисел
         return has_operators and has_numbers
     
+    def compile(self, expression: str) -> Optional[CompiledExpression]:
+        """
+        Очищает и компилирует выражение, переиспользуя ранее скомпилированные
+
+        Returns:
+            CompiledExpression или None, если выражение некорректно
+        """
+        clean_expr = self._clean_expression(expression)
+        compiled = self._compiled.get(clean_expr)
+        if compiled is None:
+            try:
+                compiled = compile_expression(clean_expr)
+            except ExpressionError:
+                return None
+            self._compiled.set(clean_expr, compiled)
+        return compiled
+
     def evaluate_expression(self, expression: str) -> Optional[float]:
         """
         Вычисляет математическое выражение
@@ -123,39 +285,10 @@ class MathParser:
         Returns:
             float или None: Результат вычисления
         """
-        try:
-            # Очищаем выражение
-            clean_expr = self._clean_expression(expression)
-            
-            # Обрабатываем суффиксы к/кк перед вычислением
-            clean_expr = self._process_suffixes(clean_expr)
-            
-            # Проверяем безопасность выражения
-            if not self._is_safe_expression(clean_expr):
-                return None
-            
-            # Вычисляем выражение безопасно
-            try:
-                result = eval(clean_expr, {"__builtins__": {}}, {})
-            except (ValueError, SyntaxError, ZeroDivisionError, NameError):
-                return None
-            
-            # Проверяем, что результат - число
-            if isinstance(result, (int, float)):
-                return float(result)
-            
+        compiled = self.compile(expression)
+        if compiled is None:
             return None
-            
-        except (ValueError, SyntaxError, ZeroDivisionError, NameError):
-            return None
-    
-    def _process_suffixes(self, expression: str) -> str:
-        """Обрабатывает суффиксы к/кк в математическом выражении"""
-        # Заменяем кк на *1000000
-        expression = re.sub(r'(\d+)кк', r'\1*1000000', expression)
-        # Заменяем к на *1000
-        expression = re.sub(r'(\d+)к', r'\1*1000', expression)
-        return expression
+        return compiled.evaluate()
     
     def _clean_expression(self, expression: str) -> str:
         """Очищает математическое выражение"""
@@ -185,29 +318,6 @@ class MathParser:
         
         return expression
     
-    def _is_safe_expression(self, expression: str) -> bool:
-        """Проверяет безопасность математического выражения"""
-        # Разрешенные символы
-        allowed_chars = set('0123456789+-*/.() ')
-        
-        # Проверяем, что выражение содержит только разрешенные символы
-        if not all(c in allowed_chars for c in expression):
-            return False
-        
-        # Проверяем баланс скобок
-        if expression.count('(') != expression.count(')'):
-            return False
-        
-        # Проверяем, что нет подряд идущих операторов
-        if re.search(r'[\+\-\*\/]{2,}', expression):
-            return False
-        
-        # Проверяем, что выражение не начинается с оператора (кроме минуса)
-        if expression and expression[0] in ['+', '*', '/']:
-            return False
-        
-        return True
-    
     def parse_and_evaluate(self, text: str) -> Optional[Tuple[float, str]]:
         """
         Парсит текст, извлекает математическое выражение и вычисляет его
@@ -0,0 +1,62 @@
+"""Middleware aiogram: контекст пользователя на время обработки апдейта."""
+
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+@dataclass
+class UserContext:
+    """Настройки пользователя, загруженные одним вызовом get_user.
+
+    Хендлеры читают поля отсюда, а после записи в базу обновляют
+    контекст сами — повторно в базу за тем же профилем не ходят."""
+
+    user_id: int
+    language: str = 'ru'
+    processing_mode: str = 'standard'
+    api_source: str = 'auto'
+    debug_mode: bool = False
+    appearance: Dict[str, bool] = field(default_factory=dict)
+    selected: Dict[str, List[str]] = field(default_factory=lambda: {'fiat': [], 'crypto': []})
+
+    @classmethod
+    def from_user(cls, user: Dict) -> 'UserContext':
+        return cls(
+            user_id=user['user_id'],
+            language=user['language'],
+            processing_mode=user['processing_mode'],
+            api_source=user['api_source'],
+            debug_mode=user['debug_mode'],
+            appearance=user['appearance'],
+            selected=user['selected_currencies'],
+        )
+
+    def selected_codes(self, currency_type: str) -> List[str]:
+        return self.selected['fiat'] if currency_type == 'fiat' else self.selected['crypto']
+
+    @property
+    def targets(self) -> List[str]:
+        """Все выбранные валюты (новый список, можно изменять)."""
+        return self.selected['fiat'] + self.selected['crypto']
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Загружает UserContext для автора апдейта и передаёт его
+    в хендлер аргументом user_ctx. db — AsyncUserDatabase."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = getattr(event, 'from_user', None)
+        if user is not None:
+            data['user_ctx'] = UserContext.from_user(await self.db.get_user(user.id))
+        return await handler(event, data)
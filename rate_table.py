@@ -0,0 +1,348 @@
+"""Компактная таблица курсов к USD в общей памяти.
+
+Индекс валют фиксирован (FIAT_CURRENCIES + CRYPTO_CURRENCIES из config),
+курсы провайдера — непрерывный массив float64, NaN — курса нет. Таблица
+лежит в mmap: анонимном для одного процесса или в файле для воркеров —
+тогда все процессы читают одни и те же страницы без копий и JSON. Хэш
+раскладки (коды + провайдеры) входит в имя файла, поэтому процессы с разной
+раскладкой никогда не делят и не переразмечают один файл.
+
+Согласованность — seqlock на слот провайдера: писатель делает счётчик
+нечётным, пишет курсы и возвращает его в чётное значение; читатель
+повторяет чтение, если счётчик был нечётным или изменился. Писатели
+разных процессов сериализуются flock на файле таблицы.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from contextlib import contextmanager
+from itertools import repeat
+from typing import Callable, Dict, Optional, Sequence, Tuple, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # Windows: только анонимная таблица одного процесса
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: convert_batch работает и на array
+    np = None
+
+from config import CRYPTO_CURRENCIES, FIAT_CURRENCIES
+
+logger = logging.getLogger(__name__)
+
+CODES: Tuple[str, ...] = tuple(dict.fromkeys([*FIAT_CURRENCIES, *CRYPTO_CURRENCIES]))
+INDEX: Dict[str, int] = {code: i for i, code in enumerate(CODES)}
+
+_MAGIC = b'NKRATES1'
+# magic, число валют, число слотов, crc32 раскладки (коды + провайдеры)
+_HEADER = struct.Struct('<8sIII')
+_HEADER_SIZE = 64
+# seq (uint64) + timestamp (float64), затем курсы
+_SLOT_HEADER_SIZE = 16
+# С какого размера пакета convert_batch считает через NumPy (на мелких
+# пакетах накладные расходы NumPy больше выигрыша)
+NUMPY_MIN_BATCH = 64
+# Сколько раз читатель повторяет чтение слота, прежде чем сдаться
+# (нечётный seq навсегда остаётся только после падения писателя)
+_MAX_READ_ATTEMPTS = 10000
+
+T = TypeVar('T')
+
+
+class RateTable:
+    """Слоты курсов по провайдерам: rates[index[code]] — единиц code за 1 USD.
+
+    path=None — анонимный mmap (один процесс), иначе файл <path>.<хэш
+    раскладки>, общий для процессов с той же раскладкой (self.path — итоговое
+    имя). Повреждённый файл не трогается (его может держать в mmap другой
+    процесс): таблица тогда остаётся анонимной, а self.path — None."""
+
+    def __init__(self, providers: Sequence[str], path: Optional[str] = None,
+                 codes: Sequence[str] = CODES):
+        self.providers = tuple(providers)
+        self.codes = tuple(codes)
+        self.index = INDEX if self.codes == CODES else {code: i for i, code in enumerate(self.codes)}
+        self.path = path
+        self.stats = {'publishes': 0, 'read_retries': 0}
+
+        slot_size = _SLOT_HEADER_SIZE + 8 * len(self.codes)
+        size = _HEADER_SIZE + slot_size * len(self.providers)
+        layout = zlib.crc32('\n'.join(self.codes + ('',) + self.providers).encode())
+        header = _HEADER.pack(_MAGIC, len(self.codes), len(self.providers), layout)
+
+        self._fd: Optional[int] = None
+        self._mm: Optional[mmap.mmap] = None
+        if path is not None:
+            if fcntl is None:
+                raise ValueError("file-backed RateTable needs fcntl (POSIX)")
+            self.path = f"{path}.{layout:08x}"
+            self._mm = self._attach_file(size, header)
+        if self._mm is None:
+            self.path = None
+            self._mm = mmap.mmap(-1, size)
+            self._mm[:_HEADER.size] = header
+
+        buf = memoryview(self._mm)
+        self._slots: Dict[str, Tuple[memoryview, memoryview, memoryview]] = {}
+        for i, name in enumerate(self.providers):
+            offset = _HEADER_SIZE + i * slot_size
+            self._slots[name] = (
+                buf[offset:offset + 8].cast('Q'),
+                buf[offset + 8:offset + 16].cast('d'),
+                buf[offset + _SLOT_HEADER_SIZE:offset + slot_size].cast('d'),
+            )
+        self._buf = buf
+
+    def _attach_file(self, size: int, header: bytes) -> Optional[mmap.mmap]:
+        """Отобразить файл таблицы, разметив его, если он только что создан.
+        None — файл другого размера или с чужим заголовком."""
+        dir_name = os.path.dirname(self.path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._write_lock():
+            current = os.fstat(self._fd).st_size
+            if current == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, header, 0)
+                valid = True
+            else:
+                valid = current == size and os.pread(self._fd, _HEADER.size, 0) == header
+        if valid:
+            return mmap.mmap(self._fd, size)
+        logger.warning("Файл таблицы курсов %s повреждён, используем таблицу процесса", self.path)
+        os.close(self._fd)
+        self._fd = None
+        return None
+
+    def close(self):
+        # mmap нельзя закрыть, пока на него есть memoryview
+        for views in self._slots.values():
+            for view in views:
+                view.release()
+        self._slots.clear()
+        self._buf.release()
+        self._mm.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @contextmanager
+    def _write_lock(self):
+        if self._fd is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # ── Запись ───────────────────────────────────────────────
+
+    def publish(self, provider: str, timestamp: float, usd_rates: Dict) -> bool:
+        """Записать USD-снимок провайдера. Коды вне индекса отбрасываются.
+        False — для провайдера нет слота."""
+        slot = self._slots.get(provider)
+        if slot is None:
+            return False
+        values = array('d', [float('nan')]) * len(self.codes)
+        for code, rate in usd_rates.items():
+            i = self.index.get(code)
+            if i is not None and isinstance(rate, (int, float)):
+                values[i] = float(rate)
+        usd = self.index.get('USD')
+        if usd is not None and 'USD' not in usd_rates:
+            values[usd] = 1.0
+
+        seq, stamp, rates = slot
+        with self._write_lock():
+            # Нечётное значение до записи (упавший писатель) тоже приводится к нечётному
+            start = (seq[0] + 1) | 1
+            seq[0] = start
+            stamp[0] = timestamp
+            rates[:] = memoryview(values)
+            seq[0] = start + 1
+        self.stats['publishes'] += 1
+        return True
+
+    # ── Чтение ───────────────────────────────────────────────
+
+    def read(self, provider: str, reader: Callable[[memoryview], T]) -> Optional[Tuple[float, T]]:
+        """Согласованно прочитать слот: (timestamp, reader(rates)) или None,
+        если курсов провайдера нет. reader получает memoryview float64 прямо
+        на общую память (без копирования) и может вызываться повторно,
+        если слот переписали во время чтения."""
+        slot = self._slots.get(provider)
+        if slot is None:
+            return None
+        seq, stamp, rates = slot
+        for _ in range(_MAX_READ_ATTEMPTS):
+            before = seq[0]
+            if before == 0:
+                return None
+            if before & 1:
+                self.stats['read_retries'] += 1
+                continue
+            try:
+                result = (stamp[0], reader(rates))
+            except ArithmeticError:
+                # Разорванное чтение может дать, например, деление на ноль
+                if seq[0] == before:
+                    raise
+                self.stats['read_retries'] += 1
+                continue
+            if seq[0] == before:
+                return result
+            self.stats['read_retries'] += 1
+        return None
+
+    def read_overlay(self, provider: str, overlay: str,
+                     reader: Callable[[memoryview, Optional[memoryview]], T]
+                     ) -> Optional[Tuple[float, T]]:
+        """Как read, но согласованно сразу с двумя слотами: reader(rates,
+        overlay_rates), overlay_rates — None, если курсов overlay нет.
+        Метка времени — слота provider."""
+        slot = self._slots.get(provider)
+        extra = self._slots.get(overlay)
+        if slot is None:
+            return None
+        if extra is None:
+            return self.read(provider, lambda rates: reader(rates, None))
+        seq, stamp, rates = slot
+        extra_seq, _, extra_rates = extra
+        for _ in range(_MAX_READ_ATTEMPTS):
+            before, extra_before = seq[0], extra_seq[0]
+            if before == 0:
+                return None
+            if (before | extra_before) & 1:
+                self.stats['read_retries'] += 1
+                continue
+            try:
+                result = (stamp[0], reader(rates, extra_rates if extra_before else None))
+            except ArithmeticError:
+                if seq[0] == before and extra_seq[0] == extra_before:
+                    raise
+                self.stats['read_retries'] += 1
+                continue
+            if seq[0] == before and extra_seq[0] == extra_before:
+                return result
+            self.stats['read_retries'] += 1
+        return None
+
+    def timestamp(self, provider: str) -> float:
+        """Время снимка провайдера, 0.0 — курсов нет."""
+        result = self.read(provider, _ignore)
+        return result[0] if result else 0.0
+
+    def to_dict(self, provider: str) -> Optional[Tuple[float, Dict[str, float]]]:
+        """(timestamp, {код: курс}) — копия слота для API со словарями."""
+        return self.read(provider, lambda rates: {
+            code: rate for code, rate in zip(self.codes, rates.tolist()) if rate == rate
+        })
+
+
+def _ignore(rates: memoryview) -> None:
+    return None
+
+
+# ── Пакетная конвертация ─────────────────────────────────────
+
+def batch_length(*sequences: Sequence) -> int:
+    """Длина результата с растяжением последовательностей длины 1, как в NumPy."""
+    n = 1
+    for seq in sequences:
+        size = len(seq)
+        if size == 1:
+            continue
+        if n != 1 and size != n:
+            raise ValueError(f"batch sequences have incompatible lengths: {n} and {size}")
+        n = size
+    return n
+
+
+def _stretch(seq: Sequence, n: int) -> Sequence:
+    return seq * n if len(seq) == 1 and n != 1 else seq
+
+
+def convert_batch(rates: Sequence[float], amounts: Sequence[float], from_codes: Sequence[str],
+                  to_codes: Sequence[str], index: Dict[str, int] = INDEX,
+                  use_numpy: Optional[bool] = None,
+                  overlay: Optional[Sequence[float]] = None) -> array:
+    """amounts[k] из from_codes[k] в to_codes[k] по вектору USD-курсов rates.
+
+    Последовательности длины 1 растягиваются на длину остальных: одна сумма
+    в 30 валют — ([a], [from], codes), отчёт по многим парам — три списка
+    одной длины. Результат — array('d'), NaN там, где курса нет (или код
+    вне index). use_numpy=None — NumPy, если он установлен и пакет не меньше
+    NUMPY_MIN_BATCH. overlay — второй вектор того же индекса (курсы крипты
+    от отдельного провайдера): где в нём не NaN, курс берётся из него."""
+    n = batch_length(amounts, from_codes, to_codes)
+    get = index.get
+    if use_numpy is None:
+        use_numpy = np is not None and n >= NUMPY_MIN_BATCH
+    if use_numpy:
+        return _convert_numpy(rates, amounts, [get(code, -1) for code in from_codes],
+                              [get(code, -1) for code in to_codes], n, overlay)
+    if overlay is not None:
+        rates = _Overlay(rates, overlay)
+
+    nan = float('nan')
+    to_idx = map(get, _stretch(to_codes, n), repeat(-1))
+    if len(from_codes) == 1 and len(amounts) == 1:
+        # Частый случай: одна сумма во много валют — пересчёт в USD один раз
+        f = get(from_codes[0], -1)
+        from_rate = rates[f] if f >= 0 else nan
+        usd_amount = amounts[0] / from_rate if from_rate > 0 else nan
+        return array('d', [usd_amount * rates[t] if t >= 0 else nan for t in to_idx])
+
+    from_idx = map(get, _stretch(from_codes, n), repeat(-1))
+    out = array('d')
+    for amount, f, t in zip(_stretch(amounts, n), from_idx, to_idx):
+        from_rate = rates[f] if f >= 0 else nan
+        if from_rate > 0 and t >= 0:
+            out.append(amount * rates[t] / from_rate)
+        else:
+            out.append(nan)
+    return out
+
+
+class _Overlay:
+    """Вектор курсов с наложением: overlay[i], если он есть, иначе base[i].
+    Без копирования — индексы проверяются по мере обращения."""
+
+    __slots__ = ('base', 'overlay')
+
+    def __init__(self, base: Sequence[float], overlay: Sequence[float]):
+        self.base = base
+        self.overlay = overlay
+
+    def __getitem__(self, i: int) -> float:
+        rate = self.overlay[i]
+        return rate if rate == rate else self.base[i]
+
+
+def _convert_numpy(rates: Sequence[float], amounts: Sequence[float], from_idx: Sequence[int],
+                   to_idx: Sequence[int], n: int, overlay: Optional[Sequence[float]] = None) -> array:
+    # memoryview из RateTable asarray не копирует: индексация идёт прямо по общей памяти
+    vector = np.asarray(rates, dtype=np.float64)
+    if overlay is not None:
+        extra = np.asarray(overlay, dtype=np.float64)
+        vector = np.where(np.isnan(extra), vector, extra)
+    from_idx = np.asarray(from_idx, dtype=np.intp)
+    to_idx = np.asarray(to_idx, dtype=np.intp)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        from_rates = np.where(from_idx >= 0, vector[from_idx], np.nan)
+        to_rates = np.where(to_idx >= 0, vector[to_idx], np.nan)
+        from_rates = np.where(from_rates > 0, from_rates, np.nan)
+        result = np.asarray(amounts, dtype=np.float64) * to_rates / from_rates
+    out = array('d')
+    out.frombytes(np.broadcast_to(result, (n,)).tobytes())
+    return out
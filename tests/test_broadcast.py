@@ -0,0 +1,176 @@
+"""Тесты для broadcast (рассылки)."""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from broadcast import Broadcaster, TokenBucket
+from database import AsyncUserDatabase
+
+
+class FakeBot:
+    """Бот-заглушка: пишет отправленное, умеет отвечать ошибками Telegram."""
+
+    def __init__(self, blocked=(), flood_once=()):
+        self.sent = []
+        self.edits = []
+        self.blocked = set(blocked)
+        self.flood_once = set(flood_once)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_message(self, chat_id, text):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method, "bot was blocked by the user")
+        if chat_id in self.flood_once:
+            self.flood_once.discard(chat_id)
+            raise TelegramRetryAfter(method, "Too Many Requests", retry_after=0)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=len(self.sent))
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None):
+        self.edits.append(text)
+
+
+@pytest.fixture
+async def adb(tmp_path):
+    adb = AsyncUserDatabase(str(tmp_path / "users.db"))
+    yield adb
+    await adb.close()
+
+
+async def _wait(broadcaster):
+    await asyncio.gather(*broadcaster._tasks.values())
+
+
+class TestTokenBucket:
+    async def test_rate_limit(self):
+        bucket = TokenBucket(rate=200, capacity=1)
+        started = time.monotonic()
+        for _ in range(21):
+            await bucket.acquire()
+        # Первый токен сразу, остальные 20 — по 5 мс
+        assert time.monotonic() - started >= 0.09
+
+    async def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(rate=1, capacity=5)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        assert time.monotonic() - started < 0.05
+
+    async def test_pause(self):
+        bucket = TokenBucket(rate=1000, capacity=10)
+        bucket.pause(0.05)
+        started = time.monotonic()
+        await bucket.acquire()
+        assert time.monotonic() - started >= 0.045
+
+    def test_invalid_rate(self):
+        with pytest.raises(ValueError):
+            TokenBucket(rate=0)
+
+
+class TestBroadcaster:
+    async def test_delivers_to_all_users(self, adb):
+        for uid in range(1, 11):
+            await adb.get_user(uid)
+        bot = FakeBot(blocked={4}, flood_once={7})
+        broadcaster = Broadcaster(bot, adb, rate=1000, concurrency=3, batch_size=4, report_interval=0)
+        broadcast_id = await broadcaster.start(1, "hello")
+        await _wait(broadcaster)
+
+        recipients = sorted(chat_id for chat_id, text in bot.sent if text == "hello")
+        assert recipients == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+        assert bot.max_in_flight <= 3
+        row = await adb.get_broadcast(broadcast_id)
+        assert row['status'] == 'done'
+        assert (row['sent'], row['failed'], row['last_user_id']) == (9, 1, 10)
+        assert bot.edits and '#%d' % broadcast_id in bot.edits[-1]
+
+    async def test_resume_from_saved_progress(self, adb):
+        for uid in range(1, 8):
+            await adb.get_user(uid)
+        broadcast_id = await adb.create_broadcast(1, "resume", total=7)
+        await adb.update_broadcast(broadcast_id, last_user_id=4, sent=4)
+        bot = FakeBot()
+        broadcaster = Broadcaster(bot, adb, rate=1000, batch_size=2)
+        assert await broadcaster.resume_unfinished() == 1
+        await _wait(broadcaster)
+
+        assert sorted(chat_id for chat_id, _ in bot.sent) == [5, 6, 7]
+        row = await adb.get_broadcast(broadcast_id)
+        assert (row['status'], row['sent'], row['failed']) == ('done', 7, 0)
+        assert await adb.get_unfinished_broadcasts() == []
+
+    async def test_close_keeps_broadcast_resumable(self, adb):
+        for uid in range(1, 6):
+            await adb.get_user(uid)
+        bot = FakeBot()
+        broadcaster = Broadcaster(bot, adb, rate=2, batch_size=1)
+        broadcast_id = await broadcaster.start(1, "slow")
+        await asyncio.sleep(0.05)
+        await broadcaster.close()
+        row = await adb.get_broadcast(broadcast_id)
+        assert row['status'] == 'running'
+        assert [b['id'] for b in await adb.get_unfinished_broadcasts()] == [broadcast_id]
+
+    async def test_one_broadcast_across_workers(self, adb, tmp_path):
+        """Два воркера с общей базой: вторая рассылка не стартует, отправляет только sender."""
+        for uid in range(1, 4):
+            await adb.get_user(uid)
+        await adb.flush()
+        other_db = AsyncUserDatabase(str(tmp_path / "users.db"))
+        sender_bot, other_bot = FakeBot(), FakeBot()
+        sender = Broadcaster(sender_bot, adb, rate=1000)
+        other = Broadcaster(other_bot, other_db, rate=1000, sender=False)
+        try:
+            broadcast_id = await other.start(1, "from worker 1")
+            assert broadcast_id is not None
+            assert not other.is_running
+            # Строка running в общей базе — занято для всех воркеров
+            assert await sender.start(2, "second") is None
+            assert await other.start(2, "second") is None
+
+            assert await sender.resume_unfinished() == 1
+            await _wait(sender)
+            assert sorted(c for c, text in sender_bot.sent if text == "from worker 1") == [1, 2, 3]
+            # Воркер без sender отправил админу только статус, не саму рассылку
+            assert not any(text == "from worker 1" for _, text in other_bot.sent)
+            assert (await adb.get_broadcast(broadcast_id))['status'] == 'done'
+            assert await sender.start(2, "next") is not None
+            await _wait(sender)
+        finally:
+            await other.close()
+            await other_db.close()
+
+    async def test_watching_picks_up_new_broadcasts(self, adb):
+        await adb.get_user(1)
+        bot = FakeBot()
+        sender = Broadcaster(bot, adb, rate=1000)
+        broadcast_id = await adb.create_broadcast(1, "queued", total=1)
+        sender.start_watching(interval=0.01)
+        try:
+            for _ in range(100):
+                if (await adb.get_broadcast(broadcast_id))['status'] == 'done':
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await sender.close()
+        assert (1, "queued") in bot.sent
+
+    def test_progress_text(self):
+        text = Broadcaster._progress_text(
+            {'id': 3, 'total': 1000}, 'en', sent=240, failed=10, elapsed=10.0, done_this_run=250)
+        assert "250/1000 (25%)" in text
+        assert "25.0 msg/s" in text
+        assert "0:00:30" in text
@@ -0,0 +1,56 @@
+"""Тесты для индексов валют (currency_index)."""
+
+from currency_index import AliasTrie, CodeIndex, CurrencySearchIndex, ALIAS_INDEX, CODE_INDEX, SEARCH_INDEX
+
+
+class TestAliasTrie:
+    def test_longest_wins(self):
+        assert ALIAS_INDEX.find_longest("5 белорусских рублей") == "BYN"
+
+    def test_word_boundary(self):
+        # "бел" внутри "белка" не считается алиасом
+        assert ALIAS_INDEX.find_longest("белка") is None
+
+    def test_trailing_dot_alias(self):
+        assert ALIAS_INDEX.find_longest("10 грн.") == "UAH"
+
+    def test_short_aliases_skipped(self):
+        assert ALIAS_INDEX.find_longest("5 р") is None
+
+    def test_tie_prefers_declared_first(self):
+        trie = AliasTrie({"аа": "AAA", "бб": "BBB"})
+        assert trie.find_longest("бб аа") == "AAA"
+
+    def test_empty(self):
+        assert ALIAS_INDEX.find_longest("") is None
+
+
+class TestCodeIndex:
+    def test_token(self):
+        assert CODE_INDEX.find_first("(20+5)*4 eur") == "EUR"
+
+    def test_not_inside_word(self):
+        assert CODE_INDEX.find_first("usdx") is None
+
+    def test_declared_order(self):
+        index = CodeIndex(["EUR", "USD"])
+        assert index.find_first("usd eur") == "EUR"
+
+
+class TestCurrencySearchIndex:
+    def test_exact_code_first(self):
+        assert SEARCH_INDEX.search("usd")[0] == ('fiat', 'USD')
+
+    def test_alias(self):
+        assert SEARCH_INDEX.search("доллар")[0] == ('fiat', 'USD')
+
+    def test_ranking(self):
+        index = CurrencySearchIndex(
+            {'fiat': {'ABC': 'Zeta coin', 'XAB': 'Abacus'}, 'crypto': {'AB': 'Other'}}, {})
+        # точный код, префикс кода, префикс названия, подстрока кода
+        assert index.search("ab") == [('crypto', 'AB'), ('fiat', 'ABC'), ('fiat', 'XAB')]
+
+    def test_limit_and_empty(self):
+        assert len(SEARCH_INDEX.search("a", limit=3)) == 3
+        assert SEARCH_INDEX.search("   ") == []
+        assert SEARCH_INDEX.search("xyzq") == []
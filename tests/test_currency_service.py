@@ -2,6 +2,7 @@
 
 import pytest
 import asyncio
+import time
 from unittest.mock import AsyncMock, patch
 from currency_service import CurrencyService
 
@@ -244,7 +245,7 @@ class TestGetRates:
     @pytest.mark.asyncio
     async def test_returns_from_cache(self, cs):
         """Если данные в кэше — возвращает их без HTTP-запроса."""
-        cs.rates_cache["auto:USD"] = (9999999999.0, {"EUR": 0.87, "USD": 1.0})
+        cs.rates_cache["frankfurter"] = (9999999999.0, {"EUR": 0.87, "USD": 1.0})
         result, source = await cs.get_rates("USD", "auto")
         assert result == {"EUR": 0.87, "USD": 1.0}
         assert source.startswith("cache:")
@@ -262,3 +263,553 @@ class TestGetRates:
         assert result is not None
         assert result["EUR"] == 0.87042
         assert source == "frankfurter"
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_coalesced(self, cs):
+        """Параллельные промахи кэша делят один запрос к API."""
+        calls = 0
+
+        async def slow_fetch(base):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"EUR": 0.9, "USD": 1.0}
+
+        with patch.object(cs, "_fetch_frankfurter", side_effect=slow_fetch):
+            results = await asyncio.gather(*(cs.get_rates("USD", "auto") for _ in range(10)))
+
+        assert calls == 1
+        assert all(r == ({"EUR": 0.9, "USD": 1.0}, "frankfurter") for r in results)
+        stats = cs.get_fetch_stats()
+        assert stats["fetches"] == 1
+        assert stats["coalesced"] == 9
+
+    @pytest.mark.asyncio
+    async def test_sources_with_same_provider_coalesced(self, cs):
+        """'auto' и '1' начинаются с frankfurter — запрос к нему один."""
+        calls = 0
+
+        async def slow_fetch(base):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"EUR": 0.9, "USD": 1.0}
+
+        with patch.object(cs, "_fetch_frankfurter", side_effect=slow_fetch):
+            results = await asyncio.gather(cs.get_rates("USD", "auto"), cs.get_rates("USD", "1"))
+
+        assert calls == 1
+        assert all(r == ({"EUR": 0.9, "USD": 1.0}, "frankfurter") for r in results)
+        assert cs._source_map == {"auto": "frankfurter", "1": "frankfurter"}
+
+    @pytest.mark.asyncio
+    async def test_cancelled_leader_does_not_fail_waiters(self, cs):
+        """Отмена первого вызова не обрывает запрос для остальных."""
+        started = asyncio.Event()
+
+        async def slow_fetch(base):
+            started.set()
+            await asyncio.sleep(0.02)
+            return {"EUR": 0.9, "USD": 1.0}
+
+        with patch.object(cs, "_fetch_frankfurter", side_effect=slow_fetch):
+            leader = asyncio.create_task(cs.get_rates("USD", "auto"))
+            await started.wait()
+            waiter = asyncio.create_task(cs.get_rates("USD", "auto"))
+            await asyncio.sleep(0)
+            leader.cancel()
+            result = await waiter
+
+        assert leader.cancelled()
+        assert result == ({"EUR": 0.9, "USD": 1.0}, "frankfurter")
+        assert cs.get_fetch_stats()["fetches"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_served_and_refreshed_in_background(self, cs):
+        """Истёкший кэш отдаётся сразу, а обновление идёт в фоне."""
+        cs.rates_cache["frankfurter"] = (0.0, {"EUR": 0.8, "USD": 1.0})
+        fresh = {"EUR": 0.9, "USD": 1.0}
+
+        async def fetch(base):
+            return fresh
+
+        with patch.object(cs, "_fetch_frankfurter", side_effect=fetch):
+            result, source = await cs.get_rates("USD", "auto")
+            assert result == {"EUR": 0.8, "USD": 1.0}
+            assert source.startswith("stale:frankfurter:")
+            await asyncio.gather(*cs._background_tasks)
+
+        assert cs.rates_cache["frankfurter"][1] == fresh
+        result, source = await cs.get_rates("USD", "auto")
+        assert result == fresh
+        assert source == "cache:frankfurter"
+
+    @pytest.mark.asyncio
+    async def test_refresh_hot_keys(self, cs):
+        """Горячий источник обновляется заранее, холодный — забывается."""
+        cs._hot_keys["auto"] = time.time()
+        cs._hot_keys["2"] = 0.0
+
+        async def fetch(base):
+            return {"EUR": 0.9, "USD": 1.0}
+
+        with patch.object(cs, "_fetch_frankfurter", side_effect=fetch):
+            await cs.refresh_hot_keys()
+
+        assert "frankfurter" in cs.rates_cache
+        assert "2" not in cs._hot_keys
+
+    @pytest.mark.asyncio
+    async def test_one_snapshot_serves_all_bases(self, cs):
+        """Любая база выводится из одного USD-снимка без новых запросов."""
+        calls = 0
+
+        async def fetch(base):
+            nonlocal calls
+            calls += 1
+            assert base == "USD"
+            return {"USD": 1.0, "EUR": 0.8, "RUB": 80.0}
+
+        with patch.object(cs, "_fetch_frankfurter", side_effect=fetch):
+            usd, _ = await cs.get_rates("USD", "auto")
+            eur, _ = await cs.get_rates("EUR", "auto")
+            rub, _ = await cs.get_rates("RUB", "auto")
+
+        assert calls == 1
+        assert list(cs.rates_cache) == ["frankfurter"]
+        assert eur["USD"] == pytest.approx(1.25)
+        assert eur["RUB"] == pytest.approx(100.0)
+        assert rub["EUR"] == pytest.approx(0.01)
+
+    @pytest.mark.asyncio
+    async def test_cross_rate(self, cs):
+        cs.rates_cache["frankfurter"] = (9999999999.0, {"USD": 1.0, "EUR": 0.8, "RUB": 80.0})
+        assert await cs.get_cross_rate("EUR", "RUB") == pytest.approx(100.0)
+        assert await cs.get_cross_rate("EUR", "XXX") is None
+
+
+class TestRatesSnapshot:
+    """Тесты для снимка курсов на диске."""
+
+    @pytest.mark.asyncio
+    async def test_snapshot_survives_restart(self, tmp_path):
+        path = str(tmp_path / "rates.json")
+        first = CurrencyService(snapshot_path=path)
+
+        async def fetch(base):
+            return {"USD": 1.0, "EUR": 0.9}
+
+        with patch.object(first, "_fetch_frankfurter", side_effect=fetch):
+            await first.get_rates("USD", "auto")
+        saved_at = first.rates_cache["frankfurter"][0]
+
+        second = CurrencyService(snapshot_path=path)
+        assert second.rates_cache["frankfurter"] == (saved_at, {"USD": 1.0, "EUR": 0.9})
+        with patch.object(second, "_fetch_frankfurter", side_effect=AssertionError):
+            result, source = await second.get_rates("USD", "auto")
+        assert result["EUR"] == 0.9
+        assert source == "cache:frankfurter"
+
+    @pytest.mark.asyncio
+    async def test_concurrent_saves(self, tmp_path):
+        """Параллельные сохранения не портят файл, последним пишется свежее состояние."""
+        import json
+        path = tmp_path / "rates.json"
+        cs = CurrencyService(snapshot_path=str(path))
+
+        async def save(i):
+            cs.rates_cache["frankfurter"] = (float(i), {"USD": 1.0, "EUR": i / 100})
+            await cs._save_snapshot()
+
+        await asyncio.gather(*(save(i) for i in range(1, 21)))
+        data = json.loads(path.read_text())
+        assert data["providers"]["frankfurter"] == {"timestamp": 20.0, "rates": {"USD": 1.0, "EUR": 0.2}}
+        assert [p.name for p in tmp_path.iterdir()] == ["rates.json"]
+
+    def test_missing_or_broken_file(self, tmp_path):
+        assert CurrencyService(snapshot_path=str(tmp_path / "none.json")).rates_cache == {}
+        broken = tmp_path / "broken.json"
+        broken.write_text("{not json")
+        assert CurrencyService(snapshot_path=str(broken)).rates_cache == {}
+
+
+class TestSharedSnapshot:
+    """Режим воркеров: несколько процессов делят снимок курсов на диске."""
+
+    @staticmethod
+    def _workers(tmp_path, count=2):
+        path = str(tmp_path / "rates.json")
+        workers = [CurrencyService(snapshot_path=path, shared=True) for _ in range(count)]
+        for worker in workers:
+            worker.snapshot_check_interval = 0
+        return workers
+
+    def test_requires_snapshot_path(self):
+        with pytest.raises(ValueError):
+            CurrencyService(shared=True)
+
+    @pytest.mark.asyncio
+    async def test_second_worker_reuses_fetch(self, tmp_path):
+        first, second = self._workers(tmp_path)
+
+        async def fetch(base):
+            return {"USD": 1.0, "EUR": 0.9}
+
+        with patch.object(first, "_fetch_frankfurter", side_effect=fetch):
+            await first.get_rates("USD", "auto")
+        with patch.object(second, "_fetch_frankfurter", side_effect=AssertionError):
+            result, _ = await second.get_rates("USD", "auto")
+        assert result["EUR"] == 0.9
+
+    @pytest.mark.asyncio
+    async def test_concurrent_workers_fetch_once(self, tmp_path):
+        workers = self._workers(tmp_path, 3)
+        calls = 0
+
+        async def slow_fetch(base):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return {"USD": 1.0, "EUR": 0.9}
+
+        for worker in workers:
+            worker.lease_poll_interval = 0.01
+        with patch.object(CurrencyService, "_fetch_frankfurter", side_effect=slow_fetch):
+            results = await asyncio.gather(*(w.get_rates("USD", "auto") for w in workers))
+
+        assert calls == 1
+        assert all(r[0]["EUR"] == 0.9 for r in results)
+        assert sum(w.get_fetch_stats()["shared_hits"] for w in workers) == 2
+
+    @pytest.mark.asyncio
+    async def test_picks_up_other_worker_rates(self, tmp_path):
+        first, second = self._workers(tmp_path)
+        first.rates_cache["frankfurter"] = (time.time() - 100, {"USD": 1.0, "EUR": 0.8})
+        second.rates_cache["frankfurter"] = (time.time(), {"USD": 1.0, "EUR": 0.9})
+        second._publish("frankfurter")
+
+        result, source = await first.get_rates("USD", "auto")
+        assert result["EUR"] == 0.9
+        assert source == "cache:frankfurter"
+
+    @pytest.mark.asyncio
+    async def test_lease_timeout_fetches_anyway(self, tmp_path):
+        import fcntl
+        import os
+        (worker,) = self._workers(tmp_path, 1)
+        worker.lease_timeout = 0.05
+        worker.lease_poll_interval = 0.01
+        holder = os.open(str(tmp_path / "rates.json.lock"), os.O_RDWR | os.O_CREAT)
+        fcntl.flock(holder, fcntl.LOCK_EX)
+
+        async def fetch(base):
+            return {"USD": 1.0, "EUR": 0.9}
+
+        try:
+            with patch.object(worker, "_fetch_frankfurter", side_effect=fetch):
+                result, _ = await worker.get_rates("USD", "auto")
+        finally:
+            os.close(holder)
+        assert result["EUR"] == 0.9
+        assert worker.get_fetch_stats()["lease_waits"] == 1
+
+
+class TestConvertViaUsd:
+    """Конвертация читает курсы из rate_table."""
+
+    @pytest.mark.asyncio
+    async def test_converts_through_usd(self, cs):
+        cs.rates_cache["frankfurter"] = (9999999999.0, {"USD": 1.0, "EUR": 0.8, "RUB": 80.0})
+        with patch.object(cs, "_fetch_coingecko", return_value=None):
+            result = await cs.convert_currency(10, "EUR", ["RUB", "USD", "BTC", "XXX"])
+        assert result["RUB"]["amount"] == pytest.approx(1000.0)
+        assert result["USD"]["amount"] == pytest.approx(12.5)
+        assert result["RUB"]["source"] == "cache:frankfurter"
+        # Курса нет или код вне индекса — валюта пропускается
+        assert set(result) == {"RUB", "USD"}
+
+    @pytest.mark.asyncio
+    async def test_unknown_or_missing_source_currency(self, cs):
+        cs.rates_cache["frankfurter"] = (9999999999.0, {"USD": 1.0, "EUR": 0.8})
+        assert await cs.convert_currency(1, "RUB", ["EUR"]) == {}
+        assert await cs.convert_currency(1, "XXX", ["EUR"]) == {}
+
+    @pytest.mark.asyncio
+    async def test_convert_batch(self, cs):
+        cs.rates_cache["frankfurter"] = (9999999999.0, {"USD": 1.0, "EUR": 0.8, "RUB": 80.0})
+        values, source = await cs.convert_batch([1, 160], ["USD", "RUB"], ["EUR"])
+        assert list(values) == [pytest.approx(0.8), pytest.approx(1.6)]
+        assert source == "cache:frankfurter"
+
+    @pytest.mark.asyncio
+    async def test_convert_batch_unavailable(self, cs):
+        with patch.object(cs, "_fetch_rates", return_value=({}, "unavailable")):
+            values, source = await cs.convert_batch([1], ["USD"], ["EUR", "RUB"])
+        assert source == "unavailable"
+        assert len(values) == 2 and all(v != v for v in values)
+
+    @pytest.mark.asyncio
+    async def test_sees_updated_cache(self, cs):
+        cs.rates_cache["frankfurter"] = (9999999998.0, {"USD": 1.0, "EUR": 0.8})
+        await cs.convert_currency(1, "USD", ["EUR"])
+        cs.rates_cache["frankfurter"] = (9999999999.0, {"USD": 1.0, "EUR": 0.9})
+        result = await cs.convert_currency(1, "USD", ["EUR"])
+        assert result["EUR"]["amount"] == pytest.approx(0.9)
+
+
+@pytest.fixture
+async def coingecko():
+    """Локальная заглушка CoinGecko simple/price; запросы копятся в server.calls,
+    задержка ответа — server.delay."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    calls = []
+    prices = {"bitcoin": {"usd": 50000}, "the-open-network": {"usd": 5}, "tether": {"usd": 1}}
+
+    async def simple_price(request):
+        calls.append(dict(request.query))
+        await asyncio.sleep(server.delay)
+        return web.json_response(prices)
+
+    app = web.Application()
+    app.router.add_get("/api/v3/simple/price", simple_price)
+    server = TestServer(app)
+    await server.start_server()
+    server.calls = calls
+    server.delay = 0.0
+    service = CurrencyService()
+    service.coingecko_base_url = str(server.make_url("/api/v3"))
+    yield service, server
+    await service.close()
+    await server.close()
+
+
+class TestCryptoProvider:
+    """CoinGecko: все монеты одним запросом, свой TTL, наложение на фиат."""
+
+    async def test_single_batched_request(self, coingecko):
+        from config import COINGECKO_IDS
+        service, server = coingecko
+        rates = await service._fetch_coingecko()
+        assert len(server.calls) == 1
+        assert server.calls[0]["vs_currencies"] == "usd"
+        assert server.calls[0]["ids"].split(",") == list(COINGECKO_IDS.values())
+        # USD-снимок: монет за 1 USD; монеты без цены пропускаются
+        assert rates == {"BTC": pytest.approx(0.00002), "TON": pytest.approx(0.2),
+                         "USDT": pytest.approx(1.0), "USD": 1.0}
+
+    async def test_overlays_fiat_snapshot(self, coingecko):
+        service, server = coingecko
+        service.rates_cache["frankfurter"] = (9999999999.0, {"USD": 1.0, "EUR": 0.8})
+        result = await service.convert_currency(1, "BTC", ["EUR", "TON"])
+        assert result["EUR"]["amount"] == pytest.approx(40000.0)
+        assert result["TON"]["amount"] == pytest.approx(10000.0)
+        assert result["EUR"]["source"] == "cache:frankfurter+coingecko"
+        # Фиатная конвертация крипто-провайдер не трогает
+        assert await service.convert_currency(1, "USD", ["EUR"]) == {
+            "EUR": {"amount": pytest.approx(0.8), "source": "cache:frankfurter"}}
+        assert len(server.calls) == 1
+
+    async def test_crypto_overrides_fiat_provider(self, coingecko):
+        service, _ = coingecko
+        service.rates_cache["currencyfreaks"] = (9999999999.0, {"USD": 1.0, "BTC": 0.00001})
+        result = await service.convert_currency(1, "BTC", ["USD"], api_source="3")
+        assert result["USD"]["amount"] == pytest.approx(50000.0)
+
+    async def test_shorter_ttl(self, coingecko):
+        service, server = coingecko
+        service.rates_cache["frankfurter"] = (9999999999.0, {"USD": 1.0, "EUR": 0.8})
+        await service.convert_currency(1, "BTC", ["USD"])
+        await service.convert_currency(2, "BTC", ["USD"])
+        assert len(server.calls) == 1
+        # Снимок крипты старше crypto_cache_timeout — stale и обновление в фоне
+        fetched_at, rates = service.rates_cache["coingecko"]
+        service.rates_cache["coingecko"] = (fetched_at - service.crypto_cache_timeout - 1, rates)
+        result = await service.convert_currency(1, "BTC", ["USD"])
+        assert result["USD"]["source"].startswith("cache:frankfurter+stale:coingecko:")
+        await asyncio.gather(*service._background_tasks)
+        assert len(server.calls) == 2
+        assert service.crypto_cache_timeout < service.cache_timeout
+
+    async def test_crypto_without_fiat(self, coingecko):
+        service, _ = coingecko
+        with patch.object(service, "_fetch_rates", return_value=({}, "unavailable")):
+            values, source = await service.convert_batch([1], ["BTC"], ["USD", "TON", "EUR"])
+        assert source == "coingecko"
+        assert list(values[:2]) == [pytest.approx(50000.0), pytest.approx(10000.0)]
+        assert values[2] != values[2]
+
+    async def test_background_refresh_skips_unused_crypto(self, coingecko):
+        service, server = coingecko
+
+        async def fetch(base):
+            return {"USD": 1.0, "EUR": 0.8}
+
+        with patch.object(service, "_fetch_frankfurter", side_effect=fetch):
+            service.start_background_refresh(interval=0.01)
+            await asyncio.sleep(0.05)
+        assert "frankfurter" in service.rates_cache
+        assert server.calls == []
+
+    async def test_cold_fetch_timeout(self, coingecko):
+        """Медленный CoinGecko не держит ответ: конвертация идёт без крипты,
+        а запрос доезжает в кэш в фоне."""
+        service, server = coingecko
+        server.delay = 0.2
+        service.crypto_cold_timeout = 0.02
+        service.rates_cache["frankfurter"] = (9999999999.0, {"USD": 1.0, "EUR": 0.8})
+        started = time.monotonic()
+        result = await service.convert_currency(1, "USD", ["EUR", "BTC"])
+        assert time.monotonic() - started < 0.15
+        assert set(result) == {"EUR"}
+        await asyncio.gather(*service._inflight.values())
+        result = await service.convert_currency(1, "BTC", ["USD"])
+        assert result["USD"]["amount"] == pytest.approx(50000.0)
+        assert len(server.calls) == 1
+
+    async def test_http_error_counts_failure(self, coingecko):
+        service, server = coingecko
+        service.coingecko_base_url = str(server.make_url("/missing"))
+        assert await service._get_crypto_snapshot() is None
+        assert service.api_failures["coingecko"] == 1
+        assert service.get_provider_stats()["coingecko"]["failures"] == 1
+
+
+class TestHedgedFetch:
+    """Тесты для параллельного (hedged) обхода цепочки источников."""
+
+    @pytest.mark.asyncio
+    async def test_slow_primary_is_hedged(self, cs):
+        """Зависший Frankfurter не задерживает ответ НБРБ дольше hedge_delay."""
+        cs.hedge_delay = 0.01
+        primary_cancelled = asyncio.Event()
+
+        async def hang(base):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                primary_cancelled.set()
+                raise
+
+        async def nbrb(base):
+            return {"USD": 1.0, "BYN": 3.2}
+
+        with patch.object(cs, "_fetch_frankfurter", side_effect=hang), \
+                patch.object(cs, "_fetch_nbrb", side_effect=nbrb):
+            result, source = await asyncio.wait_for(cs.get_rates("USD", "auto"), timeout=1)
+
+        await asyncio.wait_for(primary_cancelled.wait(), timeout=1)
+        assert source == "nbrb"
+        assert result["BYN"] == 3.2
+        assert cs.get_fetch_stats()["hedged"] == 1
+        stats = cs.get_provider_stats()
+        assert stats["frankfurter"]["cancelled"] == 1
+        assert stats["nbrb"]["calls"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failure_starts_next_immediately(self, cs):
+        """Упавший источник сразу передаёт ход следующему, не дожидаясь бюджета."""
+        cs.hedge_delay = 10
+
+        async def fail(base):
+            return None
+
+        async def nbrb(base):
+            return {"USD": 1.0, "BYN": 3.2}
+
+        with patch.object(cs, "_fetch_frankfurter", side_effect=fail), \
+                patch.object(cs, "_fetch_nbrb", side_effect=nbrb):
+            result, source = await asyncio.wait_for(cs.get_rates("USD", "auto"), timeout=1)
+
+        assert source == "nbrb"
+        assert cs.api_failures["frankfurter"] == 1
+        assert cs.get_provider_stats()["frankfurter"]["failures"] == 1
+
+
+class TestCircuitBreaker:
+    """Тесты для circuit breaker на основе api_failures."""
+
+    def test_open_provider_skipped(self, cs):
+        for _ in range(cs.max_failures):
+            cs._record_failure("frankfurter")
+        assert cs._circuit_state("frankfurter") == "open"
+        names = [n for n, _ in cs._build_chain("auto")]
+        assert names == ["nbrb", "currencyfreaks", "exchangerate"]
+
+    def test_half_open_admits_single_probe(self, cs):
+        for _ in range(cs.max_failures):
+            cs._record_failure("frankfurter")
+        cs._opened_at["frankfurter"] -= cs.breaker_cooldown
+        assert cs._circuit_state("frankfurter") == "half_open"
+        assert cs._admit("frankfurter") is True
+        # Пока идёт проба, остальные запросы видят разомкнутую цепь
+        assert cs._admit("frankfurter") is False
+
+    def test_success_closes(self, cs):
+        for _ in range(cs.max_failures):
+            cs._record_failure("frankfurter")
+        cs._record_success("frankfurter")
+        assert cs._circuit_state("frankfurter") == "closed"
+        assert cs.api_failures["frankfurter"] == 0
+
+    @pytest.mark.asyncio
+    async def test_dead_provider_not_called(self, cs):
+        """Разомкнутый источник не получает сетевых запросов."""
+        calls = 0
+
+        async def fail(base):
+            nonlocal calls
+            calls += 1
+            return None
+
+        async def nbrb(base):
+            return {"USD": 1.0, "BYN": 3.2}
+
+        with patch.object(cs, "_fetch_frankfurter", side_effect=fail), \
+                patch.object(cs, "_fetch_nbrb", side_effect=nbrb):
+            for _ in range(cs.max_failures + 2):
+                await cs._fetch_rates("auto")
+
+        assert calls == cs.max_failures
+        assert cs.get_provider_stats()["frankfurter"]["circuit"] == "open"
+
+
+class TestParsingGrammar:
+    """Порядок шаблонов и нормализация чисел после компиляции регулярок."""
+
+    def test_spaced_thousands_value(self, cs):
+        assert cs.extract_number_and_currency("1 000 000 рублей") == (1_000_000.0, "RUB")
+
+    def test_code_first(self, cs):
+        assert cs.extract_number_and_currency("usd 25") == (25.0, "USD")
+
+    def test_word_beats_symbol(self, cs):
+        """Слипшееся «число+валюта» приоритетнее символа, даже если стоит правее."""
+        assert cs.extract_number_and_currency("$5 или 10евро") == (10.0, "EUR")
+
+    def test_normalize_many_groups(self, cs):
+        assert cs.normalize_number("1 2  3\t4") == "1234"
+
+
+class TestParseCache:
+    """Тесты для LRU-кэша разбора сообщений."""
+
+    def test_hit_on_repeat(self, cs):
+        assert cs.parse_message("100$") == (100.0, "USD")
+        with patch.object(cs, "extract_number_and_currency", side_effect=AssertionError):
+            assert cs.parse_message("  100$ ") == (100.0, "USD")
+        assert cs.get_parse_cache_stats()["hits"] == 1
+
+    def test_negative_result_cached(self, cs):
+        assert cs.parse_message("просто текст") is None
+        with patch.object(cs, "extract_number_and_currency", side_effect=AssertionError):
+            assert cs.parse_message("просто текст") is None
+
+    def test_mode_is_part_of_key(self, cs):
+        assert cs.parse_message("twenty five долларов", use_w2n=False) is None
+        assert cs.parse_message("twenty five долларов", use_w2n=True) == (25, "USD")
+
+    def test_long_text_not_cached(self, cs):
+        cs.parse_message("x" * 1000 + " 5$")
+        assert cs.get_parse_cache_stats()["size"] == 0
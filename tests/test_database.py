@@ -157,3 +157,449 @@ class TestDeleteUser:
         # After delete, get_user creates again — just verify no crash
         user = db.get_user(999)
         assert user['user_id'] == 999
+
+
+class _CountingConnection:
+    """Обёртка над sqlite3.Connection, считающая SELECT-запросы."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.selects = 0
+
+    def execute(self, sql, *args):
+        if sql.lstrip().upper().startswith('SELECT'):
+            self.selects += 1
+        return self._conn.execute(sql, *args)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class TestUserCache:
+    def test_one_read_per_message(self, db):
+        """Все геттеры одного сообщения обслуживаются из кэша"""
+        db.get_user(1)
+        db._conn = counting = _CountingConnection(db._conn)
+        db.get_processing_mode(1)
+        db.get_selected_currencies(1)
+        db.get_api_source(1)
+        db.get_language(1)
+        db.get_appearance(1)
+        db.get_debug_mode(1)
+        assert counting.selects == 0
+
+    def test_miss_costs_single_select(self, db):
+        db._conn = counting = _CountingConnection(db._conn)
+        db.get_user(2)  # новый пользователь: SELECT, INSERT уходит в буфер
+        db._cache.clear()
+        counting.selects = 0
+        db.get_language(2)
+        db.get_api_source(2)
+        assert counting.selects == 1
+
+    def test_write_through(self, db):
+        db.get_user(3)
+        db.set_language(3, 'en')
+        db.set_debug_mode(3, True)
+        db.set_appearance(3, compact=True)
+        db.add_selected_currency(3, 'fiat', 'USD')
+        assert db.get_language(3) == 'en'
+        assert db.get_debug_mode(3) is True
+        assert db.get_appearance(3)['compact'] is True
+        assert db.get_selected_currencies(3)['fiat'] == ['USD']
+        # Кэш совпадает с тем, что лежит в базе
+        cached = db.get_user(3)
+        db._cache.clear()
+        fresh = db.get_user(3)
+        assert cached == fresh
+
+    def test_returned_values_are_copies(self, db):
+        db.get_selected_currencies(4)['fiat'].append('EUR')
+        db.get_appearance(4)['compact'] = True
+        db.get_user(4)['selected_currencies']['crypto'].append('BTC')
+        assert db.get_selected_currencies(4) == {'fiat': [], 'crypto': []}
+        assert db.get_appearance(4)['compact'] is False
+
+    def test_lru_eviction(self):
+        db = UserDatabase(":memory:", cache_size=2)
+        try:
+            for uid in (1, 2, 3):
+                db.get_user(uid)
+            assert len(db._cache) == 2
+            assert 1 not in db._cache
+            assert db.get_user(1)['user_id'] == 1
+        finally:
+            db.close()
+
+    def test_delete_invalidates(self, db):
+        db.get_user(5)
+        db.set_language(5, 'en')
+        db.delete_user(5)
+        assert db.get_language(5) == 'ru'
+
+    def test_disabled_cache(self):
+        db = UserDatabase(":memory:", cache_size=0)
+        try:
+            db.get_user(6)
+            db.set_language(6, 'en')
+            assert db.get_language(6) == 'en'
+            assert len(db._cache) == 0
+        finally:
+            db.close()
+
+
+class TestAsyncUserDatabase:
+    @pytest.fixture
+    async def adb(self, tmp_path):
+        from database import AsyncUserDatabase
+        adb = AsyncUserDatabase(str(tmp_path / "users.db"))
+        yield adb
+        await adb.close()
+
+    async def test_roundtrip(self, adb):
+        user = await adb.get_user(1)
+        assert user['language'] == 'ru'
+        await adb.set_language(1, 'en')
+        await adb.add_selected_currency(1, 'fiat', 'USD')
+        await adb.set_appearance(1, compact=True)
+        assert await adb.get_language(1) == 'en'
+        assert await adb.get_selected_currencies(1) == {'fiat': ['USD'], 'crypto': []}
+        assert (await adb.get_appearance(1))['compact'] is True
+
+    async def test_invalid_value_propagates(self, adb):
+        await adb.get_user(2)
+        with pytest.raises(ValueError):
+            await adb.set_processing_mode(2, 'invalid')
+
+    async def test_sqlite_runs_off_loop_thread(self, adb):
+        """Запросы к SQLite выполняются в потоке userdb, а не в потоке loop"""
+        import threading
+        threads = []
+        original = adb._db._get_user
+
+        def spy(user_id):
+            threads.append(threading.current_thread().name)
+            return original(user_id)
+
+        adb._db._get_user = spy
+        await adb.get_user(3)
+        assert threads and all(name.startswith('userdb') for name in threads)
+
+    async def test_cached_read_skips_executor(self, adb):
+        await adb.get_user(4)
+        calls = []
+        original = adb._run
+
+        async def counting_run(func, *args, **kwargs):
+            calls.append(func)
+            return await original(func, *args, **kwargs)
+
+        adb._run = counting_run
+        assert await adb.get_language(4) == 'ru'
+        assert (await adb.get_user(4))['user_id'] == 4
+        assert calls == []
+
+    async def test_persists_after_close(self, tmp_path):
+        from database import AsyncUserDatabase
+        path = str(tmp_path / "persist.db")
+        adb = AsyncUserDatabase(path)
+        await adb.get_user(5)
+        await adb.set_language(5, 'en')
+        await adb.close()
+        db = UserDatabase(path)
+        try:
+            assert db.get_language(5) == 'en'
+        finally:
+            db.close()
+
+
+class TestWriteBehind:
+    def _reopen(self, path):
+        return UserDatabase(path, cache_size=0)
+
+    def test_updates_are_coalesced(self, tmp_path):
+        path = str(tmp_path / "wb.db")
+        db = UserDatabase(path)
+        db.get_user(1)
+        for _ in range(5):
+            db.set_appearance(1, compact=True)
+            db.set_appearance(1, compact=False)
+        db.set_language(1, 'en')
+        assert db.pending_count == 2  # INSERT нового пользователя + один склеенный UPDATE
+        assert db.flush() == 1
+        assert db.pending_count == 0
+        other = self._reopen(path)
+        try:
+            assert other.get_language(1) == 'en'
+        finally:
+            other.close()
+        db.close()
+
+    def test_nothing_written_before_flush(self, tmp_path):
+        path = str(tmp_path / "wb.db")
+        db = UserDatabase(path)
+        db.get_user(2)
+        db.set_language(2, 'en')
+        count = db._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        assert count == 0
+        assert db.get_language(2) == 'en'  # чтение видит буфер
+        db.flush()
+        count = db._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        assert count == 1
+        db.close()
+
+    def test_size_threshold_flushes(self):
+        db = UserDatabase(":memory:", max_pending=3)
+        try:
+            db.get_user(1)
+            db.get_user(2)
+            assert db.pending_count == 2
+            db.get_user(3)
+            assert db.pending_count == 0
+            assert db.flush_stats['flushes'] == 1
+        finally:
+            db.close()
+
+    def test_evicted_user_reads_pending_changes(self):
+        db = UserDatabase(":memory:", cache_size=1)
+        try:
+            db.get_user(1)
+            db.set_language(1, 'en')
+            db.get_user(2)  # вытесняет пользователя 1 из кэша
+            assert db.get_language(1) == 'en'
+        finally:
+            db.close()
+
+    def test_close_flushes(self, tmp_path):
+        path = str(tmp_path / "wb.db")
+        db = UserDatabase(path)
+        db.get_user(3)
+        db.add_selected_currency(3, 'fiat', 'EUR')
+        db.close()
+        other = self._reopen(path)
+        try:
+            assert other.get_selected_currencies(3)['fiat'] == ['EUR']
+        finally:
+            other.close()
+
+    def test_get_all_users_sees_buffer(self, db):
+        db.get_user(4)
+        db.set_language(4, 'en')
+        users = db.get_all_users()
+        assert [u['language'] for u in users] == ['en']
+
+    def test_delete_drops_pending(self, db):
+        db.get_user(5)
+        db.set_language(5, 'en')
+        db.delete_user(5)
+        assert db.pending_count == 0
+        assert db.get_all_users() == []
+
+    async def test_background_flush(self, tmp_path):
+        import asyncio
+        from database import AsyncUserDatabase
+        adb = AsyncUserDatabase(str(tmp_path / "bg.db"))
+        adb.start_background_flush(interval=0.01)
+        await adb.set_language((await adb.get_user(6))['user_id'], 'en')
+        for _ in range(100):
+            if adb._db.pending_count == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert adb._db.pending_count == 0
+        await adb.close()
+
+
+def _make_legacy_db(tmp_path, users):
+    """База в формате до версионирования: выбранные валюты в JSON-колонках."""
+    import json
+    import sqlite3
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            processing_mode TEXT DEFAULT 'standard',
+            api_source TEXT DEFAULT 'auto',
+            debug_mode INTEGER DEFAULT 0,
+            language TEXT DEFAULT 'ru',
+            appearance TEXT DEFAULT '{}',
+            selected_fiat TEXT DEFAULT '[]',
+            selected_crypto TEXT DEFAULT '[]',
+            created_at TEXT,
+            last_activity TEXT
+        )""")
+    conn.executemany(
+        "INSERT INTO users (user_id, selected_fiat, selected_crypto) VALUES (?, ?, ?)",
+        [(uid, json.dumps(fiat), json.dumps(crypto)) for uid, (fiat, crypto) in users.items()])
+    conn.commit()
+    conn.close()
+    return path
+
+
+class TestUserCurrencies:
+    def test_order_preserved(self, tmp_path):
+        path = str(tmp_path / "uc.db")
+        db = UserDatabase(path)
+        for code in ('USD', 'EUR', 'RUB'):
+            db.add_selected_currency(1, 'fiat', code)
+        db.remove_selected_currency(1, 'fiat', 'EUR')
+        db.add_selected_currency(1, 'fiat', 'EUR')
+        db.close()
+        db = UserDatabase(path)
+        try:
+            assert db.get_selected_currencies(1)['fiat'] == ['USD', 'RUB', 'EUR']
+        finally:
+            db.close()
+
+    def test_count_users_with_currency(self, db):
+        db.add_selected_currency(1, 'crypto', 'BTC')
+        db.add_selected_currency(2, 'crypto', 'BTC')
+        db.add_selected_currency(2, 'fiat', 'USD')
+        db.add_selected_currency(3, 'fiat', 'USD')
+        assert db.count_users_with_currency('BTC') == 2
+        assert db.count_users_with_currency('USD', 'fiat') == 2
+        assert db.count_users_with_currency('USD', 'crypto') == 0
+        db.delete_user(2)
+        assert db.count_users_with_currency('BTC') == 1
+
+    def test_count_uses_index(self, db):
+        plan = db._conn.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM user_currencies WHERE code = ?", ('BTC',)
+        ).fetchall()
+        assert any('idx_user_currencies_code' in row[-1] for row in plan)
+
+    def test_update_user_replaces_selection(self, db):
+        db.add_selected_currency(1, 'fiat', 'USD')
+        db.update_user(1, selected_currencies={'fiat': ['EUR'], 'crypto': ['BTC']})
+        assert db.get_selected_currencies(1) == {'fiat': ['EUR'], 'crypto': ['BTC']}
+        db._cache.clear()
+        assert db.get_selected_currencies(1) == {'fiat': ['EUR'], 'crypto': ['BTC']}
+
+    def test_migrates_json_columns(self, tmp_path):
+        path = _make_legacy_db(tmp_path, {1: (['USD', 'EUR'], ['BTC']), 2: ([], [])})
+        db = UserDatabase(path)
+        try:
+            assert db.get_selected_currencies(1) == {'fiat': ['USD', 'EUR'], 'crypto': ['BTC']}
+            assert db.get_selected_currencies(2) == {'fiat': [], 'crypto': []}
+            assert db.count_users_with_currency('EUR') == 1
+        finally:
+            db.close()
+        # Повторный запуск не дублирует записи
+        db = UserDatabase(path)
+        try:
+            assert db.get_selected_currencies(1)['fiat'] == ['USD', 'EUR']
+        finally:
+            db.close()
+
+
+class TestMigrations:
+    def _connect(self, path):
+        import sqlite3
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def test_fresh_db_gets_latest_version(self, db):
+        from database import SCHEMA_VERSION, get_schema_version
+        assert get_schema_version(db._conn) == SCHEMA_VERSION
+
+    def test_batched_backfill_reports_progress(self, tmp_path):
+        from database import SCHEMA_VERSION, get_schema_version, migrate
+        path = _make_legacy_db(tmp_path, {uid: (['USD'], ['BTC']) for uid in range(1, 8)})
+        conn = self._connect(path)
+        calls = []
+        applied = migrate(conn, batch_size=3, progress=lambda done, total: calls.append((done, total)))
+        assert [version for version, _ in applied] == list(range(1, SCHEMA_VERSION + 1))
+        assert calls == [(3, 7), (6, 7), (7, 7)]
+        assert get_schema_version(conn) == SCHEMA_VERSION
+        assert conn.execute("SELECT COUNT(*) FROM user_currencies").fetchone()[0] == 14
+        assert migrate(conn) == []
+        conn.close()
+
+    def test_interrupted_migration_resumes(self, tmp_path):
+        from database import SCHEMA_VERSION, get_schema_version, migrate
+        path = _make_legacy_db(tmp_path, {uid: (['EUR'], []) for uid in range(1, 6)})
+        conn = self._connect(path)
+
+        def crash(done, total):
+            raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            migrate(conn, batch_size=2, progress=crash)
+        # Первый батч закоммичен, версия схемы не повышена
+        assert conn.execute("SELECT COUNT(*) FROM user_currencies").fetchone()[0] == 2
+        assert get_schema_version(conn) < SCHEMA_VERSION
+
+        calls = []
+        migrate(conn, batch_size=2, progress=lambda done, total: calls.append((done, total)))
+        assert calls == [(2, 3), (3, 3)]
+        assert get_schema_version(conn) == SCHEMA_VERSION
+        assert conn.execute("SELECT COUNT(*) FROM user_currencies").fetchone()[0] == 5
+        conn.close()
+
+    def test_newer_schema_left_untouched(self, tmp_path):
+        from database import SCHEMA_VERSION, migrate
+        conn = self._connect(str(tmp_path / "future.db"))
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+        assert migrate(conn) == []
+        conn.close()
+
+
+class TestIterUsers:
+    @pytest.fixture
+    def filled(self, db):
+        for uid in range(1, 8):
+            db.get_user(uid)
+        db.set_language(3, 'en')
+        db.add_selected_currency(5, 'crypto', 'BTC')
+        return db
+
+    def test_pages_cover_all_users(self, filled):
+        pages = []
+        original = filled.fetch_users_page
+
+        def spy(after, limit, columns):
+            page = original(after, limit, columns)
+            pages.append(len(page))
+            return page
+
+        filled.fetch_users_page = spy
+        users = list(filled.iter_users(batch_size=3))
+        assert [u['user_id'] for u in users] == list(range(1, 8))
+        assert pages == [3, 3, 1, 0]
+        assert users[2]['language'] == 'en'
+        assert users[4]['selected_currencies'] == {'fiat': [], 'crypto': ['BTC']}
+
+    def test_projection(self, filled):
+        users = list(filled.iter_users(columns=['language']))
+        assert users[0] == {'user_id': 1, 'language': 'ru'}
+        assert users[2] == {'user_id': 3, 'language': 'en'}
+        users = list(filled.iter_users(batch_size=2, columns=['selected_currencies']))
+        assert users[4] == {'user_id': 5, 'selected_currencies': {'fiat': [], 'crypto': ['BTC']}}
+
+    def test_unknown_column(self, filled):
+        with pytest.raises(ValueError):
+            list(filled.iter_users(columns=['user_id; DROP TABLE users']))
+
+    def test_writes_during_iteration(self, filled):
+        for user in filled.iter_users(batch_size=2, columns=['user_id']):
+            filled.set_language(user['user_id'], 'en')
+        assert all(u['language'] == 'en' for u in filled.get_all_users())
+
+    def test_get_all_users_matches_get_user(self, filled):
+        assert filled.get_all_users() == [filled.get_user(uid) for uid in range(1, 8)]
+
+    async def test_async_iteration(self, tmp_path):
+        from database import AsyncUserDatabase
+        adb = AsyncUserDatabase(str(tmp_path / "iter.db"))
+        for uid in range(1, 6):
+            await adb.get_user(uid)
+        ids = [u['user_id'] async for u in adb.iter_users(batch_size=2, columns=['user_id'])]
+        assert ids == [1, 2, 3, 4, 5]
+        await adb.close()
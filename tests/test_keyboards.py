@@ -0,0 +1,99 @@
+"""Тесты для keyboards (предрасчитанные клавиатуры валют)."""
+
+from config import CRYPTO_CURRENCIES, FIAT_CURRENCIES
+from keyboards import (
+    LETTER_INDEX, PAGE_SIZE, find_currency_page, get_currencies_by_letter_keyboard,
+    get_letter_keyboard, get_search_results_keyboard, page_count,
+)
+
+
+def _texts(markup):
+    return [[button.text for button in row] for row in markup.inline_keyboard]
+
+
+class TestLetterIndex:
+    def test_covers_all_currencies(self):
+        for currency_type, currencies in (('fiat', FIAT_CURRENCIES), ('crypto', CRYPTO_CURRENCIES)):
+            indexed = [code for items in LETTER_INDEX[currency_type].values() for code, _ in items]
+            assert sorted(indexed) == sorted(currencies)
+
+    def test_letters_sorted(self):
+        letters = list(LETTER_INDEX['fiat'])
+        assert letters == sorted(letters)
+
+
+class TestLetterKeyboard:
+    def test_cached_per_type_and_lang(self):
+        assert get_letter_keyboard('fiat', 'ru') is get_letter_keyboard('fiat', 'ru')
+        assert get_letter_keyboard('fiat', 'ru') is not get_letter_keyboard('fiat', 'en')
+        # Неизвестный язык — английский, как и в остальных клавиатурах
+        assert get_letter_keyboard('crypto', 'de') is get_letter_keyboard('crypto', 'en')
+
+    def test_rows_of_six(self):
+        rows = get_letter_keyboard('fiat', 'ru').inline_keyboard
+        assert all(len(row) <= 6 for row in rows[:-1])
+        assert rows[0][0].callback_data == f"letter_fiat_{next(iter(LETTER_INDEX['fiat']))}"
+
+
+class TestCurrenciesByLetter:
+    def test_selection_overlay(self):
+        markup = get_currencies_by_letter_keyboard('fiat', 'U', ['USD'], 'ru')
+        buttons = {b.callback_data: b.text for row in markup.inline_keyboard for b in row}
+        assert buttons['select_currency_fiat_USD_U_0'] == f"✅ {FIAT_CURRENCIES['USD']}"
+        assert buttons['select_currency_fiat_UAH_U_0'] == f"❌ {FIAT_CURRENCIES['UAH']}"
+
+    def test_overlay_does_not_leak_between_users(self):
+        get_currencies_by_letter_keyboard('fiat', 'U', ['USD'], 'ru')
+        markup = get_currencies_by_letter_keyboard('fiat', 'U', [], 'ru')
+        assert not any(text.startswith("✅") for row in _texts(markup) for text in row)
+
+    def test_lowercase_and_unknown_letter(self):
+        assert _texts(get_currencies_by_letter_keyboard('fiat', 'u', [], 'en')) == \
+            _texts(get_currencies_by_letter_keyboard('fiat', 'U', [], 'en'))
+        rows = get_currencies_by_letter_keyboard('crypto', 'Я', [], 'en').inline_keyboard
+        assert [row[0].callback_data for row in rows] == ["back_to_letters_crypto", "back_to_currency_selection"]
+
+
+class TestPagination:
+    def test_page_count(self):
+        assert page_count('fiat', 'B') == -(-len(LETTER_INDEX['fiat']['B']) // PAGE_SIZE)
+        assert page_count('crypto', 'Я') == 1
+
+    def test_pages_split_letter(self):
+        codes = []
+        for page in range(page_count('fiat', 'B')):
+            markup = get_currencies_by_letter_keyboard('fiat', 'B', [], 'ru', page)
+            codes += [b.callback_data.split('_')[3] for row in markup.inline_keyboard
+                      for b in row if b.callback_data.startswith('select_currency_')]
+        assert codes == [code for code, _ in LETTER_INDEX['fiat']['B']]
+
+    def test_nav_row_wraps(self):
+        last = page_count('fiat', 'B') - 1
+        nav = get_currencies_by_letter_keyboard('fiat', 'B', [], 'ru', 0).inline_keyboard[-3]
+        assert [b.callback_data for b in nav] == [f"page_fiat_B_{last}", "noop", "page_fiat_B_1"]
+        assert nav[1].text == f"1/{last + 1}"
+
+    def test_single_page_has_no_nav(self):
+        rows = get_currencies_by_letter_keyboard('crypto', 'B', [], 'ru').inline_keyboard
+        assert not any(b.callback_data.startswith('page_') for row in rows for b in row)
+
+    def test_page_clamped(self):
+        last = page_count('fiat', 'B') - 1
+        assert _texts(get_currencies_by_letter_keyboard('fiat', 'B', [], 'ru', 99)) == \
+            _texts(get_currencies_by_letter_keyboard('fiat', 'B', [], 'ru', last))
+
+    def test_find_currency_page(self):
+        letter, page = find_currency_page('fiat', 'USD')
+        markup = get_currencies_by_letter_keyboard('fiat', letter, [], 'ru', page)
+        assert any(b.callback_data == f"select_currency_fiat_USD_{letter}_{page}"
+                   for row in markup.inline_keyboard for b in row)
+
+
+class TestSearchResultsKeyboard:
+    def test_overlay_and_back(self):
+        markup = get_search_results_keyboard(
+            iter([('fiat', 'USD'), ('crypto', 'USDT')]), {'fiat': ['USD'], 'crypto': []}, 'en')
+        texts = _texts(markup)
+        assert f"✅ {FIAT_CURRENCIES['USD']}" in texts[0]
+        assert any(f"❌ {CRYPTO_CURRENCIES['USDT']}" in row for row in texts)
+        assert markup.inline_keyboard[-1][0].callback_data == "back_to_currency_selection"
@@ -0,0 +1,31 @@
+"""Тесты для LRUCache."""
+
+from lru_cache import LRUCache
+
+
+class TestLRUCache:
+    def test_evicts_least_recent(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert "a" in cache
+        assert "b" not in cache
+        assert len(cache) == 2
+
+    def test_stats(self):
+        cache = LRUCache(10)
+        cache.set("a", None)
+        assert cache.get("a", "miss") is None
+        assert cache.get("b", "miss") == "miss"
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+        assert len(cache) == 0
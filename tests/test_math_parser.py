@@ -99,3 +99,44 @@ class TestFormatResult:
 
     def test_integer_no_decimal(self, parser):
         assert parser.format_result(100.0, "USD") == "$100"
+
+
+class TestCompiledExpression:
+    def test_unary_minus(self, parser):
+        assert parser.evaluate_expression("5*-2") == -10.0
+
+    def test_leading_minus(self, parser):
+        assert parser.evaluate_expression("-(3 + 2) * 2") == -10.0
+
+    def test_precedence(self, parser):
+        assert parser.evaluate_expression("2 + 3 * 4 - 6 / 2") == 11.0
+
+    def test_left_associative(self, parser):
+        assert parser.evaluate_expression("100 / 10 / 2") == 5.0
+        assert parser.evaluate_expression("10 - 3 - 2") == 5.0
+
+    def test_suffix_inside_expression(self, parser):
+        assert parser.evaluate_expression("1.5к + 2кк") == 2_001_500.0
+
+    def test_rejects_double_operator(self, parser):
+        assert parser.evaluate_expression("5**2") is None
+
+    def test_rejects_call_syntax(self, parser):
+        assert parser.evaluate_expression("2(3)") is None
+
+    def test_operand_too_long(self, parser):
+        assert parser.evaluate_expression("9" * 40 + "+1") is None
+
+    def test_nesting_bounded(self, parser):
+        assert parser.evaluate_expression("(" * 50 + "1" + ")" * 50) is None
+
+    def test_expression_too_long(self, parser):
+        assert parser.evaluate_expression("+".join(["1"] * 150)) is None
+
+    def test_overflow(self, parser):
+        assert parser.evaluate_expression("*".join(["999999999999999"] * 30)) is None
+
+    def test_compiled_is_reused(self, parser):
+        compiled = parser.compile("(20 + 5) * 4")
+        assert compiled is parser.compile("(20+5)*4")
+        assert compiled.evaluate() == 100.0
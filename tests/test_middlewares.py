@@ -0,0 +1,69 @@
+"""Тесты для middlewares (контекст пользователя)."""
+
+from types import SimpleNamespace
+
+import pytest
+from database import AsyncUserDatabase, UserDatabase
+from middlewares import UserContext, UserContextMiddleware
+
+
+class _CountingDB:
+    def __init__(self, db):
+        self._db = db
+        self.calls = 0
+
+    async def get_user(self, user_id):
+        self.calls += 1
+        return await self._db.get_user(user_id)
+
+
+@pytest.fixture
+def db():
+    db = UserDatabase(":memory:")
+    yield db
+    db.close()
+
+
+class TestUserContextMiddleware:
+    async def test_injects_context_with_single_lookup(self):
+        db = AsyncUserDatabase(":memory:")
+        await db.get_user(7)
+        await db.set_language(7, 'en')
+        await db.add_selected_currency(7, 'fiat', 'USD')
+        counting = _CountingDB(db)
+        middleware = UserContextMiddleware(counting)
+        seen = {}
+
+        async def handler(event, data):
+            seen.update(data)
+            return 'ok'
+
+        event = SimpleNamespace(from_user=SimpleNamespace(id=7))
+        assert await middleware(handler, event, {}) == 'ok'
+        ctx = seen['user_ctx']
+        assert counting.calls == 1
+        assert ctx.user_id == 7
+        assert ctx.language == 'en'
+        assert ctx.selected_codes('fiat') == ['USD']
+        await db.close()
+
+    async def test_event_without_user(self):
+        middleware = UserContextMiddleware(None)
+
+        async def handler(event, data):
+            return data
+
+        data = await middleware(handler, SimpleNamespace(from_user=None), {})
+        assert 'user_ctx' not in data
+
+
+class TestUserContext:
+    def test_targets_is_new_list(self, db):
+        db.get_user(8)
+        db.add_selected_currency(8, 'fiat', 'EUR')
+        db.add_selected_currency(8, 'crypto', 'BTC')
+        ctx = UserContext.from_user(db.get_user(8))
+        targets = ctx.targets
+        assert targets == ['EUR', 'BTC']
+        targets.remove('EUR')
+        assert ctx.selected_codes('fiat') == ['EUR']
@@ -0,0 +1,168 @@
+"""Тесты для rate_table (таблица курсов в общей памяти)."""
+
+import math
+
+import pytest
+from config import CRYPTO_CURRENCIES, FIAT_CURRENCIES
+from rate_table import CODES, INDEX, RateTable, batch_length, convert_batch
+
+
+@pytest.fixture
+def table():
+    table = RateTable(['a', 'b'])
+    yield table
+    table.close()
+
+
+class TestIndex:
+    def test_fixed_order(self):
+        assert CODES[:len(FIAT_CURRENCIES)] == tuple(FIAT_CURRENCIES)
+        assert set(CODES) == set(FIAT_CURRENCIES) | set(CRYPTO_CURRENCIES)
+        assert all(CODES[i] == code for code, i in INDEX.items())
+
+
+class TestRateTable:
+    def test_empty_slot(self, table):
+        assert table.read('a', lambda rates: rates[0]) is None
+        assert table.timestamp('a') == 0.0
+        assert table.read('missing', lambda rates: rates[0]) is None
+
+    def test_publish_and_read(self, table):
+        assert table.publish('a', 100.0, {'EUR': 0.8, 'XXX': 5.0, 'RUB': 'n/a'})
+        assert not table.publish('missing', 100.0, {})
+        ts, (eur, usd, rub) = table.read(
+            'a', lambda rates: (rates[INDEX['EUR']], rates[INDEX['USD']], rates[INDEX['RUB']]))
+        assert ts == 100.0
+        assert eur == 0.8
+        # Снимок в базе USD: курс USD всегда 1
+        assert usd == 1.0
+        assert math.isnan(rub)
+        assert table.to_dict('a') == (100.0, {'USD': 1.0, 'EUR': 0.8})
+        assert table.timestamp('b') == 0.0
+
+    def test_retry_on_concurrent_write(self, table):
+        table.publish('a', 1.0, {'EUR': 0.8})
+        calls = []
+
+        def reader(rates):
+            calls.append(rates[INDEX['EUR']])
+            if len(calls) == 1:
+                # Писатель обновил слот посреди чтения
+                table.publish('a', 2.0, {'EUR': 0.9})
+            return rates[INDEX['EUR']]
+
+        assert table.read('a', reader) == (2.0, 0.9)
+        assert table.stats['read_retries'] == 1
+
+    def test_read_overlay(self, table):
+        table.publish('a', 1.0, {'EUR': 0.8})
+        eur = INDEX['EUR']
+        assert table.read_overlay('a', 'b', lambda rates, extra: extra) == (1.0, None)
+        table.publish('b', 2.0, {'EUR': 0.9})
+        # Метка времени — основного слота; overlay переписали посреди чтения — повтор
+        calls = []
+
+        def reader(rates, extra):
+            calls.append(extra[eur])
+            if len(calls) == 1:
+                table.publish('b', 3.0, {'EUR': 0.95})
+            return rates[eur], extra[eur]
+
+        assert table.read_overlay('a', 'b', reader) == (1.0, (0.8, 0.95))
+        assert table.stats['read_retries'] == 1
+        assert table.read_overlay('missing', 'b', reader) is None
+
+    def test_odd_sequence_after_crashed_writer(self, table):
+        table.publish('a', 1.0, {'EUR': 0.8})
+        seq = table._slots['a'][0]
+        seq[0] += 1
+        assert table.read('a', lambda rates: rates[0]) is None
+        table.publish('a', 2.0, {'EUR': 0.9})
+        assert table.to_dict('a')[1]['EUR'] == 0.9
+
+    def test_file_shared_between_instances(self, tmp_path):
+        path = str(tmp_path / "rates.table")
+        writer, reader = RateTable(['a'], path), RateTable(['a'], path)
+        try:
+            writer.publish('a', 5.0, {'EUR': 0.8})
+            assert reader.to_dict('a') == (5.0, {'USD': 1.0, 'EUR': 0.8})
+        finally:
+            writer.close()
+            reader.close()
+
+    def test_file_per_layout(self, tmp_path):
+        path = str(tmp_path / "rates.table")
+        old = RateTable(['a'], path, codes=['USD', 'EUR'])
+        new = RateTable(['a', 'b'], path, codes=['USD', 'EUR'])
+        try:
+            # Другая раскладка — другой файл: старый не урезается под живым mmap
+            assert old.path != new.path
+            old.publish('a', 5.0, {'EUR': 0.8})
+            assert new.timestamp('a') == 0.0
+            assert old.to_dict('a') == (5.0, {'USD': 1.0, 'EUR': 0.8})
+        finally:
+            old.close()
+            new.close()
+
+    def test_corrupt_file_not_touched(self, tmp_path):
+        path = str(tmp_path / "rates.table")
+        probe = RateTable(['a'], path, codes=['USD', 'EUR'])
+        file_path = probe.path
+        probe.close()
+        with open(file_path, 'wb') as f:
+            f.write(b'garbage')
+        table = RateTable(['a'], path, codes=['USD', 'EUR'])
+        try:
+            assert table.path is None
+            assert table.publish('a', 1.0, {'EUR': 0.8})
+            with open(file_path, 'rb') as f:
+                assert f.read() == b'garbage'
+        finally:
+            table.close()
+
+RATES = [1.0, 0.8, 80.0, float('nan'), 0.0]
+CODE_INDEX = {'USD': 0, 'EUR': 1, 'RUB': 2, 'BTC': 3, 'ZZZ': 4}
+
+
+def _nan_to_none(values):
+    return [None if v != v else pytest.approx(v) for v in values]
+
+
+class TestConvertBatch:
+    @pytest.fixture(params=[False, True], ids=['array', 'numpy'])
+    def use_numpy(self, request):
+        if request.param:
+            pytest.importorskip('numpy')
+        return request.param
+
+    def test_one_amount_many_targets(self, use_numpy):
+        result = convert_batch(RATES, [10], ['EUR'], ['USD', 'RUB', 'BTC', 'XXX'], CODE_INDEX, use_numpy)
+        assert _nan_to_none(result) == [12.5, 1000.0, None, None]
+
+    def test_many_pairs(self, use_numpy):
+        result = convert_batch(RATES, [1, 2, 3, 4], ['USD', 'RUB', 'ZZZ', 'XXX'],
+                               ['EUR', 'USD', 'USD', 'USD'], CODE_INDEX, use_numpy)
+        # Нулевой курс или неизвестный код источника — NaN, а не деление на ноль
+        assert _nan_to_none(result) == [0.8, 0.025, None, None]
+
+    def test_broadcast_target(self, use_numpy):
+        result = convert_batch(RATES, [1, 80], ['USD', 'RUB'], ['EUR'], CODE_INDEX, use_numpy)
+        assert _nan_to_none(result) == [0.8, 0.8]
+
+    def test_overlay(self, use_numpy):
+        # Курсы overlay (крипта) важнее основного вектора, NaN в overlay — берём основной
+        overlay = [1.0, float('nan'), float('nan'), 0.00002, float('nan')]
+        result = convert_batch(RATES, [10, 1], ['EUR', 'BTC'], ['BTC', 'RUB'], CODE_INDEX, use_numpy,
+                               overlay=overlay)
+        assert _nan_to_none(result) == [0.00025, 4000000.0]
+
+    def test_empty_and_mismatch(self):
+        assert len(convert_batch(RATES, [1], ['USD'], [], CODE_INDEX)) == 0
+        assert batch_length([1], [1, 2], [3, 4]) == 2
+        with pytest.raises(ValueError):
+            convert_batch(RATES, [1, 2], ['USD'] * 3, ['EUR'], CODE_INDEX)
+
+    def test_reads_table_view(self, table):
+        table.publish('a', 1.0, {'EUR': 0.8, 'RUB': 80.0})
+        _, result = table.read('a', lambda rates: convert_batch(rates, [10], ['EUR'], ['RUB']))
+        assert _nan_to_none(result) == [1000.0]
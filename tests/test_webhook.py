@@ -0,0 +1,67 @@
+"""Тесты для webhook-режима (create_webhook_app)."""
+
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+
+from bot import create_webhook_app
+
+UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1, 'date': 0, 'text': 'hi',
+        'chat': {'id': 5, 'type': 'private'},
+        'from': {'id': 5, 'is_bot': False, 'first_name': 'test'},
+    },
+}
+
+
+async def _client(received):
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handler(message: Message):
+        received.append(message.text)
+
+    app = create_webhook_app(dp, Bot('123:test'), path='/hook', secret='s3cret')
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+class TestWebhookApp:
+    async def test_rejects_wrong_secret(self):
+        received = []
+        client = await _client(received)
+        try:
+            for headers in ({}, {'X-Telegram-Bot-Api-Secret-Token': 'wrong'}):
+                resp = await client.post('/hook', json=UPDATE, headers=headers)
+                assert resp.status == 401
+            await asyncio.sleep(0)
+            assert received == []
+        finally:
+            await client.close()
+
+    async def test_dispatches_update(self):
+        received = []
+        client = await _client(received)
+        try:
+            resp = await client.post('/hook', json=UPDATE, headers={'X-Telegram-Bot-Api-Secret-Token': 's3cret'})
+            assert resp.status == 200
+            for _ in range(50):
+                if received:
+                    break
+                await asyncio.sleep(0.01)
+            assert received == ['hi']
+        finally:
+            await client.close()
+
+    async def test_other_path_not_found(self):
+        client = await _client([])
+        try:
+            resp = await client.post('/webhook', json=UPDATE, headers={'X-Telegram-Bot-Api-Secret-Token': 's3cret'})
+            assert resp.status == 404
+        finally:
+            await client.close()